@@ -0,0 +1,96 @@
+"""
+Сравнение JSON API с HTML-страницами тех же лент.
+
+Запуск: python -m benchmarks.api_vs_html [--posts 2000] [--requests 200]
+
+Данные создаются во временной тестовой базе, кэш на время замера
+отключается (DummyCache), чтобы HTML-страницы каждый раз рендерились,
+как у клиента, который их скрапит. Для каждой пары печатаются медиана
+времени ответа, число SQL-запросов и размер ответа до и после gzip.
+"""
+import argparse
+import gzip
+import os
+import statistics
+import time
+
+
+def measure(client, url, count):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        timings.append(time.perf_counter() - started)
+    content = response.content
+    return {
+        'ms': statistics.median(timings) * 1000,
+        'queries': len(queries),
+        'bytes': len(content),
+        'gzip': len(gzip.compress(content)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    from django.test import Client, override_settings
+    from django.urls import reverse
+
+    from benchmarks.dataset import seed, temporary_database
+
+    dummy = {'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+    }}
+    with override_settings(CACHES=dummy), temporary_database():
+        objects = seed(posts=args.posts)
+        author, group = objects['author'], objects['group']
+        # Адрес вне INTERNAL_IPS, чтобы debug toolbar не попал в HTML.
+        client = Client(REMOTE_ADDR='10.0.0.1')
+        client.force_login(objects['reader'])
+        pairs = (
+            ('index', reverse('index'), reverse('api_index')),
+            (
+                'group',
+                reverse('group', args=[group.slug]),
+                reverse('api_group', args=[group.slug]),
+            ),
+            (
+                'profile',
+                reverse('profile', args=[author.username]),
+                reverse('api_profile', args=[author.username]),
+            ),
+            (
+                'follow',
+                reverse('follow_index'),
+                reverse('api_follow_index'),
+            ),
+        )
+        print('%-10s%-6s%10s%10s%10s%10s' % (
+            'лента', '', 'мс', 'запросов', 'байт', 'gzip'
+        ))
+        for name, html_url, api_url in pairs:
+            for kind, url in (('html', html_url), ('api', api_url)):
+                result = measure(client, url, args.requests)
+                print('%-10s%-6s%10.2f%10d%10d%10d' % (
+                    name,
+                    kind,
+                    result['ms'],
+                    result['queries'],
+                    result['bytes'],
+                    result['gzip'],
+                ))
+
+
+if __name__ == '__main__':
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+    django.setup()
+    main()
@@ -0,0 +1,126 @@
+"""
+Сравнение SQLiteCache с LocMemCache.
+
+Запуск: python -m benchmarks.cache_backends [--operations 20000]
+
+Для каждого бэкенда меряется число операций в секунду на get, set,
+get_many, set_many и incr в одном процессе, а затем incr из нескольких
+процессов: LocMemCache у каждого процесса свой, поэтому итоговое
+значение счётчика у него не сходится.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from django.core.cache.backends.locmem import LocMemCache
+
+from yatube.sqlite_cache import SQLiteCache
+
+
+def measure(operation, count):
+    started = time.perf_counter()
+    operation(count)
+    return count / (time.perf_counter() - started)
+
+
+def run_single_process(cache, count):
+    keys = [f'key_{i}' for i in range(100)]
+    payload = 'x' * 2048
+    cache.set_many({key: payload for key in keys})
+    cache.set('counter', 0)
+    return {
+        'get': measure(
+            lambda n: [cache.get(keys[i % 100]) for i in range(n)],
+            count
+        ),
+        'set': measure(
+            lambda n: [cache.set(keys[i % 100], payload) for i in range(n)],
+            count
+        ),
+        'get_many(10)': measure(
+            lambda n: [
+                cache.get_many(keys[i % 90:i % 90 + 10])
+                for i in range(n)
+            ],
+            count // 10
+        ),
+        'set_many(10)': measure(
+            lambda n: [
+                cache.set_many({key: payload for key in keys[:10]})
+                for i in range(n)
+            ],
+            count // 10
+        ),
+        'incr': measure(
+            lambda n: [cache.incr('counter') for i in range(n)],
+            count
+        ),
+    }
+
+
+def incr_worker(make_cache, times):
+    cache = make_cache()
+    for _ in range(times):
+        cache.incr('counter')
+    return cache.get('counter')
+
+
+def run_multi_process(make_cache, workers, times):
+    cache = make_cache()
+    cache.set('counter', 0)
+    context = multiprocessing.get_context('fork')
+    started = time.perf_counter()
+    with context.Pool(workers) as pool:
+        pool.starmap(incr_worker, [(make_cache, times)] * workers)
+    elapsed = time.perf_counter() - started
+    return workers * times / elapsed, cache.get('counter')
+
+
+class MakeLocMem:
+    def __call__(self):
+        return LocMemCache('benchmark', {})
+
+
+class MakeSQLite:
+    def __init__(self, location):
+        self.location = location
+
+    def __call__(self):
+        return SQLiteCache(self.location, {})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--operations', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    backends = {
+        'LocMemCache': MakeLocMem(),
+        'SQLiteCache': MakeSQLite(os.path.join(directory, 'cache.sqlite3')),
+    }
+    results = {
+        name: run_single_process(make_cache(), args.operations)
+        for name, make_cache in backends.items()
+    }
+    print('%-14s' % 'ops/s' + ''.join('%16s' % name for name in backends))
+    for operation in results['LocMemCache']:
+        print('%-14s' % operation + ''.join(
+            '%16.0f' % results[name][operation] for name in backends
+        ))
+    expected = args.workers * 1000
+    print(f'\nincr из {args.workers} процессов, ожидается {expected}:')
+    for name, make_cache in backends.items():
+        rate, value = run_multi_process(make_cache, args.workers, 1000)
+        print('%-14s%16.0f ops/s, счётчик = %s' % (name, rate, value))
+
+
+if __name__ == '__main__':
+    import django
+    from django.conf import settings
+
+    settings.configure()
+    django.setup()
+    main()
@@ -0,0 +1,197 @@
+"""
+Смешанная нагрузка читателей и писателей на файловую SQLite-базу.
+
+Запуск: python -m benchmarks.concurrency [--readers 8] [--writers 4]
+        [--seconds 10]
+
+Потоки-читатели анонимно открывают главную, профиль и запись, потоки-
+писатели публикуют записи, комментируют и подписываются. Замер идёт в
+трёх режимах: настройки SQLite по умолчанию, PRAGMA из settings с
+BEGIN IMMEDIATE и они же с сериализацией записи в процессе. Для каждого
+режима печатаются запросы в секунду, p99 времени ответа и число ошибок
+"database is locked".
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+MODES = ('default', 'pragmas', 'serialized')
+
+
+def mode_options(mode, tuned):
+    if mode == 'default':
+        # journal_mode сохраняется в файле, поэтому возвращается явно.
+        return {'pragmas': {'journal_mode': 'DELETE'}}
+    return tuned
+
+
+def reader(client, urls, deadline, stats):
+    while time.perf_counter() < deadline:
+        stats.call(client.get, random.choice(urls), read=True)
+
+
+def writer(client, objects, deadline, stats):
+    from django.urls import reverse
+
+    post = objects['post']
+    author = objects['author']
+    actions = (
+        lambda: client.post(reverse('new_post'), {'text': 'Нагрузка'}),
+        lambda: client.post(
+            reverse('add_comment', args=[author.username, post.id]),
+            {'text': 'Комментарий под нагрузкой'}
+        ),
+        lambda: client.get(
+            reverse('profile_follow', args=[author.username])
+        ),
+        lambda: client.get(
+            reverse('profile_unfollow', args=[author.username])
+        ),
+    )
+    while time.perf_counter() < deadline:
+        stats.call(random.choice(actions), read=False)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {True: [], False: []}
+        self.errors = 0
+
+    def call(self, function, *args, read):
+        from django.db import OperationalError
+
+        started = time.perf_counter()
+        try:
+            response = function(*args)
+            failed = response.status_code >= 500
+        except OperationalError:
+            failed = True
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            if failed:
+                self.errors += 1
+            else:
+                self.timings[read].append(elapsed)
+
+
+def run_mode(mode, tuned, objects, args):
+    from django.conf import settings
+    from django.db import connection, connections
+    from django.test import Client, override_settings
+    from django.urls import reverse
+
+    connection.settings_dict['OPTIONS'] = mode_options(mode, tuned)
+    connection.close()
+    connections.close_all()
+    urls = [
+        reverse('index'),
+        reverse('profile', args=[objects['author'].username]),
+        reverse('post', args=[objects['author'].username,
+                              objects['post'].id]),
+    ]
+    stats = Stats()
+    deadline = time.perf_counter() + args.seconds
+    threads = []
+
+    def target(function, *function_args):
+        try:
+            function(*function_args)
+        finally:
+            connections.close_all()
+
+    with override_settings(
+        DATABASE_SERIALIZE_WRITES=mode == 'serialized',
+        DATABASE_WRITE_RETRIES=(
+            0 if mode == 'default' else settings.DATABASE_WRITE_RETRIES
+        )
+    ):
+        for _ in range(args.readers):
+            client = Client(REMOTE_ADDR='10.0.0.1')
+            threads.append(threading.Thread(
+                target=target,
+                args=(reader, client, urls, deadline, stats)
+            ))
+        for number in range(args.writers):
+            client = Client(REMOTE_ADDR='10.0.0.1')
+            client.force_login(objects['writers'][number])
+            threads.append(threading.Thread(
+                target=target,
+                args=(writer, client, objects, deadline, stats)
+            ))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return stats
+
+
+def p99(timings):
+    if len(timings) < 2:
+        return 0
+    return statistics.quantiles(timings, n=100)[98] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--only', nargs='*', choices=MODES)
+    args = parser.parse_args()
+
+    import logging
+
+    from django.db import connection
+    from django.test import override_settings
+
+    from benchmarks.dataset import seed, temporary_database
+    from posts.models import User
+
+    # Ошибки под нагрузкой считаются, а не печатаются трассировками.
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    tuned = dict(connection.settings_dict['OPTIONS'])
+    dummy = {'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+    }}
+    directory = tempfile.mkdtemp()
+    # Файл, а не база в памяти: WAL и блокировки есть только у файла.
+    connection.settings_dict['TEST']['NAME'] = os.path.join(
+        directory, 'concurrency.sqlite3'
+    )
+    print('%-12s%10s%10s%14s%14s%10s' % (
+        'режим', 'чтений/с', 'записей/с', 'p99 чтения', 'p99 записи',
+        'ошибок'
+    ))
+    with override_settings(CACHES=dummy), temporary_database():
+        objects = seed(posts=args.posts)
+        objects['writers'] = list(
+            User.objects.exclude(pk=objects['author'].pk)[:args.writers]
+        )
+        for mode in MODES:
+            if args.only and mode not in args.only:
+                continue
+            stats = run_mode(mode, tuned, objects, args)
+            print('%-12s%10.1f%10.1f%12.1fмс%12.1fмс%10d' % (
+                mode,
+                len(stats.timings[True]) / args.seconds,
+                len(stats.timings[False]) / args.seconds,
+                p99(stats.timings[True]),
+                p99(stats.timings[False]),
+                stats.errors,
+            ))
+        connection.settings_dict['OPTIONS'] = tuned
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+    django.setup()
+    main()
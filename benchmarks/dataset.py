@@ -0,0 +1,82 @@
+"""
+Общие для замеров данные: временная тестовая база и детерминированный
+набор пользователей, групп, записей, комментариев и подписок.
+"""
+import random
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+
+@contextmanager
+def temporary_database():
+    from django.db import connection
+    from django.test.utils import (setup_test_environment,
+                                   teardown_test_environment)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def records(users, groups, posts, seed):
+    """Записи для posts.importer: одинаковый seed - одинаковые данные."""
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    for number in range(users):
+        yield {'type': 'user', 'id': number, 'username': f'user{number}'}
+    for number in range(groups):
+        yield {
+            'type': 'group',
+            'id': number,
+            'title': f'Группа {number}',
+            'slug': f'group{number}',
+        }
+    for number in range(1, users):
+        yield {'type': 'follow', 'user': number, 'author': 0}
+        for author in rng.sample(range(users), min(10, users)):
+            yield {'type': 'follow', 'user': number, 'author': author}
+    for number in range(posts):
+        yield {
+            'type': 'post',
+            'id': number,
+            'author': number % users,
+            'group': rng.randrange(groups) if rng.random() < 0.5 else None,
+            'text': ' '.join(
+                rng.choice(('лето', 'море', 'город', 'книга', 'кот'))
+                for _ in range(rng.randint(5, 60))
+            ),
+            'pub_date': (start + timedelta(minutes=number)).isoformat(),
+        }
+        for comment in range(int(rng.paretovariate(1.5)) - 1):
+            yield {
+                'type': 'comment',
+                'post': number,
+                'author': rng.randrange(users),
+                'text': 'Комментарий',
+                'created': (
+                    start + timedelta(minutes=number, seconds=comment + 1)
+                ).isoformat(),
+            }
+
+
+def seed(users=50, groups=5, posts=2000, seed=0):
+    """
+    Заливает набор через Importer и возвращает по объекту каждого вида.
+
+    user0 - самый популярный автор: на него подписаны все остальные.
+    """
+    from posts.importer import Importer
+    from posts.models import Group, Post, User
+
+    Importer().run(records(users, groups, posts, seed))
+    author = User.objects.get(username='user0')
+    return {
+        'reader': User.objects.get(username='user1'),
+        'author': author,
+        'group': Group.objects.get(slug='group0'),
+        'post': Post.objects.filter(author=author).latest('pub_date'),
+    }
@@ -0,0 +1,210 @@
+"""
+Замер каждого адреса из posts/urls.py на одном и том же наборе данных.
+
+Запуск:
+    python -m benchmarks.views --output baseline.json
+    python -m benchmarks.views --compare baseline.json
+
+Для каждого адреса анонимом и вошедшим пользователем меряются p50, p90
+и p99 времени ответа, число SQL-запросов и размер ответа. Кэш по
+умолчанию выключен (DummyCache), чтобы мерить рендеринг, а не попадание
+в кэш; с --warm-cache используется LocMemCache. В режиме --compare
+результат сверяется с сохранённым, и при регрессии команда завершается
+с кодом 1.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+CACHES = {
+    'cold': {'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+    }},
+    'warm': {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }},
+}
+# Во сколько раз может вырасти p50 и размер ответа, прежде чем это
+# считается регрессией; число запросов сравнивается точно. Рост p50
+# меньше LATENCY_FLOOR_MS - шум и регрессией не считается.
+LATENCY_TOLERANCE = 1.2
+LATENCY_FLOOR_MS = 1.0
+BYTES_TOLERANCE = 1.1
+QUERY_STRINGS = {
+    'search': 'q=лето',
+}
+
+
+def url_kwargs(pattern, objects):
+    values = {
+        'username': objects['author'].username,
+        'post_id': objects['post'].id,
+        'slug': objects['group'].slug,
+    }
+    return {name: values[name] for name in pattern.pattern.converters}
+
+
+def post_urls(objects):
+    from django.urls import reverse
+
+    from posts.urls import urlpatterns
+
+    urls = {}
+    for pattern in urlpatterns:
+        url = reverse(pattern.name, kwargs=url_kwargs(pattern, objects))
+        if pattern.name in QUERY_STRINGS:
+            url += '?' + QUERY_STRINGS[pattern.name]
+        urls[pattern.name] = url
+    return urls
+
+
+def percentile(timings, point):
+    return statistics.quantiles(timings, n=100)[point - 1] * 1000
+
+
+def measure(client, url, count):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    client.get(url)
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+            content = b''.join(response) if response.streaming else (
+                response.content
+            )
+        timings.append(time.perf_counter() - started)
+    return {
+        'status': response.status_code,
+        'p50': percentile(timings, 50),
+        'p90': percentile(timings, 90),
+        'p99': percentile(timings, 99),
+        'queries': len(queries),
+        'bytes': len(content),
+    }
+
+
+def run(args):
+    from django.test import Client, override_settings
+
+    from benchmarks.dataset import seed, temporary_database
+
+    results = {}
+    with override_settings(CACHES=CACHES[args.cache]), temporary_database():
+        objects = seed(posts=args.posts, seed=args.seed)
+        # Адреса идут в порядке urls.py, поэтому подписка и отписка
+        # каждый раз меняют состояние одинаково и замеры повторяемы.
+        urls = post_urls(objects)
+        # Адрес вне INTERNAL_IPS, чтобы debug toolbar не попал в HTML.
+        anonymous = Client(REMOTE_ADDR='10.0.0.1')
+        logged_in = Client(REMOTE_ADDR='10.0.0.1')
+        logged_in.force_login(objects['reader'])
+        for name, url in urls.items():
+            if args.only and name not in args.only:
+                continue
+            for role, client in (('anon', anonymous), ('auth', logged_in)):
+                results[f'{name}:{role}'] = measure(client, url, args.requests)
+    return {
+        'meta': {
+            'posts': args.posts,
+            'seed': args.seed,
+            'requests': args.requests,
+            'cache': args.cache,
+        },
+        'results': results,
+    }
+
+
+def regressions(baseline, current):
+    found = []
+    for key, now in current['results'].items():
+        before = baseline['results'].get(key)
+        if before is None:
+            continue
+        if (
+            now['p50'] > before['p50'] * LATENCY_TOLERANCE
+            and now['p50'] - before['p50'] > LATENCY_FLOOR_MS
+        ):
+            found.append(
+                f'{key}: p50 {before["p50"]:.2f} -> {now["p50"]:.2f} мс'
+            )
+        if now['queries'] > before['queries']:
+            found.append(
+                f'{key}: запросов {before["queries"]} -> {now["queries"]}'
+            )
+        if now['bytes'] > before['bytes'] * BYTES_TOLERANCE:
+            found.append(f'{key}: байт {before["bytes"]} -> {now["bytes"]}')
+    return found
+
+
+def print_table(report):
+    print('%-28s%7s%10s%10s%10s%10s%10s' % (
+        'адрес', 'код', 'p50 мс', 'p90 мс', 'p99 мс', 'запросов', 'байт'
+    ))
+    for key, result in report['results'].items():
+        print('%-28s%7d%10.2f%10.2f%10.2f%10d%10d' % (
+            key,
+            result['status'],
+            result['p50'],
+            result['p90'],
+            result['p99'],
+            result['queries'],
+            result['bytes'],
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--requests',
+        type=int,
+        default=50,
+        help='Запросов на адрес, не меньше 2'
+    )
+    parser.add_argument(
+        '--warm-cache',
+        dest='cache',
+        action='store_const',
+        const='warm',
+        default='cold'
+    )
+    parser.add_argument('--only', nargs='*', help='Имена адресов из urls.py')
+    parser.add_argument('--output', help='Сохранить результат в JSON')
+    parser.add_argument('--compare', help='JSON с базовым результатом')
+    args = parser.parse_args()
+    # 401 и 404 - ожидаемые ответы, их предупреждения только мешают.
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as source:
+            baseline = json.load(source)
+        for option in ('posts', 'seed', 'cache'):
+            setattr(args, option, baseline['meta'][option])
+    report = run(args)
+    print_table(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as target:
+            json.dump(report, target, ensure_ascii=False, indent=2)
+    if baseline is not None:
+        found = regressions(baseline, report)
+        for line in found:
+            print('РЕГРЕССИЯ', line)
+        if found:
+            sys.exit(1)
+        print('Регрессий нет')
+
+
+if __name__ == '__main__':
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+    django.setup()
+    main()
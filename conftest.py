@@ -0,0 +1,9 @@
+import pytest
+
+from yatube.runner import isolated_settings
+
+
+@pytest.fixture(autouse=True, scope='session')
+def isolated_test_settings():
+    with isolated_settings():
+        yield
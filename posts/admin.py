@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import Comment, Follow, Group, Post
+from .search import filter_matching
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -11,12 +12,18 @@ class PostAdmin(admin.ModelAdmin):
         'pub_date',
         'author',
         'group',
-        'image'
+        'image',
+        'comments_count'
     )
     search_fields = ('text',)
     list_filter = ('pub_date', 'group',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return filter_matching(queryset, search_term), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = (
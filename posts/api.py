@@ -0,0 +1,190 @@
+"""
+JSON API только для чтения, версия 1.
+
+Строки собираются из values(), без экземпляров моделей, и пишутся
+короткими ключами в постоянном порядке, чтобы ответ хорошо жался gzip:
+
+    i - id, a - автор, g - группа, d - дата, t - текст,
+    m - картинка, c - число комментариев.
+
+Страница - {"items": [...], "next": курсор, "prev": курсор}, каждая
+стоит одного запроса с LIMIT, автор и группа приходят в нём же. С
+шардами лента - запрос с LIMIT в каждый шард, а авторы и группы
+подставляются из default (в шардах лежат их копии).
+"""
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+
+from .models import Comment, FeedEntry, Group, Post, User
+from .paginators import POSTS_PER_PAGE, CursorPaginator
+from .sharding import (followed_posts, is_sharded, scatter,
+                       shard_for_post)
+
+API_MAX_LIMIT = getattr(settings, 'API_MAX_LIMIT', 100)
+POST_FIELDS = (
+    'id',
+    'author__username',
+    'group__slug',
+    'pub_date',
+    'text',
+    'image',
+    'comments_count',
+)
+COMMENT_FIELDS = ('id', 'author__username', 'created', 'text')
+
+
+def api_response(data, status=200):
+    return JsonResponse(
+        data,
+        status=status,
+        json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False}
+    )
+
+
+def api_error(message, status):
+    return api_response({'error': message}, status=status)
+
+
+def post_values(queryset, prefix=''):
+    fields = [prefix + field for field in POST_FIELDS]
+    if prefix:
+        fields += ['id', 'pub_date']
+    return queryset.values(*fields)
+
+
+def post_row(row, prefix=''):
+    image = row[prefix + 'image']
+    return {
+        'i': row[prefix + 'id'],
+        'a': row[prefix + 'author__username'],
+        'g': row[prefix + 'group__slug'],
+        'd': row[prefix + 'pub_date'],
+        't': row[prefix + 'text'],
+        'm': default_storage.url(image) if image else None,
+        'c': row[prefix + 'comments_count'],
+    }
+
+
+def post_object_row(post):
+    return {
+        'i': post.pk,
+        'a': post.author.username,
+        'g': post.group.slug if post.group else None,
+        'd': post.pub_date,
+        't': post.text,
+        'm': default_storage.url(post.image.name) if post.image else None,
+        'c': post.comments_count,
+    }
+
+
+def comment_row(row):
+    return {
+        'i': row['id'],
+        'a': row['author__username'],
+        'd': row['created'],
+        't': row['text'],
+    }
+
+
+def page_limit(request):
+    try:
+        limit = int(request.GET.get('limit', POSTS_PER_PAGE))
+    except ValueError:
+        limit = POSTS_PER_PAGE
+    return min(max(limit, 1), API_MAX_LIMIT)
+
+
+def cursor_page(request, rows, serialize, date_field='pub_date'):
+    paginator = CursorPaginator(rows, page_limit(request), date_field)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return {
+        'items': [serialize(row) for row in page],
+        'next': page.next_cursor,
+        'prev': page.previous_cursor,
+    }
+
+
+def post_list(request, posts, owner=None, not_found=''):
+    """
+    Лента записей. Владелец ленты (owner - queryset) проверяется
+    отдельным запросом только на пустой первой странице, чтобы отличить
+    пустую ленту от несуществующей.
+    """
+    data = cursor_page(request, post_values(posts), post_row)
+    if owner is not None and not data['items'] and not data['prev']:
+        if not owner.exists():
+            return api_error(not_found, 404)
+    return api_response(data)
+
+
+def sharded_post_list(request, posts):
+    return api_response(cursor_page(request, posts, post_object_row))
+
+
+def index(request):
+    if is_sharded():
+        return sharded_post_list(request, scatter(Post.objects.all()))
+    return post_list(request, Post.objects.all())
+
+
+def group_posts(request, slug):
+    if is_sharded():
+        group = Group.objects.filter(slug=slug).first()
+        if group is None:
+            return api_error('Группа не найдена', 404)
+        return sharded_post_list(
+            request,
+            scatter(Post.objects.filter(group_id=group.pk))
+        )
+    return post_list(
+        request,
+        Post.objects.filter(group__slug=slug),
+        Group.objects.filter(slug=slug),
+        'Группа не найдена'
+    )
+
+
+def profile(request, username):
+    if is_sharded():
+        author = User.objects.filter(username=username).first()
+        if author is None:
+            return api_error('Пользователь не найден', 404)
+        return sharded_post_list(
+            request,
+            scatter(Post.objects.filter(author_id=author.pk))
+        )
+    return post_list(
+        request,
+        Post.objects.filter(author__username=username),
+        User.objects.filter(username=username),
+        'Пользователь не найден'
+    )
+
+
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return api_error('Нужно войти', 401)
+    if is_sharded():
+        # FeedEntry с шардами не заполняется.
+        return sharded_post_list(request, followed_posts(request.user))
+    entries = FeedEntry.objects.filter(user=request.user)
+    return api_response(cursor_page(
+        request,
+        post_values(entries, prefix='post__'),
+        lambda row: post_row(row, prefix='post__')
+    ))
+
+
+def post(request, post_id):
+    alias = shard_for_post(post_id)
+    row = post_values(Post.objects.using(alias).filter(pk=post_id)).first()
+    if row is None:
+        return api_error('Запись не найдена', 404)
+    comments = Comment.objects.using(alias).filter(post_id=post_id).values(
+        *COMMENT_FIELDS
+    )
+    return api_response({
+        'post': post_row(row),
+        'comments': cursor_page(request, comments, comment_row, 'created'),
+    })
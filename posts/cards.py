@@ -0,0 +1,95 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .page_cache import (PENDING_CACHE_TIMEOUT, PENDING_MARKER,
+                         get_generations)
+from .thumbnails import prefetch_thumbnails
+
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+EDIT_LINK_MARKER = '<!-- post-edit-link -->'
+
+
+class Card:
+    def __init__(self, html):
+        head, _, tail = html.partition(EDIT_LINK_MARKER)
+        self.head = mark_safe(head)
+        self.tail = mark_safe(tail)
+
+
+def author_card_scope(author_id):
+    return f'card:author:{author_id}'
+
+
+def group_card_scope(group_id):
+    return f'card:group:{group_id}'
+
+
+def card_scopes(post):
+    scopes = [author_card_scope(post.author_id)]
+    if post.group_id is not None:
+        scopes.append(group_card_scope(post.group_id))
+    return scopes
+
+
+def card_cache_key(post, generations):
+    """
+    Ключ карточки: версия записи, число комментариев и поколения автора
+    и группы из generations. Переименование автора или группы меняет
+    их поколение, а сами записи не трогает.
+    """
+    version = int(post.edited.timestamp() * 1000000)
+    names = ':'.join(str(generations[scope]) for scope in card_scopes(post))
+    return f'post_card:{post.id}:{version}:{post.comments_count}:{names}'
+
+
+def card_timeout(html):
+    # Карточку с заглушкой миниатюры перерисуем, когда та будет готова.
+    if PENDING_MARKER in html:
+        return PENDING_CACHE_TIMEOUT
+    return CARD_CACHE_TIMEOUT
+
+
+def render_card(post):
+    return render_to_string('posts/includes/post_card.html', {'post': post})
+
+
+def prefetch_cards(posts):
+    """
+    Достаёт готовые карточки всех записей одним get_many, перед этим
+    одним get_many читаются поколения их авторов и групп.
+
+    Недостающие карточки рендерятся и кладутся в кэш одним set_many,
+    миниатюры для них перед этим ищутся одним запросом. Карточки с
+    заглушкой вместо миниатюры живут в кэше недолго.
+    """
+    posts = list(posts)
+    generations = get_generations({
+        scope for post in posts for scope in card_scopes(post)
+    })
+    keys = {card_cache_key(post, generations): post for post in posts}
+    cached = cache.get_many(keys)
+    for key, html in cached.items():
+        keys[key]._card_html = html
+    missing = [key for key in keys if key not in cached]
+    prefetch_thumbnails(keys[key] for key in missing)
+    missing = {key: render_card(keys[key]) for key in missing}
+    for key, html in missing.items():
+        keys[key]._card_html = html
+    by_timeout = {}
+    for key, html in missing.items():
+        by_timeout.setdefault(card_timeout(html), {})[key] = html
+    for timeout, cards in by_timeout.items():
+        cache.set_many(cards, timeout)
+
+
+def get_card(post):
+    html = getattr(post, '_card_html', None)
+    if html is None:
+        key = card_cache_key(post, get_generations(card_scopes(post)))
+        html = cache.get(key)
+        if html is None:
+            html = render_card(post)
+            cache.set(key, html, card_timeout(html))
+        post._card_html = html
+    return Card(html)
@@ -0,0 +1,126 @@
+from collections import Counter
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import sharding
+from .models import AuthorStats, Comment, Follow, Post, User
+
+
+def count_of(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('pk')).values('total')
+        ),
+        0
+    )
+
+
+def id_batches(queryset, batch_size):
+    last_id = 0
+    while True:
+        ids = list(
+            queryset.filter(pk__gt=last_id).order_by('pk').values_list(
+                'pk',
+                flat=True
+            )[:batch_size]
+        )
+        if not ids:
+            return
+        last_id = ids[-1]
+        yield ids
+
+
+def change_comments_count(post_id, delta, using=None):
+    posts = Post.objects.using(using).filter(pk=post_id)
+    if delta < 0:
+        posts = posts.filter(comments_count__gte=-delta)
+    posts.update(comments_count=F('comments_count') + delta)
+
+
+def real_comments_count():
+    return count_of(Comment, 'post')
+
+
+def recount_comments(batch_size=1000):
+    """
+    Пересчитывает comments_count пачками по id в каждом шарде (там же
+    лежат и комментарии записей), возвращает число правок.
+    """
+    fixed = 0
+    for alias in sharding.shard_aliases():
+        posts = Post.objects.using(alias)
+        for ids in id_batches(posts, batch_size):
+            drifted = posts.filter(id__in=ids).annotate(
+                real_count=real_comments_count()
+            ).exclude(comments_count=F('real_count'))
+            fixed += posts.filter(
+                id__in=list(drifted.values_list('id', flat=True))
+            ).update(comments_count=real_comments_count())
+    return fixed
+
+
+def change_author_stats(user_id, **deltas):
+    stats = AuthorStats.objects.filter(pk=user_id)
+    for field, delta in deltas.items():
+        if delta < 0:
+            stats = stats.filter(**{f'{field}__gte': -delta})
+    stats.update(**{
+        field: F(field) + delta for field, delta in deltas.items()
+    })
+
+
+def real_posts_counts(user_ids):
+    """{id автора: число записей}, сложенное по всем шардам."""
+    counts = Counter()
+    for alias in sharding.shard_aliases():
+        counts.update(dict(
+            Post.objects.using(alias).filter(
+                author_id__in=user_ids
+            ).order_by().values_list('author_id').annotate(
+                total=Count('pk')
+            ).values_list('author_id', 'total')
+        ))
+    return counts
+
+
+def real_author_stats(user_ids):
+    posts = real_posts_counts(user_ids)
+    return [
+        (pk, followers, following, posts[pk])
+        for pk, followers, following in User.objects.filter(
+            pk__in=user_ids
+        ).annotate(
+            real_followers=count_of(Follow, 'author'),
+            real_following=count_of(Follow, 'user'),
+        ).values_list('pk', 'real_followers', 'real_following')
+    ]
+
+
+def rebuild_author_stats(batch_size=1000, dry_run=False):
+    """
+    Сверяет AuthorStats с исходными таблицами и чинит расхождения.
+
+    Возвращает число пользователей, у которых статистика отличалась
+    или отсутствовала.
+    """
+    fields = ('followers_count', 'following_count', 'posts_count')
+    fixed = 0
+    for ids in id_batches(User.objects.all(), batch_size):
+        existing = AuthorStats.objects.in_bulk(ids)
+        missing = []
+        drifted = []
+        for pk, *values in real_author_stats(ids):
+            stats = AuthorStats(pk, *values)
+            current = existing.get(pk)
+            if current is None:
+                missing.append(stats)
+            elif any(getattr(current, f) != getattr(stats, f) for f in fields):
+                drifted.append(stats)
+        fixed += len(missing) + len(drifted)
+        if not dry_run:
+            AuthorStats.objects.bulk_create(missing)
+            AuthorStats.objects.bulk_update(drifted, fields)
+    return fixed
@@ -0,0 +1,149 @@
+import csv
+import heapq
+import json
+import zipfile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .models import Comment, Post
+from .sharding import shard_aliases, shard_for_author
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+EXPORT_FORMATS = {
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'csv': ('text/csv', 'csv'),
+    'zip': ('application/zip', 'zip'),
+}
+CSV_FIELDS = ('type', 'id', 'post', 'group', 'text', 'date', 'image')
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+
+def export_rows(author, after_post=0, after_comment=0):
+    """
+    Отдаёт записи, а затем комментарии автора по возрастанию id.
+
+    Каждая строка содержит type и id, поэтому прерванную выгрузку можно
+    продолжить, передав последние полученные id в after_post и
+    after_comment.
+    """
+    posts = Post.objects.using(shard_for_author(author.pk)).filter(
+        author=author,
+        pk__gt=after_post
+    ).order_by('pk').values_list('pk', 'group__slug', 'text', 'pub_date',
+                                 'image')
+    for pk, group, text, pub_date, image in posts.iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    ):
+        yield {
+            'type': 'post',
+            'id': pk,
+            'group': group,
+            'text': text,
+            'date': pub_date.isoformat(),
+            'image': image or None,
+        }
+    # Комментарии автора разбросаны по шардам записей: потоки шардов
+    # сливаются по id, чтобы продолжение с after_comment оставалось верным.
+    comments = heapq.merge(*(
+        Comment.objects.using(alias).filter(
+            author=author,
+            pk__gt=after_comment
+        ).order_by('pk').values_list(
+            'pk', 'post_id', 'text', 'created'
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        for alias in shard_aliases()
+    ))
+    for pk, post_id, text, created in comments:
+        yield {
+            'type': 'comment',
+            'id': pk,
+            'post': post_id,
+            'text': text,
+            'date': created.isoformat(),
+        }
+
+
+def as_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+class Echo:
+    """Псевдофайл для csv.writer: write возвращает строку, а не пишет её."""
+
+    def write(self, value):
+        return value
+
+
+def as_csv(rows):
+    writer = csv.DictWriter(Echo(), CSV_FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class ZipBuffer:
+    """Несеекабельный буфер: zipfile пишет в него, генератор забирает."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def post_images(author, after_post=0):
+    return Post.objects.using(shard_for_author(author.pk)).filter(
+        author=author,
+        pk__gt=after_post
+    ).exclude(image='').exclude(image=None).order_by('pk').values_list(
+        'image',
+        flat=True
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def as_zip(author, after_post=0, after_comment=0):
+    """
+    Архив с export.jsonl и картинками записей в images/.
+
+    Архив собирается на лету: zipfile пишет в несеекабельный буфер
+    с дескрипторами данных, а картинки читаются кусками.
+    """
+    buffer = ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('export.jsonl', 'w', force_zip64=True) as entry:
+            for line in as_jsonl(
+                export_rows(author, after_post, after_comment)
+            ):
+                entry.write(line.encode())
+                yield buffer.pop()
+        for name in post_images(author, after_post):
+            try:
+                source = default_storage.open(name)
+            except OSError:
+                continue
+            with source, archive.open(f'images/{name}', 'w') as entry:
+                for chunk in source.chunks(IMAGE_CHUNK_SIZE):
+                    entry.write(chunk)
+                    yield buffer.pop()
+    yield buffer.pop()
+
+
+def export(author, file_format='jsonl', after_post=0, after_comment=0):
+    if file_format == 'zip':
+        chunks = as_zip(author, after_post, after_comment)
+        return (chunk for chunk in chunks if chunk)
+    rows = export_rows(author, after_post, after_comment)
+    if file_format == 'csv':
+        return as_csv(rows)
+    return as_jsonl(rows)
@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import FeedEntry, Follow, Post
+from .paginators import count_cache_key, reset_counts
+
+FANOUT_SYNC_LIMIT = getattr(settings, 'FEED_FANOUT_SYNC_LIMIT', 500)
+FANOUT_BATCH_SIZE = getattr(settings, 'FEED_FANOUT_BATCH_SIZE', 1000)
+
+executor = ThreadPoolExecutor(max_workers=1)
+
+
+def push_to_followers(post_id, author_id, pub_date, batch_size=None):
+    """Раскладывает запись по лентам подписчиков пачками по user_id."""
+    batch_size = batch_size or FANOUT_BATCH_SIZE
+    last_id = 0
+    while True:
+        user_ids = list(
+            Follow.objects.filter(author_id=author_id, user_id__gt=last_id)
+            .order_by('user_id')
+            .values_list('user_id', flat=True)[:batch_size]
+        )
+        if not user_ids:
+            return
+        last_id = user_ids[-1]
+        FeedEntry.objects.bulk_create(
+            [
+                FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+                for user_id in user_ids
+            ],
+            ignore_conflicts=True
+        )
+        reset_counts(
+            [count_cache_key('follow', user_id) for user_id in user_ids]
+        )
+
+
+def push_in_background(post_id, author_id, pub_date):
+    try:
+        push_to_followers(post_id, author_id, pub_date)
+    finally:
+        connection.close()
+
+
+def fan_out(post):
+    followers = Follow.objects.filter(author_id=post.author_id)
+    if followers[:FANOUT_SYNC_LIMIT + 1].count() <= FANOUT_SYNC_LIMIT:
+        push_to_followers(post.id, post.author_id, post.pub_date)
+        return
+    transaction.on_commit(lambda: executor.submit(
+        push_in_background,
+        post.id,
+        post.author_id,
+        post.pub_date
+    ))
+
+
+def backfill(user_id, author_id, batch_size=None):
+    batch_size = batch_size or FANOUT_BATCH_SIZE
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'id',
+        'pub_date'
+    )
+    entries = []
+    for post_id, pub_date in posts.iterator(chunk_size=batch_size):
+        entries.append(
+            FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        )
+        if len(entries) >= batch_size:
+            FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+            entries = []
+    FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def prune(user_id, author_id):
+    FeedEntry.objects.filter(
+        user_id=user_id,
+        post__author_id=author_id
+    ).delete()
@@ -0,0 +1,114 @@
+"""
+Граф подписок в кэше.
+
+Для каждого пользователя в кэше лежит отсортированный массив id авторов,
+на которых он подписан (array('I'), четыре байта на подписку), под
+ключом с версией - поколением области follow:<id> из page_cache.
+Подписка и отписка увеличивают версию, поэтому все процессы сразу
+перестают верить старому набору. В памяти процесса набор живёт как
+frozenset, пока версия не сменилась: проверка подписки стоит одного
+чтения версии из кэша и поиска в множестве.
+"""
+import threading
+from array import array
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Follow
+from .page_cache import bump_generation, get_generation
+
+FOLLOW_GRAPH_TIMEOUT = 60 * 60 * 24
+LOCAL_SETS_SIZE = 1024
+
+local_sets = OrderedDict()
+local_lock = threading.Lock()
+
+
+def follow_scope(user_id):
+    return f'follow:{user_id}'
+
+
+def graph_key(user_id, version):
+    return f'follow_graph:{user_id}:{version}'
+
+
+def pack(author_ids):
+    return array('I', sorted(author_ids)).tobytes()
+
+
+def unpack(data):
+    author_ids = array('I')
+    author_ids.frombytes(data)
+    return author_ids
+
+
+def load(user_id):
+    return Follow.objects.filter(
+        user_id=user_id,
+        author__isnull=False
+    ).values_list('author_id', flat=True)
+
+
+def followed_ids(user_id):
+    """frozenset id авторов, на которых подписан user_id."""
+    if user_id is None:
+        return frozenset()
+    version = get_generation(follow_scope(user_id))
+    if version is None:
+        # Кэш не хранит значения (DummyCache): читаем базу.
+        return frozenset(load(user_id))
+    with local_lock:
+        entry = local_sets.get(user_id)
+        if entry is not None and entry[0] == version:
+            local_sets.move_to_end(user_id)
+            return entry[1]
+    data = cache.get(graph_key(user_id, version))
+    if data is None:
+        data = pack(load(user_id))
+        cache.set(graph_key(user_id, version), data, FOLLOW_GRAPH_TIMEOUT)
+    author_ids = frozenset(unpack(data))
+    with local_lock:
+        local_sets[user_id] = (version, author_ids)
+        local_sets.move_to_end(user_id)
+        while len(local_sets) > LOCAL_SETS_SIZE:
+            local_sets.popitem(last=False)
+    return author_ids
+
+
+def is_following(user_id, author_id):
+    return author_id in followed_ids(user_id)
+
+
+def apply_change(user_id, author_id, following):
+    """
+    После коммита кладёт новый набор: предыдущий плюс или минус автор.
+
+    Новая версия строится только из набора ровно предыдущей версии,
+    поэтому одновременные подписки не теряют друг друга. Если его нет
+    в кэше, набор загрузится из базы при следующем чтении.
+    """
+    scope = follow_scope(user_id)
+    version = bump_generation(scope)[scope]
+    if version is None:
+        return
+    data = cache.get(graph_key(user_id, version - 1))
+    if data is None:
+        return
+    author_ids = set(unpack(data))
+    if following:
+        author_ids.add(author_id)
+    else:
+        author_ids.discard(author_id)
+    cache.set(graph_key(user_id, version), pack(author_ids),
+              FOLLOW_GRAPH_TIMEOUT)
+
+
+def follow_changed(user_id, author_id, following):
+    # Сразу - чтобы никто не читал старый набор, и после коммита -
+    # чтобы набор, загруженный из базы до коммита, не стал последним.
+    bump_generation(follow_scope(user_id))
+    transaction.on_commit(
+        lambda: apply_change(user_id, author_id, following)
+    )
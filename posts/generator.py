@@ -0,0 +1,355 @@
+import random
+import time
+from bisect import bisect
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Max
+from PIL import Image
+
+from . import search, sharding
+from .models import AuthorStats, Comment, FeedEntry, Follow, Group, Post, User
+
+WORDS = (
+    'город', 'море', 'лето', 'книга', 'кот', 'дорога', 'музыка', 'утро',
+    'друг', 'работа', 'вечер', 'фильм', 'снег', 'река', 'кофе', 'поезд',
+    'сон', 'окно', 'ветер', 'песня', 'лес', 'дом', 'свет', 'небо',
+)
+# Даты считаются наивными в UTC: так adapt_datetimefield_value не
+# переводит часовой пояс на каждой строке, а база хранит даты в UTC.
+START = datetime(2020, 1, 1)
+TEXT_POOL_SIZE = 4096
+
+
+def zipf_weights(count, skew):
+    """Накопленные веса закона Ципфа: k-й по номеру в 1/k**skew популярнее."""
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def last_id(model):
+    return model.objects.aggregate(last=Max('pk'))['last'] or 0
+
+
+class TableWriter:
+    """Копит строки и пишет их executemany пачками, минуя ORM."""
+
+    def __init__(self, model, fields, batch_size):
+        quote = connection.ops.quote_name
+        columns = [model._meta.get_field(field).column for field in fields]
+        self.sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            quote(model._meta.db_table),
+            ', '.join(quote(column) for column in columns),
+            ', '.join(['%s'] * len(columns)),
+        )
+        self.batch_size = batch_size
+        self.rows = []
+        self.written = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(self.sql, self.rows)
+        self.written += len(self.rows)
+        self.rows = []
+
+
+class DatasetGenerator:
+    """
+    Синтетические пользователи, группы, записи, комментарии и подписки.
+
+    Популярность авторов подчиняется закону Ципфа: на первых по номеру
+    подписываются и пишут чаще всего. Число подписок у пользователя и
+    число комментариев к записи - распределение Парето, то есть
+    тяжёлый хвост. Все случайности идут от одного seed, поэтому набор
+    воспроизводим. Строки пишутся executemany прямо в таблицы, а
+    счётчики считаются на лету и сразу пишутся готовыми.
+    """
+
+    def __init__(self, users=1000, groups=10, posts=10000, avg_follows=20,
+                 max_follows=1000, follow_skew=1.5, popularity_skew=1.0,
+                 comment_skew=1.5, max_comments=500, group_ratio=0.5,
+                 images=0, image_ratio=0.2, feeds=True, prefix='gen',
+                 seed=0, batch_size=5000, days=365, defer_indexes=False):
+        self.users = users
+        self.groups = groups
+        self.posts = posts
+        self.avg_follows = avg_follows
+        self.max_follows = max_follows
+        self.follow_skew = follow_skew
+        self.comment_skew = comment_skew
+        self.max_comments = max_comments
+        self.group_ratio = group_ratio
+        self.images = images
+        self.image_ratio = image_ratio
+        self.feeds = feeds
+        self.defer_indexes = defer_indexes
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.step = timedelta(days=days) / max(posts, 1)
+        self.rng = random.Random(seed)
+        self.popularity = zipf_weights(users, popularity_skew)
+        # Кто много пишет, не обязательно популярен: с общими весами
+        # первый автор был бы и самым читаемым, и самым плодовитым, и
+        # ленты росли бы как число записей на число его подписчиков.
+        # Отдельный поток случайностей не сдвигает остальные данные.
+        self.writers = list(range(users))
+        random.Random(f'{seed}:writers').shuffle(self.writers)
+        self.group_popularity = zipf_weights(groups, popularity_skew)
+        self.adapt_date = connection.ops.adapt_datetimefield_value
+        self.rows = {}
+        self.timings = {}
+
+    def pick(self, weights):
+        return bisect(weights, self.rng.random() * weights[-1])
+
+    def run(self):
+        if sharding.is_sharded():
+            # Строки пишутся в default мимо ShardSequence и AuthorShard.
+            raise ValueError('Генератор не поддерживает шарды (POST_SHARDS)')
+        started = time.perf_counter()
+        self.first_user = last_id(User) + 1
+        self.first_group = last_id(Group) + 1
+        self.first_post = last_id(Post) + 1
+        self.followers = [0] * self.users
+        self.following = [0] * self.users
+        self.posts_count = [0] * self.users
+        # Связи верны по построению, а проверка внешних ключей на каждой
+        # вставке удваивает время заливки. На SQLite отключать проверки
+        # можно только вне транзакции.
+        with connection.constraint_checks_disabled():
+            with transaction.atomic(), self.deferred_indexes():
+                with self.timed('user'):
+                    self.write_users()
+                with self.timed('group'):
+                    self.write_groups()
+                with self.timed('follow'):
+                    self.write_follows()
+                images = self.write_images()
+                with self.timed('post', 'comment'):
+                    self.write_posts(images)
+                self.write_stats()
+        if self.feeds:
+            with self.timed('feed'):
+                self.write_feeds()
+        search.index_posts_since(self.first_post, chunk_size=self.batch_size)
+        cache.clear()
+        self.elapsed = time.perf_counter() - started
+        return self.rows
+
+    @contextmanager
+    def timed(self, *tables):
+        """Время записи таблиц tables, которые пишутся одним проходом."""
+        started = time.perf_counter()
+        yield
+        self.timings[tables] = time.perf_counter() - started
+
+    @contextmanager
+    def deferred_indexes(self):
+        """
+        Снимает составные индексы из Meta.indexes на время заливки.
+
+        Построить индекс по готовой таблице заметно быстрее, чем
+        обновлять его на каждой вставке. Пока индексов нет, страницы
+        сайта работают медленно, поэтому режим включается явно.
+        """
+        if not self.defer_indexes:
+            yield
+            return
+        indexes = [
+            (model, index)
+            for model in (Post, Comment, Follow)
+            for index in model._meta.indexes
+        ]
+        # Только SQL индексов, без входа в schema_editor: на SQLite он
+        # не работает внутри transaction.atomic.
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for model, index in indexes:
+                cursor.execute(str(index.remove_sql(model, editor)))
+        yield
+        with connection.cursor() as cursor:
+            for model, index in indexes:
+                cursor.execute(str(index.create_sql(model, editor)))
+
+    def write_users(self):
+        writer = TableWriter(User, (
+            'id', 'password', 'last_login', 'is_superuser', 'username',
+            'first_name', 'last_name', 'email', 'is_staff', 'is_active',
+            'date_joined'
+        ), self.batch_size)
+        password = make_password(None)
+        joined = self.adapt_date(START)
+        for number in range(self.users):
+            pk = self.first_user + number
+            writer.add((
+                pk, password, None, False, f'{self.prefix}{pk}', '', '', '',
+                False, True, joined
+            ))
+        writer.flush()
+        self.rows['user'] = writer.written
+
+    def write_groups(self):
+        writer = TableWriter(
+            Group,
+            ('id', 'title', 'slug', 'description'),
+            self.batch_size
+        )
+        for number in range(self.groups):
+            pk = self.first_group + number
+            writer.add((
+                pk,
+                f'Группа {pk}',
+                f'{self.prefix}-group-{pk}',
+                ' '.join(self.rng.choices(WORDS, k=12)),
+            ))
+        writer.flush()
+        self.rows['group'] = writer.written
+
+    def follows_of(self, user):
+        alpha = self.follow_skew
+        wanted = min(
+            self.users - 1,
+            self.max_follows,
+            int(self.avg_follows * (alpha - 1) / alpha *
+                self.rng.paretovariate(alpha))
+        )
+        authors = set()
+        for _ in range(wanted * 4):
+            if len(authors) >= wanted:
+                break
+            author = self.pick(self.popularity)
+            if author != user:
+                authors.add(author)
+        return sorted(authors)
+
+    def write_follows(self):
+        writer = TableWriter(Follow, ('user', 'author'), self.batch_size)
+        for user in range(self.users):
+            for author in self.follows_of(user):
+                writer.add((self.first_user + user, self.first_user + author))
+                self.followers[author] += 1
+                self.following[user] += 1
+        writer.flush()
+        self.rows['follow'] = writer.written
+
+    def write_images(self):
+        names = []
+        for number in range(self.images):
+            color = tuple(self.rng.randrange(256) for _ in range(3))
+            content = BytesIO()
+            Image.new('RGB', (960, 540), color).save(content, 'JPEG')
+            names.append(default_storage.save(
+                f'posts/{self.prefix}_{number}.jpg',
+                ContentFile(content.getvalue())
+            ))
+        return names
+
+    def write_posts(self, images):
+        posts = TableWriter(Post, (
+            'id', 'text', 'pub_date', 'edited', 'author', 'group', 'image',
+            'comments_count'
+        ), self.batch_size)
+        comments = TableWriter(
+            Comment,
+            ('post', 'author', 'text', 'created'),
+            self.batch_size
+        )
+        rng = self.rng
+        # Склеивать слова на каждую строку дорого: тексты берутся из
+        # заранее собранного набора, для поиска его разнообразия хватает.
+        texts = [
+            ' '.join(rng.choices(WORDS, k=rng.randint(3, 80)))
+            for _ in range(TEXT_POOL_SIZE)
+        ]
+        comment_texts = [
+            ' '.join(rng.choices(WORDS, k=rng.randint(1, 12)))
+            for _ in range(TEXT_POOL_SIZE)
+        ]
+        for number in range(self.posts):
+            pk = self.first_post + number
+            author = self.writers[self.pick(self.popularity)]
+            self.posts_count[author] += 1
+            group = None
+            if self.groups and rng.random() < self.group_ratio:
+                group = self.first_group + self.pick(self.group_popularity)
+            image = None
+            if images and rng.random() < self.image_ratio:
+                image = rng.choice(images)
+            pub_date = START + self.step * number
+            stored_date = self.adapt_date(pub_date)
+            count = min(
+                self.max_comments,
+                int(rng.paretovariate(self.comment_skew)) - 1
+            )
+            posts.add((
+                pk, rng.choice(texts), stored_date, stored_date,
+                self.first_user + author, group, image, count
+            ))
+            if count:
+                # У комментариев одной записи общее время: порядок среди
+                # них задаёт id, а приводить дату для каждого дорого.
+                created = self.adapt_date(pub_date + self.step / 2)
+            for _ in range(count):
+                comments.add((
+                    pk,
+                    self.first_user + rng.randrange(self.users),
+                    rng.choice(comment_texts),
+                    created
+                ))
+        posts.flush()
+        comments.flush()
+        self.rows['post'] = posts.written
+        self.rows['comment'] = comments.written
+
+    def write_stats(self):
+        writer = TableWriter(AuthorStats, (
+            'user', 'followers_count', 'following_count', 'posts_count'
+        ), self.batch_size)
+        for user in range(self.users):
+            writer.add((
+                self.first_user + user,
+                self.followers[user],
+                self.following[user],
+                self.posts_count[user],
+            ))
+        writer.flush()
+
+    def write_feeds(self):
+        """
+        Ленты подписчиков одним INSERT ... SELECT на пачку пользователей.
+
+        Пользователи новые, своих лент у них ещё нет, поэтому конфликты
+        уникальности невозможны.
+        """
+        quote = connection.ops.quote_name
+        sql = (
+            'INSERT INTO {feed} (user_id, post_id, pub_date) '
+            'SELECT f.user_id, p.id, p.pub_date FROM {follow} f '
+            'INNER JOIN {post} p ON p.author_id = f.author_id '
+            'WHERE f.user_id >= %s AND f.user_id < %s'
+        ).format(
+            feed=quote(FeedEntry._meta.db_table),
+            follow=quote(Follow._meta.db_table),
+            post=quote(Post._meta.db_table),
+        )
+        written = 0
+        users_per_batch = max(1, self.batch_size // max(self.avg_follows, 1))
+        last_user = self.first_user + self.users
+        for first in range(self.first_user, last_user, users_per_batch):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, [first, first + users_per_batch])
+                written += cursor.rowcount
+        self.rows['feed'] = written
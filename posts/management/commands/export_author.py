@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.exports import EXPORT_FORMATS, export
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Выгружает записи и комментарии автора в JSONL, CSV или zip'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument(
+            '--format',
+            choices=tuple(EXPORT_FORMATS),
+            default='jsonl'
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл для выгрузки, по умолчанию stdout (кроме zip)'
+        )
+        parser.add_argument(
+            '--after-post',
+            type=int,
+            default=0,
+            help='Продолжить после записи с этим id'
+        )
+        parser.add_argument(
+            '--after-comment',
+            type=int,
+            default=0,
+            help='Продолжить после комментария с этим id'
+        )
+
+    def handle(self, *args, **options):
+        author = User.objects.filter(username=options['username']).first()
+        if author is None:
+            raise CommandError(f'Нет пользователя {options["username"]}')
+        if options['format'] == 'zip' and not options['output']:
+            raise CommandError('Для zip нужен --output')
+        chunks = export(
+            author,
+            options['format'],
+            options['after_post'],
+            options['after_comment']
+        )
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        mode = 'wb' if options['format'] == 'zip' else 'w'
+        encoding = None if options['format'] == 'zip' else 'utf-8'
+        with open(options['output'], mode, encoding=encoding) as target:
+            for chunk in chunks:
+                target.write(chunk)
@@ -0,0 +1,111 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.generator import DatasetGenerator
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует пользователей, группы, записи, комментарии и подписки '
+        'со степенными распределениями для нагрузочных проверок'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument(
+            '--avg-follows',
+            type=int,
+            default=20,
+            help='Среднее число подписок на пользователя'
+        )
+        parser.add_argument('--max-follows', type=int, default=1000)
+        parser.add_argument(
+            '--follow-skew',
+            type=float,
+            default=1.5,
+            help='Параметр Парето для числа подписок, больше 1'
+        )
+        parser.add_argument(
+            '--popularity-skew',
+            type=float,
+            default=1.0,
+            help='Показатель Ципфа для популярности авторов и групп'
+        )
+        parser.add_argument(
+            '--comment-skew',
+            type=float,
+            default=1.5,
+            help='Параметр Парето для числа комментариев к записи'
+        )
+        parser.add_argument('--max-comments', type=int, default=500)
+        parser.add_argument('--group-ratio', type=float, default=0.5)
+        parser.add_argument(
+            '--images',
+            type=int,
+            default=0,
+            help='Сколько разных картинок создать и раздать записям'
+        )
+        parser.add_argument('--image-ratio', type=float, default=0.2)
+        parser.add_argument(
+            '--no-feeds',
+            dest='feeds',
+            action='store_false',
+            help='Не строить ленты подписок'
+        )
+        parser.add_argument(
+            '--prefix',
+            default='gen',
+            help='Префикс имён пользователей и адресов групп'
+        )
+        parser.add_argument(
+            '--defer-indexes',
+            action='store_true',
+            help='Снять составные индексы на время заливки и построить заново'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=365)
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь')
+        if options['follow_skew'] <= 1:
+            raise CommandError('--follow-skew должен быть больше 1')
+        if options['comment_skew'] <= 0:
+            raise CommandError('--comment-skew должен быть больше 0')
+        options = {
+            key: options[key] for key in (
+                'users', 'groups', 'posts', 'avg_follows', 'max_follows',
+                'follow_skew', 'popularity_skew', 'comment_skew',
+                'max_comments', 'group_ratio', 'images', 'image_ratio',
+                'feeds', 'prefix', 'seed', 'batch_size', 'days',
+                'defer_indexes'
+            )
+        }
+        generator = DatasetGenerator(**options)
+        try:
+            rows = generator.run()
+        except ValueError as error:
+            raise CommandError(str(error))
+        for table, count in rows.items():
+            self.stdout.write(f'{table}: {count}')
+        # Ленты - производные строки, одним INSERT ... SELECT: в общую
+        # скорость записи они не входят, иначе её определяли бы подписки.
+        total = elapsed = 0
+        for tables, seconds in generator.timings.items():
+            count = sum(rows[table] for table in tables)
+            derived = tables == ('feed',)
+            self.stdout.write(
+                f'{" + ".join(tables)}: {count} строк за {seconds:.2f} с '
+                f'({count / max(seconds, 1e-6):.0f} строк/с)'
+                + (', производные' if derived else '')
+            )
+            if not derived:
+                total += count
+                elapsed += seconds
+        self.stdout.write(
+            f'Всего строк без лент: {total} за {elapsed:.1f} с '
+            f'({total / max(elapsed, 1e-6):.0f} строк/с), '
+            f'вся генерация - {generator.elapsed:.1f} с'
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.importer import RECORD_TYPES, Importer, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует пользователей, группы, записи, комментарии и подписки '
+        'из JSONL или CSV с полем type'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('jsonl', 'csv'))
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--transaction-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        importer = Importer(
+            batch_size=options['batch_size'],
+            transaction_size=options['transaction_size']
+        )
+        try:
+            created, skipped = importer.run(
+                read_records(options['path'], options['format'])
+            )
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Импорт прерван: {error!r}')
+        for record_type in RECORD_TYPES:
+            self.stdout.write(
+                f'{record_type}: создано {created[record_type]}, '
+                f'пропущено {skipped[record_type]}'
+            )
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.sharding import (move_author, plan_rebalance, shard_aliases,
+                            shard_loads)
+
+
+class Command(BaseCommand):
+    help = 'Переносит авторов между шардами, выравнивая число записей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.1,
+            help='Допустимый разрыв как доля средней загрузки шарда'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--author', type=int, help='id автора')
+        parser.add_argument('--to', help='Шард для --author')
+
+    def handle(self, *args, **options):
+        if options['author'] is not None:
+            if options['to'] not in shard_aliases():
+                raise CommandError(
+                    f'--to должен быть одним из {", ".join(shard_aliases())}'
+                )
+            moves = [(options['author'], None, options['to'], None)]
+        else:
+            moves = plan_rebalance(options['tolerance'])
+        for author_id, source, target, posts in moves:
+            if options['dry_run']:
+                self.stdout.write(
+                    f'автор {author_id}: {source} -> {target}, '
+                    f'записей {posts}'
+                )
+                continue
+            moved = move_author(author_id, target)
+            self.stdout.write(
+                f'автор {author_id} -> {target}, перенесено записей {moved}'
+            )
+        for alias, authors in shard_loads().items():
+            self.stdout.write(f'{alias}: записей {sum(authors.values())}')
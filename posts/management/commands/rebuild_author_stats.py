@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import rebuild_author_stats
+
+
+class Command(BaseCommand):
+    help = 'Сверяет статистику авторов с исходными таблицами и чинит её'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать расхождения, ничего не менять'
+        )
+
+    def handle(self, *args, **options):
+        fixed = rebuild_author_stats(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run']
+        )
+        if options['dry_run']:
+            self.stdout.write(f'Расхождений: {fixed}')
+        else:
+            self.stdout.write(f'Исправлено: {fixed}')
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from posts.slow_queries import log_path, read_log, top_offenders
+
+
+class Command(BaseCommand):
+    help = 'Показывает самые дорогие медленные запросы из журнала'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--log', help='Путь к журналу')
+        parser.add_argument(
+            '--plans',
+            action='store_true',
+            help='Печатать план и стек для каждого запроса'
+        )
+
+    def handle(self, *args, **options):
+        offenders = top_offenders(
+            read_log(options['log'] or log_path()),
+            options['top']
+        )
+        if not offenders:
+            self.stdout.write('Медленных запросов нет')
+            return
+        for number, offender in enumerate(offenders, 1):
+            self.stdout.write(
+                f'{number}. всего {offender["total_ms"]:.1f} мс, '
+                f'{offender["count"]} раз, максимум '
+                f'{offender["max_ms"]:.1f} мс, view: '
+                f'{", ".join(sorted(offender["views"])) or "-"}'
+            )
+            self.stdout.write(f'   {offender["sql"]}')
+            if options['plans']:
+                for line in offender['plan'] or []:
+                    self.stdout.write(f'   план: {line}')
+                for line in offender['stack'] or []:
+                    self.stdout.write(f'   стек: {line}')
@@ -0,0 +1,194 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+
+from yatube.replicas import lag_seconds, reading_from_replica, use_primary
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24)
+# Так помечены заглушки того, что ещё готовится, например миниатюр.
+PENDING_MARKER = 'data-pending'
+PENDING_CACHE_TIMEOUT = 60
+
+
+def generation_key(scope):
+    return f'generation:{scope}'
+
+
+def changed_at_key(scope):
+    return f'generation_changed_at:{scope}'
+
+
+def get_generation(scope):
+    key = generation_key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, int(time.time() * 1000), None)
+        generation = cache.get(key)
+    return generation
+
+
+def get_generations(scopes):
+    """
+    Поколения нескольких областей одним get_many: словарь
+    {область: поколение}. Недостающие заводятся как в get_generation.
+    """
+    keys = {generation_key(scope): scope for scope in scopes}
+    cached = cache.get_many(keys)
+    generations = {keys[key]: generation for key, generation in cached.items()}
+    for key, scope in keys.items():
+        if key not in cached:
+            generations[scope] = get_generation(scope)
+    return generations
+
+
+def read_generation(scope):
+    """
+    Поколение области для ключа кэша или ETag.
+
+    Если область менялась меньше, чем за время отставания реплики,
+    запрос читает с основной базы: иначе отставшая реплика отдала бы
+    старые данные, и они закэшировались бы под новым поколением. Метка
+    изменения читается после поколения, а пишется до него.
+    """
+    generation = get_generation(scope)
+    if reading_from_replica():
+        timestamp = cache.get(changed_at_key(scope))
+        if timestamp is not None and time.time() - timestamp < lag_seconds():
+            use_primary()
+    return generation
+
+
+def bump_generation(*scopes):
+    """
+    Делает устаревшими все закэшированные страницы областей scopes и
+    возвращает словарь их новых поколений.
+
+    Начальное значение берётся из времени, чтобы после вытеснения
+    счётчика из кэша не вернуться к номеру старых страниц.
+    """
+    now = time.time()
+    cache.set_many({changed_at_key(scope): now for scope in scopes}, None)
+    generations = {}
+    for scope in set(scopes):
+        key = generation_key(scope)
+        try:
+            generations[scope] = cache.incr(key)
+        except ValueError:
+            cache.add(key, int(now * 1000), None)
+            generations[scope] = cache.get(key)
+    return generations
+
+
+def bump_generation_on_commit(*scopes, using=None):
+    """
+    bump_generation сейчас и ещё раз после коммита транзакции using.
+
+    Чтение между записью и коммитом видит новое поколение, но старые
+    строки, и без второго увеличения его страница жила бы в кэше под
+    последним поколением.
+    """
+    bump_generation(*scopes)
+    transaction.on_commit(lambda: bump_generation(*scopes), using=using)
+
+
+def changed_at(scope):
+    timestamp = cache.get(changed_at_key(scope))
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def cache_page_by_generation(key_prefix, scope, timeout=PAGE_CACHE_TIMEOUT):
+    """
+    Как cache_page, но в ключ страницы входит поколение области, а
+    страница кэшируется только на сервере (Cache-Control: no-cache).
+
+    scope получает аргументы view из URL и возвращает имя области,
+    например 'index' или 'group:<slug>'. Vary: Cookie выставляется до
+    сохранения в кэш, иначе вошедшему пользователю достанется
+    страница, закэшированная для анонима. Страница с заглушками
+    (PENDING_MARKER) хранится только PENDING_CACHE_TIMEOUT, чтобы её
+    следующий показ заново поискал то, что готовилось.
+    """
+    def decorator(view):
+        @vary_on_cookie
+        def view_with_vary(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if has_pending(response):
+                patch_cache_control(response, max_age=PENDING_CACHE_TIMEOUT)
+            return response
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            generation = read_generation(scope(*args, **kwargs))
+            cached_view = cache_page(
+                timeout,
+                key_prefix=f'{key_prefix}:{generation}'
+            )(view_with_vary)
+            response = cached_view(request, *args, **kwargs)
+            # cache_page обещает браузерам и прокси страницу на весь
+            # срок кэша, а свежесть здесь задаёт поколение: кэшируем
+            # только на сервере, клиенты каждый раз переспрашивают.
+            del response['Expires']
+            patch_cache_control(response, no_cache=True, max_age=0)
+            return response
+        return wrapper
+    return decorator
+
+
+def has_pending(response):
+    return (
+        not response.streaming
+        and PENDING_MARKER.encode() in response.content
+    )
+
+
+def conditional_by_generation(scope):
+    """
+    Отвечает 304 Not Modified, пока поколение области не изменилось.
+
+    ETag строится из поколения, пользователя, CSRF-куки и адреса с
+    параметрами, поэтому проверка стоит одного чтения из кэша и не
+    трогает базу. Last-Modified отдаётся только анонимам: вошедшему
+    пользователю страница показывает и его собственное состояние.
+    """
+    def etag(request, *args, **kwargs):
+        parts = (
+            read_generation(scope(*args, **kwargs)),
+            request.user.pk,
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+            request.get_full_path(),
+        )
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return None
+        return changed_at(scope(*args, **kwargs))
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def index_scope():
+    return 'index'
+
+
+def group_scope(slug):
+    return f'group:{slug}'
+
+
+def author_scope(username):
+    return f'author:{username}'
+
+
+def post_scope(username, post_id):
+    return author_scope(username)
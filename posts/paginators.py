@@ -0,0 +1,207 @@
+import base64
+import binascii
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 20
+COUNT_CACHE_TIMEOUT = 60 * 5
+
+
+def count_cache_key(scope, pk=None):
+    if pk is None:
+        return f'posts_count:{scope}'
+    return f'posts_count:{scope}:{pk}'
+
+
+def reset_counts(keys, using=None):
+    """
+    Сбрасывает закэшированные числа записей сейчас и после коммита:
+    число, посчитанное между записью и коммитом, было бы старым.
+    """
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys), using=using)
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator с закэшированным числом записей и окном ссылок на страницы.
+
+    Точный COUNT(*) выполняется только при промахе кэша, сигналы
+    сбрасывают ключ при записи. Устаревшее значение влияет лишь на
+    число ссылок: срез страницы не обрезается по count.
+    """
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page, count_key=None,
+                 count_timeout=COUNT_CACHE_TIMEOUT, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_key = count_key
+        self.count_timeout = count_timeout
+
+    @cached_property
+    def count(self):
+        if self.count_key is None:
+            return super().count
+        count = cache.get(self.count_key)
+        if count is None:
+            count = super().count
+            cache.set(self.count_key, count, self.count_timeout)
+        return count
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(
+            self.object_list[bottom:bottom + self.per_page],
+            number,
+            self
+        )
+
+    def _get_page(self, *args, **kwargs):
+        page = super()._get_page(*args, **kwargs)
+        page.elided_page_range = list(
+            self.get_elided_page_range(page.number)
+        )
+        return page
+
+    def get_elided_page_range(self, number=1, on_each_side=2, on_ends=1):
+        number = self.validate_number(number)
+        num_pages = self.num_pages
+        if num_pages <= (on_each_side + on_ends) * 2:
+            yield from range(1, num_pages + 1)
+            return
+        if number > 1 + on_each_side + on_ends + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < num_pages - on_each_side - on_ends - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(num_pages - on_ends + 1, num_pages + 1)
+        else:
+            yield from range(number + 1, num_pages + 1)
+
+
+class CursorPage:
+    cursor_mode = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<CursorPage of %s items>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Постраничный вывод по ключу (pub_date, id) вместо OFFSET.
+
+    Не выполняет COUNT(*): любая страница стоит одного запроса
+    с LIMIT по индексу, сколько бы страниц ни было до неё. Работает и
+    с values(), если в строках есть поле даты и id.
+    """
+    cursor_mode = True
+
+    def __init__(self, object_list, per_page, date_field='pub_date'):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.date_field = date_field
+
+    def position(self, obj):
+        if isinstance(obj, dict):
+            return obj[self.date_field], obj['id']
+        return getattr(obj, self.date_field), obj.pk
+
+    def encode_cursor(self, obj, direction):
+        date, pk = self.position(obj)
+        value = '%s|%s|%s' % (direction, date.isoformat(), pk)
+        return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            value = base64.urlsafe_b64decode(padded.encode()).decode()
+            direction, date, pk = value.split('|')
+            date = parse_datetime(date)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+            return None
+        if direction not in ('n', 'p') or date is None:
+            return None
+        return direction, date, pk
+
+    def get_page(self, cursor):
+        position = self.decode_cursor(cursor)
+        field = self.date_field
+        if position is None:
+            items = list(
+                self.object_list.order_by('-' + field, '-pk')
+                [:self.per_page + 1]
+            )
+            has_more = len(items) > self.per_page
+            items = items[:self.per_page]
+            return self._page(items, has_next=has_more, has_previous=False)
+        direction, date, pk = position
+        if direction == 'n':
+            queryset = self.object_list.filter(
+                Q(**{field + '__lt': date})
+                | Q(**{field: date, 'pk__lt': pk})
+            ).order_by('-' + field, '-pk')
+        else:
+            queryset = self.object_list.filter(
+                Q(**{field + '__gt': date})
+                | Q(**{field: date, 'pk__gt': pk})
+            ).order_by(field, 'pk')
+        items = list(queryset[:self.per_page + 1])
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if direction == 'n':
+            return self._page(items, has_next=has_more, has_previous=True)
+        items.reverse()
+        return self._page(items, has_next=True, has_previous=has_more)
+
+    def _page(self, items, has_next, has_previous):
+        next_cursor = previous_cursor = None
+        if items and has_next:
+            next_cursor = self.encode_cursor(items[-1], 'n')
+        if items and has_previous:
+            previous_cursor = self.encode_cursor(items[0], 'p')
+        return CursorPage(items, next_cursor, previous_cursor)
+
+
+def paginate(request, object_list, count_key=None, per_page=POSTS_PER_PAGE):
+    if 'cursor' in request.GET:
+        paginator = CursorPaginator(object_list, per_page)
+        return paginator, paginator.get_page(request.GET.get('cursor'))
+    paginator = CachedCountPaginator(object_list, per_page, count_key)
+    return paginator, paginator.get_page(request.GET.get('page'))
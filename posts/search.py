@@ -0,0 +1,193 @@
+import heapq
+import re
+from itertools import chain, islice
+
+from django.db import connection, transaction
+
+from . import sharding
+from .counters import id_batches
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+MAX_ROWID = 2 ** 63 - 1
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """
+    Превращает ввод пользователя в безопасный запрос FTS5.
+
+    Все слова должны встретиться, последнее ищется по префиксу.
+    """
+    words = WORD_RE.findall(query)
+    if not words:
+        return None
+    terms = ['"%s"' % word for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def index_post(post):
+    if not search_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, post.text]
+        )
+
+
+def unindex_post(post_id):
+    if not search_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+
+def filter_matching(queryset, query):
+    expression = match_expression(query)
+    if expression is None:
+        return queryset.none()
+    if not search_available():
+        return queryset.filter(text__icontains=query)
+    # RawSQL в pk__in оборачивается в лишние скобки, и SQLite считает
+    # подзапрос скалярным, поэтому условие добавляется через extra.
+    return queryset.extra(
+        where=[
+            f'posts_post.id IN (SELECT rowid FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s)'
+        ],
+        params=[expression]
+    )
+
+
+class SearchResults:
+    """
+    Записи, найденные по запросу, в порядке релевантности (bm25).
+
+    Поддерживает count() и срезы, поэтому годится для Paginator:
+    страница - это один запрос к индексу с LIMIT и выборка записей по id.
+    """
+
+    def __init__(self, query):
+        self.expression = match_expression(query)
+
+    def count(self):
+        if self.expression is None:
+            return 0
+        if not search_available():
+            return self.fallback().count()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+                [self.expression]
+            )
+            return cursor.fetchone()[0]
+
+    def fallback(self):
+        posts = Post.objects.select_related('author', 'group')
+        for word in WORD_RE.findall(self.expression or ''):
+            posts = posts.filter(text__icontains=word)
+        return posts
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if self.expression is None:
+            return []
+        if not search_available():
+            return list(self.fallback()[index])
+        start = index.start or 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                'ORDER BY rank LIMIT %s OFFSET %s',
+                [self.expression, index.stop - start, start]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        posts = sharding.posts_in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+def reindex_range(cursor, first_id, last_id):
+    """
+    Переписывает в индексе диапазон id из всех шардов. Строки шардов
+    читаются после DELETE, то есть уже под блокировкой записи индекса:
+    index_post правки, сохранённой раньше, к этому времени закончен, а
+    более поздней - дождётся коммита и запишет свой текст поверх.
+    """
+    cursor.execute(
+        f'DELETE FROM {FTS_TABLE} WHERE rowid BETWEEN %s AND %s',
+        [first_id, last_id]
+    )
+    for alias in sharding.shard_aliases():
+        if alias == connection.alias:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, text) '
+                'SELECT id, text FROM posts_post WHERE id BETWEEN %s AND %s',
+                [first_id, last_id]
+            )
+            continue
+        rows = list(Post.objects.using(alias).filter(
+            pk__range=(first_id, last_id)
+        ).values_list('pk', 'text'))
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            rows
+        )
+
+
+def post_ids_since(first_id, chunk_size):
+    """id записей всех шардов от first_id по возрастанию."""
+    return heapq.merge(*(
+        chain.from_iterable(id_batches(
+            Post.objects.using(alias).filter(pk__gte=first_id),
+            chunk_size
+        ))
+        for alias in sharding.shard_aliases()
+    ))
+
+
+def index_posts_since(first_id, chunk_size=1000):
+    """
+    Заново индексирует записи с id от first_id пачками по транзакции.
+
+    Пачка удаляет из индекса диапазон id и вставляет его из таблиц
+    записей всех шардов в одной транзакции: поиск всё время находит
+    каждую запись, а index_post не столкнётся с пачкой по rowid.
+    Последний диапазон открыт сверху и убирает из индекса строки
+    удалённых записей.
+    """
+    if not search_available():
+        return 0
+    indexed = 0
+    start = first_id
+    ids = post_ids_since(first_id, chunk_size)
+    while True:
+        chunk = list(islice(ids, chunk_size))
+        if not chunk:
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            reindex_range(cursor, start, chunk[-1])
+        indexed += len(chunk)
+        start = chunk[-1] + 1
+    with transaction.atomic(), connection.cursor() as cursor:
+        reindex_range(cursor, start, MAX_ROWID)
+    return indexed
+
+
+def rebuild_index(chunk_size=1000):
+    """Заново строит индекс, не опустошая его (см. index_posts_since)."""
+    if not search_available():
+        return 0
+    indexed = index_posts_since(0, chunk_size)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"
+        )
+    return indexed
@@ -0,0 +1,503 @@
+"""
+Шардирование записей и комментариев по автору.
+
+POST_SHARDS - алиасы баз из DATABASES, по которым раскладываются Post
+и Comment. Шард автора закрепляется в AuthorShard (в default) при его
+первой записи, комментарии живут в шарде своей записи. id записей и
+комментариев выдаёт ShardSequence, поэтому они уникальны между шардами
+и переживают перенос автора. Пользователи и группы хранятся в default,
+а в шард копируются только строки, на которые ссылаются внешние ключи.
+
+С одним шардом (по умолчанию ['default']) всё работает как раньше.
+"""
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import Count, F
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from .follow_graph import followed_ids
+from .importer import original_dates
+from .models import AuthorShard, Comment, Group, Post, ShardSequence, User
+
+SHARD_CACHE_TIMEOUT = 60 * 60 * 24
+DEFAULT_ORDERING = ('-pub_date', '-pk')
+DIRECTORY_MODELS = ('authorshard', 'shardsequence')
+
+
+def shard_aliases():
+    return getattr(settings, 'POST_SHARDS', [DEFAULT_DB_ALIAS])
+
+
+def is_sharded():
+    return len(shard_aliases()) > 1
+
+
+def author_key(author_id):
+    return f'author_shard:{author_id}'
+
+
+def post_key(post_id):
+    return f'post_shard:{post_id}'
+
+
+def shard_for_author(author_id):
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return aliases[0]
+    alias = cache.get(author_key(author_id))
+    if alias is None:
+        alias = AuthorShard.objects.using(DEFAULT_DB_ALIAS).filter(
+            author_id=author_id
+        ).values_list('shard', flat=True).first()
+        if alias is None:
+            # Ещё не писал: куда попадёт первая запись, решит assign_shard.
+            return aliases[author_id % len(aliases)]
+        cache.set(author_key(author_id), alias, SHARD_CACHE_TIMEOUT)
+    return alias
+
+
+def assign_shard(author_id):
+    aliases = shard_aliases()
+    shard, _ = AuthorShard.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+        author_id=author_id,
+        defaults={'shard': aliases[author_id % len(aliases)]}
+    )
+    return shard.shard
+
+
+def shard_for_post(post_id):
+    """Шард записи по id: опрашивает шарды, ответ кэшируется."""
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return aliases[0]
+    alias = cache.get(post_key(post_id))
+    if alias is None:
+        alias = next(
+            (
+                alias for alias in aliases
+                if Post.objects.using(alias).filter(pk=post_id).exists()
+            ),
+            DEFAULT_DB_ALIAS
+        )
+        cache.set(post_key(post_id), alias, SHARD_CACHE_TIMEOUT)
+    return alias
+
+
+class ShardRouter:
+    """
+    Ведёт Post и Comment в шард автора, если известен экземпляр.
+
+    Запросы без подсказки (Post.objects.filter(...)) идут в default;
+    обойти все шарды можно через scatter(). Комментарии создаются через
+    post.comments или save(): Comment.objects.create не знает записи.
+    """
+
+    def route(self, model, hints):
+        if model not in (Post, Comment) or not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if isinstance(instance, Post):
+            return shard_for_author(instance.author_id)
+        if isinstance(instance, User) and model is Post:
+            return shard_for_author(instance.pk)
+        if isinstance(instance, Comment):
+            if Comment.post.is_cached(instance):
+                return shard_for_author(instance.post.author_id)
+            return shard_for_post(instance.post_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Автор и группа записи из шарда лежат в default.
+        if {type(obj1), type(obj2)} & {Post, Comment}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'posts' and model_name in DIRECTORY_MODELS:
+            return db == DEFAULT_DB_ALIAS
+        return None
+
+
+def next_id(model):
+    """Следующий id модели, общий для всех шардов."""
+    name = model._meta.label_lower
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        sequences = ShardSequence.objects.using(DEFAULT_DB_ALIAS)
+        if not sequences.filter(name=name).update(last_id=F('last_id') + 1):
+            last_id = max(
+                model.objects.using(alias).order_by('-pk').values_list(
+                    'pk',
+                    flat=True
+                ).first() or 0
+                for alias in shard_aliases()
+            )
+            sequences.create(name=name, last_id=last_id + 1)
+        return sequences.get(name=name).last_id
+
+
+def copy_reference_rows(alias, user_ids=(), group_ids=()):
+    """Копирует в шард пользователей и группы, на которых есть ссылки."""
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    for model, ids in ((User, user_ids), (Group, group_ids)):
+        ids = {pk for pk in ids if pk is not None}
+        ids -= set(model.objects.using(alias).filter(pk__in=ids).values_list(
+            'pk',
+            flat=True
+        ))
+        if ids:
+            model.objects.using(alias).bulk_create(
+                model.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=ids),
+                ignore_conflicts=True
+            )
+
+
+def prepare_write(instance):
+    """pre_save для Post и Comment: id, шард автора и ссылки в шарде."""
+    if instance.pk is None:
+        instance.pk = next_id(type(instance))
+    if isinstance(instance, Post):
+        alias = assign_shard(instance.author_id)
+        cache.set(author_key(instance.author_id), alias, SHARD_CACHE_TIMEOUT)
+        copy_reference_rows(alias, [instance.author_id], [instance.group_id])
+    else:
+        alias = router.db_for_write(Comment, instance=instance)
+        copy_reference_rows(alias, [instance.author_id])
+
+
+def delete_author_rows(user_id):
+    """
+    Удаляет из шардов вне default записи пользователя, его комментарии
+    и копию его строки: каскад удаления User идёт только в default.
+    """
+    for alias in shard_aliases():
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        Comment.objects.using(alias).filter(author_id=user_id).delete()
+        Post.objects.using(alias).filter(author_id=user_id).delete()
+        User.objects.using(alias).filter(pk=user_id).delete()
+    cache.delete(author_key(user_id))
+
+
+class ShardedQuerySet:
+    """
+    Один запрос ко всем шардам сразу, со слиянием результатов.
+
+    Поддерживает то, что нужно пагинаторам: filter, order_by, count и
+    срезы. Срез [a:b] берёт первые b строк каждого шарда в нужном
+    порядке и сливает отсортированные потоки через heapq.merge, поэтому
+    глубокие страницы дороже; для них есть постраничный вывод по ключу.
+    Авторы и группы подставляются из default одним запросом на модель.
+    """
+    ordered = True
+
+    def __init__(self, querysets, ordering=DEFAULT_ORDERING):
+        self.querysets = querysets
+        self.ordering = ordering
+
+    def _clone(self, querysets, ordering=None):
+        return ShardedQuerySet(querysets, ordering or self.ordering)
+
+    def filter(self, *args, **kwargs):
+        return self._clone([
+            queryset.filter(*args, **kwargs) for queryset in self.querysets
+        ])
+
+    def order_by(self, *fields):
+        return self._clone(
+            [queryset.order_by(*fields) for queryset in self.querysets],
+            fields
+        )
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def key(self, obj):
+        return tuple(getattr(obj, name.lstrip('-')) for name in self.ordering)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start = item.start or 0
+        streams = [
+            queryset.order_by(*self.ordering)[:item.stop]
+            for queryset in self.querysets
+        ]
+        rows = list(islice(
+            heapq.merge(
+                *streams,
+                key=self.key,
+                reverse=self.ordering[0].startswith('-')
+            ),
+            start,
+            item.stop
+        ))
+        attach_references(rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __len__(self):
+        return self.count()
+
+
+def attach_references(posts):
+    users = User.objects.in_bulk({post.author_id for post in posts})
+    groups = Group.objects.in_bulk(
+        {post.group_id for post in posts if post.group_id is not None}
+    )
+    for post in posts:
+        Post.author.field.set_cached_value(post, users.get(post.author_id))
+        Post.group.field.set_cached_value(post, groups.get(post.group_id))
+
+
+def scatter(queryset):
+    """queryset по всем шардам; без шардирования возвращается как есть."""
+    if not is_sharded():
+        return queryset
+    queryset = queryset.select_related(None)
+    return ShardedQuerySet(
+        [queryset.using(alias) for alias in shard_aliases()]
+    )
+
+
+def get_post_or_404(username, post_id):
+    """
+    Запись по имени автора и id: автор ищется в default, запись - в
+    его шарде. Без шардирования - один запрос, как раньше.
+    """
+    if not is_sharded():
+        return get_object_or_404(
+            Post.objects.select_related('author', 'group'),
+            author__username=username,
+            id=post_id
+        )
+    author = get_object_or_404(User, username=username)
+    post = get_object_or_404(
+        Post.objects.using(shard_for_author(author.pk)),
+        author_id=author.pk,
+        pk=post_id
+    )
+    attach_references([post])
+    return post
+
+
+def posts_in_bulk(ids):
+    """{id: запись} по id из всех шардов, с авторами и группами."""
+    if not is_sharded():
+        return Post.objects.select_related('author', 'group').in_bulk(ids)
+    posts = {}
+    for alias in shard_aliases():
+        posts.update(Post.objects.using(alias).in_bulk(ids))
+    attach_references(list(posts.values()))
+    return posts
+
+
+def followed_posts(user):
+    """Записи авторов, на которых подписан user, только из их шардов."""
+    by_shard = {}
+    for author_id in followed_ids(user.pk):
+        by_shard.setdefault(shard_for_author(author_id), []).append(
+            author_id
+        )
+    return ShardedQuerySet([
+        Post.objects.using(alias).filter(author_id__in=author_ids)
+        for alias, author_ids in by_shard.items()
+    ])
+
+
+def shard_loads():
+    """{шард: {author_id: число записей}} по фактическим данным шардов."""
+    return {
+        alias: dict(
+            Post.objects.using(alias).order_by().values_list(
+                'author_id'
+            ).annotate(total=Count('pk')).values_list('author_id', 'total')
+        )
+        for alias in shard_aliases()
+    }
+
+
+def plan_rebalance(tolerance=0.1):
+    """
+    Жадный план переносов: с самого загруженного шарда на самый
+    свободный переезжает крупнейший автор, который не больше половины
+    разрыва, пока разрыв больше tolerance от средней загрузки.
+    """
+    loads = shard_loads()
+    totals = {alias: sum(authors.values()) for alias, authors in loads.items()}
+    limit = max(1, tolerance * sum(totals.values()) / len(totals))
+    moves = []
+    while True:
+        heavy = max(totals, key=totals.get)
+        light = min(totals, key=totals.get)
+        gap = totals[heavy] - totals[light]
+        if gap <= limit:
+            return moves
+        candidates = [
+            (posts, author_id)
+            for author_id, posts in loads[heavy].items()
+            if posts <= gap / 2
+        ]
+        if not candidates:
+            return moves
+        posts, author_id = max(candidates)
+        del loads[heavy][author_id]
+        loads[light][author_id] = posts
+        totals[heavy] -= posts
+        totals[light] += posts
+        moves.append((author_id, heavy, light, posts))
+
+
+def delete_rows(alias, model, ids, batch_size=500):
+    table = connections[alias].ops.quote_name(model._meta.db_table)
+    with connections[alias].cursor() as cursor:
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            cursor.execute(
+                'DELETE FROM %s WHERE id IN (%s)' % (
+                    table,
+                    ', '.join(['%s'] * len(batch))
+                ),
+                batch
+            )
+
+
+def lock_for_writes(alias):
+    """
+    Блокировка записи в шард до конца текущей транзакции: остальные
+    писатели ждут коммита (на SQLite - busy_timeout).
+    """
+    connection = connections[alias]
+    if connection.vendor == 'sqlite':
+        # Даже UPDATE без подходящих строк берёт RESERVED-блокировку.
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE %s SET id = id WHERE id < 0' % (
+                connection.ops.quote_name(Post._meta.db_table)
+            ))
+
+
+def author_rows(alias, author_id):
+    """id записей автора и комментариев к ним в шарде alias."""
+    post_ids = set(Post.objects.using(alias).filter(
+        author_id=author_id
+    ).values_list('pk', flat=True))
+    comment_ids = set(Comment.objects.using(alias).filter(
+        post_id__in=post_ids
+    ).values_list('pk', flat=True))
+    return post_ids, comment_ids
+
+
+def copy_rows(source, target, post_ids, comment_ids, batch_size=500):
+    """Копирует строки с теми же id и датами, ссылки - заранее."""
+    post_ids = sorted(post_ids)
+    comment_ids = sorted(comment_ids)
+    for start in range(0, max(len(post_ids), len(comment_ids)), batch_size):
+        posts = list(Post.objects.using(source).filter(
+            pk__in=post_ids[start:start + batch_size]
+        ))
+        comments = list(Comment.objects.using(source).filter(
+            pk__in=comment_ids[start:start + batch_size]
+        ))
+        copy_reference_rows(
+            target,
+            {post.author_id for post in posts}
+            | {comment.author_id for comment in comments},
+            {post.group_id for post in posts}
+        )
+        Post.objects.using(target).bulk_create(posts)
+        Comment.objects.using(target).bulk_create(comments)
+
+
+def catch_up(author_id, source, target, copied, started):
+    """
+    Доводит копию в target до состояния source: новые строки копирует,
+    исчезнувшие удаляет, а записи, изменённые после started или
+    потерявшие и получившие комментарии, переписывает целиком.
+    """
+    post_ids, comment_ids = author_rows(source, author_id)
+    copied_posts, copied_comments = copied
+    new_comments = comment_ids - copied_comments
+    gone_comments = copied_comments - comment_ids
+    changed = set(Post.objects.using(source).filter(
+        author_id=author_id,
+        edited__gte=started
+    ).values_list('pk', flat=True)) | set(
+        Comment.objects.using(source).filter(
+            pk__in=new_comments
+        ).values_list('post_id', flat=True)
+    ) | set(Comment.objects.using(target).filter(
+        pk__in=gone_comments
+    ).values_list('post_id', flat=True))
+    changed &= copied_posts & post_ids
+    with transaction.atomic(using=target), original_dates():
+        delete_rows(target, Comment, sorted(gone_comments))
+        delete_rows(target, Post, sorted(copied_posts - post_ids))
+        copy_rows(source, target, post_ids - copied_posts, new_comments)
+        Post.objects.using(target).bulk_update(
+            Post.objects.using(source).filter(pk__in=changed),
+            [
+                field.name for field in Post._meta.concrete_fields
+                if not field.primary_key
+            ]
+        )
+    return post_ids, comment_ids
+
+
+def move_author(author_id, target, batch_size=500):
+    """
+    Переносит записи автора и комментарии к ним в шард target.
+
+    Строки копируются с теми же id и датами без блокировок. Затем под
+    блокировкой записи в старый шард копия догоняется: строки, которые
+    появились, изменились или удалились за время копирования, переносятся
+    ещё раз. Там же автор закрепляется за новым шардом, а его строки
+    удаляются из старого. Запись, начатая ещё со старым шардом, дождётся
+    блокировки и попадёт в старый шард - такие остатки переносятся
+    следующим проходом, а комментарий к уже удалённой записи не пройдёт
+    проверку внешнего ключа и вернёт ошибку. Сигналы не срабатывают:
+    счётчики, ленты и индекс поиска от шарда не зависят.
+    """
+    source = shard_for_author(author_id)
+    if source == target:
+        return 0
+    moved = 0
+    while True:
+        started = timezone.now()
+        copied = author_rows(source, author_id)
+        with transaction.atomic(using=target), original_dates():
+            copy_rows(source, target, *copied, batch_size=batch_size)
+        with transaction.atomic(using=source):
+            lock_for_writes(source)
+            post_ids, comment_ids = catch_up(
+                author_id,
+                source,
+                target,
+                copied,
+                started
+            )
+            AuthorShard.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+                author_id=author_id,
+                defaults={'shard': target}
+            )
+            cache.set(author_key(author_id), target, SHARD_CACHE_TIMEOUT)
+            delete_rows(source, Comment, sorted(comment_ids))
+            delete_rows(source, Post, sorted(post_ids))
+        cache.delete_many([post_key(pk) for pk in post_ids])
+        moved += len(post_ids)
+        if not Post.objects.using(source).filter(
+            author_id=author_id
+        ).exists():
+            return moved
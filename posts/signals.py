@@ -0,0 +1,284 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import feeds, follow_graph, search, sharding
+from .cards import author_card_scope, group_card_scope
+from .counters import change_author_stats, change_comments_count
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+from .page_cache import (author_scope, bump_generation_on_commit,
+                         group_scope, index_scope)
+from .paginators import count_cache_key, reset_counts
+
+USER_CARD_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def post_count_keys(post):
+    keys = [
+        count_cache_key('index'),
+        count_cache_key('author', post.author_id),
+    ]
+    for group_id in {post.group_id, getattr(post, '_old_group_id', None)}:
+        if group_id is not None:
+            keys.append(count_cache_key('group', group_id))
+    return keys
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_group(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._old_group_id = Post.objects.db_manager(
+            hints={'instance': instance}
+        ).filter(pk=instance.pk).values_list('group_id', flat=True).first()
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Comment)
+def prepare_shard_write(sender, instance, raw=False, **kwargs):
+    if not raw and sharding.is_sharded():
+        sharding.prepare_write(instance)
+
+
+@receiver(post_delete, sender=User)
+def delete_sharded_rows(sender, instance, using=None, **kwargs):
+    # Копии пользователя в шардах удаляются отсюда же: им повторять
+    # не нужно.
+    if using == DEFAULT_DB_ALIAS and sharding.is_sharded():
+        sharding.delete_author_rows(instance.pk)
+
+
+def post_page_scopes(author_username, group_ids):
+    scopes = [index_scope(), author_scope(author_username)]
+    group_ids = [pk for pk in group_ids if pk is not None]
+    if group_ids:
+        slugs = Group.objects.filter(pk__in=group_ids).values_list(
+            'slug',
+            flat=True
+        )
+        scopes.extend(group_scope(slug) for slug in slugs)
+    return scopes
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def reset_post_counts(sender, instance, using=None, **kwargs):
+    reset_counts(post_count_keys(instance), using)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_post_pages(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        bump_generation_on_commit(
+            *post_page_scopes(
+                instance.author.username,
+                {instance.group_id, getattr(instance, '_old_group_id', None)}
+            ),
+            using=using
+        )
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_comment_pages(sender, instance, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    post = Post.objects.using(using).filter(
+        pk=instance.post_id
+    ).values_list(
+        'author__username',
+        'group_id'
+    ).first()
+    if post is not None:
+        bump_generation_on_commit(
+            *post_page_scopes(post[0], [post[1]]),
+            using=using
+        )
+
+
+@receiver(post_save, sender=Follow)
+def add_to_follow_graph(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        follow_graph.follow_changed(
+            instance.user_id,
+            instance.author_id,
+            following=True
+        )
+
+
+@receiver(post_delete, sender=Follow)
+def remove_from_follow_graph(sender, instance, **kwargs):
+    follow_graph.follow_changed(
+        instance.user_id,
+        instance.author_id,
+        following=False
+    )
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def reset_follow_count(sender, instance, using=None, **kwargs):
+    reset_counts([count_cache_key('follow', instance.user_id)], using)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_follow_pages(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        usernames = User.objects.filter(
+            pk__in=[instance.user_id, instance.author_id]
+        ).values_list('username', flat=True)
+        bump_generation_on_commit(
+            *(author_scope(username) for username in usernames),
+            using=using
+        )
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, raw=False, **kwargs):
+    # С шардами лента собирается из шардов при чтении, а FeedEntry
+    # ссылается на записи в default.
+    if created and not raw and not sharding.is_sharded():
+        feeds.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and not sharding.is_sharded():
+        feeds.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_feed(sender, instance, **kwargs):
+    feeds.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Comment)
+def increment_comments_count(sender, instance, created, raw=False,
+                             using=None, **kwargs):
+    if created and not raw:
+        change_comments_count(instance.post_id, 1, using)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comments_count(sender, instance, using=None, **kwargs):
+    change_comments_count(instance.post_id, -1, using)
+
+
+@receiver(post_save, sender=User)
+def create_author_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        AuthorStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def increment_posts_count(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_author_stats(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def decrement_posts_count(sender, instance, **kwargs):
+    change_author_stats(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Follow)
+def increment_follow_counts(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_author_stats(instance.author_id, followers_count=1)
+        change_author_stats(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def decrement_follow_counts(sender, instance, **kwargs):
+    change_author_stats(instance.author_id, followers_count=-1)
+    change_author_stats(instance.user_id, following_count=-1)
+
+
+@receiver(pre_save, sender=Group)
+def remember_group_card(sender, instance, **kwargs):
+    instance._old_card = None
+    if instance.pk is not None:
+        instance._old_card = Group.objects.filter(
+            pk=instance.pk
+        ).values_list('slug', 'title').first()
+
+
+@receiver(post_save, sender=Group)
+def refresh_group_cards(sender, instance, created, raw=False, using=None,
+                        **kwargs):
+    old_card = getattr(instance, '_old_card', None)
+    if created or raw or old_card is None:
+        return
+    if old_card == (instance.slug, instance.title):
+        # Карточки показывают только slug и название.
+        return
+    # Карточки с названием группы лежат и на страницах их авторов.
+    author_ids = set()
+    for alias in sharding.shard_aliases():
+        posts = Post.objects.using(alias).filter(group=instance)
+        author_ids.update(posts.order_by().values_list(
+            'author_id',
+            flat=True
+        ).distinct())
+    usernames = User.objects.filter(pk__in=author_ids).values_list(
+        'username',
+        flat=True
+    )
+    bump_generation_on_commit(
+        group_card_scope(instance.pk),
+        index_scope(),
+        group_scope(instance.slug),
+        group_scope(old_card[0]),
+        *(author_scope(username) for username in usernames),
+        using=using
+    )
+
+
+@receiver(pre_save, sender=User)
+def remember_author_names(sender, instance, update_fields=None, **kwargs):
+    instance._old_names = None
+    if instance.pk is not None and (
+        update_fields is None or set(update_fields) & set(USER_CARD_FIELDS)
+    ):
+        instance._old_names = User.objects.filter(
+            pk=instance.pk
+        ).values_list(*USER_CARD_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def refresh_author_cards(sender, instance, created, raw=False, using=None,
+                         **kwargs):
+    old_names = getattr(instance, '_old_names', None)
+    if created or raw or old_names is None:
+        return
+    old_username = old_names[0]
+    if instance.username != old_username:
+        # Карточки с именем автора лежат и на страницах его групп.
+        group_ids = instance.posts.order_by().values_list(
+            'group_id',
+            flat=True
+        ).distinct()
+        bump_generation_on_commit(
+            author_card_scope(instance.pk),
+            *post_page_scopes(instance.username, group_ids),
+            author_scope(old_username),
+            using=using
+        )
+    elif old_names[1:] != (instance.first_name, instance.last_name):
+        # Полное имя есть только в шапке страницы автора.
+        bump_generation_on_commit(author_scope(instance.username), using=using)
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, raw=False, update_fields=None,
+                    **kwargs):
+    if raw:
+        return
+    if update_fields is None or 'text' in update_fields:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post_text(sender, instance, **kwargs):
+    search.unindex_post(instance.pk)
@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import transaction
+
+SLOW_QUERY_THRESHOLD_MS = 100
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+PLAN_CACHE_SIZE = 256
+STACK_DEPTH = 8
+PARAMS_LIMIT = 500
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+TABLE_RE = re.compile(r'(?:FROM|JOIN)\s+"?(\w+)"?', re.IGNORECASE)
+PARAMS_TABLE_PREFIX = 'posts_'
+
+local = threading.local()
+handlers = {}
+plans = OrderedDict()
+plans_lock = threading.Lock()
+
+
+def threshold_ms():
+    return getattr(
+        settings, 'SLOW_QUERY_THRESHOLD_MS', SLOW_QUERY_THRESHOLD_MS
+    )
+
+
+def log_path():
+    return getattr(
+        settings,
+        'SLOW_QUERY_LOG',
+        os.path.join(settings.BASE_DIR, 'logs', 'slow_queries.log')
+    )
+
+
+def get_handler(path):
+    """Обработчик на каждый путь; заново открывает удалённый журнал."""
+    handler = handlers.get(path)
+    if handler is None or not os.path.exists(path):
+        if handler is not None:
+            handler.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = handlers[path] = RotatingFileHandler(
+            path,
+            maxBytes=getattr(settings, 'SLOW_QUERY_LOG_MAX_BYTES',
+                             LOG_MAX_BYTES),
+            backupCount=getattr(settings, 'SLOW_QUERY_LOG_BACKUP_COUNT',
+                                LOG_BACKUP_COUNT),
+            encoding='utf-8'
+        )
+    return handler
+
+
+def fingerprint(sql):
+    """Одинаковые запросы с IN разной длины считаются одним."""
+    return IN_LIST_RE.sub('IN (...)', sql)
+
+
+def stack_summary():
+    """Последние кадры из кода проекта, без Django и библиотек."""
+    frames = [
+        f'{os.path.relpath(frame.filename, settings.BASE_DIR)}:'
+        f'{frame.lineno} {frame.name}'
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(settings.BASE_DIR)
+        and 'site-packages' not in frame.filename
+        and not frame.filename.endswith('slow_queries.py')
+    ]
+    return frames[-STACK_DEPTH:]
+
+
+def loggable_params(sql, params):
+    """
+    Параметры пишутся только для SELECT по таблицам записей: в запросах
+    к пользователям и сессиям это хеши паролей и содержимое сессий.
+    """
+    tables = TABLE_RE.findall(sql)
+    if sql.lstrip()[:6].upper() == 'SELECT' and tables and all(
+        table.startswith(PARAMS_TABLE_PREFIX) for table in tables
+    ):
+        return repr(params)[:PARAMS_LIMIT]
+    return None
+
+
+def query_plan(connection, prefix, sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f'{prefix} {sql}', params)
+        return [' '.join(str(value) for value in row)
+                for row in cursor.fetchall()]
+
+
+def explain(connection, sql, params):
+    """
+    План запроса; для одного и того же SQL берётся из кэша процесса,
+    чтобы частый медленный запрос не удваивал нагрузку на базу.
+    """
+    key = fingerprint(sql)
+    with plans_lock:
+        if key in plans:
+            plans.move_to_end(key)
+            return plans[key]
+    prefix = (
+        'EXPLAIN QUERY PLAN' if connection.vendor == 'sqlite' else 'EXPLAIN'
+    )
+    local.explaining = True
+    try:
+        if connection.in_atomic_block:
+            # Савепоинт: неудачный EXPLAIN не должен ломать транзакцию.
+            with transaction.atomic(using=connection.alias):
+                plan = query_plan(connection, prefix, sql, params)
+        else:
+            # В autocommit atomic начал бы BEGIN IMMEDIATE и взял бы
+            # блокировку записи ради чтения плана.
+            plan = query_plan(connection, prefix, sql, params)
+    except Exception as error:
+        plan = [f'EXPLAIN не удался: {error}']
+    finally:
+        local.explaining = False
+    with plans_lock:
+        plans[key] = plan
+        while len(plans) > PLAN_CACHE_SIZE:
+            plans.popitem(last=False)
+    return plan
+
+
+class SlowQueryLogger:
+    """execute_wrapper, который пишет в журнал запросы дольше порога."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(local, 'explaining', False):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            threshold = threshold_ms()
+            if threshold is not None and duration >= threshold:
+                self.log(sql, params, many, duration)
+
+    def log(self, sql, params, many, duration):
+        plan = None
+        if not many and sql.lstrip()[:6].upper() in ('SELECT', 'WITH'):
+            plan = explain(self.connection, sql, params)
+        record = {
+            'time': time.time(),
+            'duration_ms': round(duration, 3),
+            'alias': self.connection.alias,
+            'view': getattr(local, 'view', None),
+            'sql': sql,
+            'params': loggable_params(sql, params),
+            'many': many,
+            'stack': stack_summary(),
+            'plan': plan,
+        }
+        get_handler(log_path()).handle(logging.makeLogRecord({
+            'msg': json.dumps(record, ensure_ascii=False),
+            'levelno': logging.INFO,
+        }))
+
+
+def install(sender, connection, **kwargs):
+    """Подключается к connection_created: ловит запросы и вне view."""
+    if not any(
+        isinstance(wrapper, SlowQueryLogger)
+        for wrapper in connection.execute_wrappers
+    ):
+        connection.execute_wrappers.append(SlowQueryLogger(connection))
+
+
+class SlowQueryMiddleware:
+    """Запоминает имя view, чтобы в журнале было видно, кто спросил."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            local.view = None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        local.view = (match.url_name or match.view_name) if match else None
+
+
+def read_log(path):
+    """Записи журнала вместе с ротированными файлами, от старых к новым."""
+    paths = [f'{path}.{number}' for number in range(
+        getattr(settings, 'SLOW_QUERY_LOG_BACKUP_COUNT', LOG_BACKUP_COUNT),
+        0,
+        -1
+    )] + [path]
+    for name in paths:
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding='utf-8') as source:
+            for line in source:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def top_offenders(records, limit=10):
+    """Запросы, сгруппированные по fingerprint, по убыванию общего времени."""
+    groups = {}
+    for record in records:
+        key = fingerprint(record['sql'])
+        group = groups.setdefault(key, {
+            'sql': key,
+            'count': 0,
+            'total_ms': 0,
+            'max_ms': 0,
+            'views': set(),
+            'plan': None,
+            'stack': None,
+        })
+        group['count'] += 1
+        group['total_ms'] += record['duration_ms']
+        if record['duration_ms'] >= group['max_ms']:
+            group['max_ms'] = record['duration_ms']
+            group['stack'] = record['stack']
+        if record['view']:
+            group['views'].add(record['view'])
+        group['plan'] = record['plan'] or group['plan']
+    return sorted(
+        groups.values(),
+        key=lambda group: group['total_ms'],
+        reverse=True
+    )[:limit]
@@ -0,0 +1,11 @@
+from django import template
+
+from posts.follow_graph import is_following
+
+register = template.Library()
+
+
+@register.filter
+def follows(user, author):
+    """{% if user|follows:author %} - проверка по графу подписок из кэша."""
+    return user.is_authenticated and is_following(user.pk, author.pk)
@@ -0,0 +1,10 @@
+from django import template
+
+from posts.cards import get_card
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_card(post):
+    return get_card(post)
@@ -0,0 +1,18 @@
+from django import template
+
+from posts.thumbnails import lookup, retry_thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def ready_thumbnail(post, size):
+    if not post.image:
+        return None
+    prefetched = getattr(post, '_thumbnails', {})
+    if size in prefetched:
+        return prefetched[size]
+    thumbnail = lookup.get_ready_thumbnail(post.image, size)
+    if thumbnail is None:
+        retry_thumbnails(post.id)
+    return thumbnail
@@ -1,14 +1,39 @@
+import json
+import os
 import shutil
+import tempfile
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django.contrib.auth.models import AnonymousUser
-from django.core.cache import cache
+from django.core.cache import cache, caches
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from sorl.thumbnail.base import ThumbnailBackend
 
-from posts.models import Comment, Follow, Group, Post, User
+from posts import (cards, feeds, follow_graph, search, sharding,
+                   slow_queries, thumbnails)
+from posts.counters import (id_batches, rebuild_author_stats,
+                            recount_comments)
+from posts.exports import export_rows
+from posts.models import (AuthorShard, AuthorStats, Comment, FeedEntry, Follow,
+                          Group, Post, User)
+from posts.page_cache import get_generation, index_scope
+from posts.paginators import COMMENTS_PER_PAGE, count_cache_key
+from yatube.replicas import copy_database
 
 TEST_DIR = 'test_data'
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21\xf9\x04'
+    b'\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02'
+    b'\x02\x4c\x01\x00\x3b'
+)
 
 
 @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
@@ -40,14 +65,9 @@ class TestPostsApp(TestCase):
         return post, pages
 
     def upload_img_file(self):
-        small_gif = (
-            b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21\xf9\x04'
-            b'\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02'
-            b'\x02\x4c\x01\x00\x3b'
-        )
         file = SimpleUploadedFile(
             'small.jpg',
-            content=small_gif,
+            content=SMALL_GIF,
             content_type='image/jpg'
         )
         return file
@@ -203,6 +223,132 @@ class TestPostsApp(TestCase):
                 response = self.client_anon.get(page)
                 self.assertContains(response, '<img')
 
+    @override_settings(THUMBNAILS_IN_BACKGROUND=True)
+    def test_thumbnails_are_generated_in_background(self):
+        submitted = []
+
+        class Executor:
+            def submit(self, func, *args):
+                submitted.append(args)
+
+        with mock.patch.object(thumbnails, 'executor', Executor()), \
+                mock.patch.object(
+                    thumbnails.transaction,
+                    'on_commit',
+                    lambda func, using=None: func()
+                ):
+            self.client_auth.post(
+                reverse('new_post'),
+                {'text': 'with image', 'image': self.upload_img_file()}
+            )
+            post = Post.objects.get()
+            url = reverse('post', args=[self.author.username, post.id])
+            with mock.patch.object(
+                ThumbnailBackend,
+                '_create_thumbnail'
+            ) as create:
+                response = self.client_anon.get(url)
+        self.assertEqual(
+            submitted,
+            [(post.id,)],
+            msg='Показ страницы повторно поставил ещё идущую генерацию'
+        )
+        create.assert_not_called()
+        self.assertNotContains(
+            response,
+            post.image.url,
+            msg_prefix='Вместо заглушки отдан исходный файл'
+        )
+        self.assertContains(response, 'data-pending')
+        thumbnails.generate_thumbnails(post.id)
+        thumbnail = thumbnails.lookup.get_ready_thumbnail(post.image, 'card')
+        self.assertIsNotNone(thumbnail, msg='Миниатюра не создана')
+        with mock.patch.object(
+            ThumbnailBackend,
+            '_create_thumbnail'
+        ) as create:
+            response = self.client_anon.get(url)
+        create.assert_not_called()
+        self.assertContains(response, thumbnail.url)
+
+    @override_settings(THUMBNAILS_IN_BACKGROUND=True)
+    def test_lost_generation_is_retried(self):
+        post = Post.objects.create(
+            text='Image',
+            author=self.author,
+            image='posts/lost.jpg'
+        )
+        submitted = []
+        stored = []
+
+        class Executor:
+            def submit(self, func, *args):
+                submitted.append(args)
+
+        def spy_set(key, value, timeout=None, **kwargs):
+            stored.append((str(getattr(value, 'content', value)), timeout))
+            return cache_set(key, value, timeout, **kwargs)
+
+        def spy_set_many(data, timeout=None, **kwargs):
+            for value in data.values():
+                stored.append((str(value), timeout))
+            return cache_set_many(data, timeout, **kwargs)
+
+        backend = caches['default']
+        cache_set, cache_set_many = backend.set, backend.set_many
+        with mock.patch.object(thumbnails, 'executor', Executor()), \
+                mock.patch.object(
+                    thumbnails.transaction,
+                    'on_commit',
+                    lambda func, using=None: func()
+                ), \
+                mock.patch.object(backend, 'set', spy_set), \
+                mock.patch.object(backend, 'set_many', spy_set_many):
+            self.client_anon.get(reverse('index'))
+            self.client_anon.get(
+                reverse('post', args=[self.author.username, post.id])
+            )
+            self.assertEqual(
+                submitted,
+                [(post.id,)],
+                msg='Генерация не поставлена повторно или поставлена дважды'
+            )
+            cache.delete(thumbnails.pending_key(post.id))
+            cache.clear()
+            self.client_anon.get(reverse('index'))
+        self.assertEqual(submitted, [(post.id,), (post.id,)])
+        pending = [
+            timeout for value, timeout in stored
+            if 'data-pending' in value
+        ]
+        self.assertTrue(pending)
+        self.assertLessEqual(
+            max(pending),
+            thumbnails.THUMBNAIL_RETRY_SECONDS,
+            msg='Страница с заглушкой закэширована надолго'
+        )
+
+    def test_page_thumbnails_are_looked_up_in_one_batch(self):
+        for i in range(10):
+            Post.objects.create(
+                text=f'Image {i}',
+                author=self.author,
+                image=f'posts/image_{i}.jpg'
+            )
+        cache.clear()
+        with mock.patch.object(
+            thumbnails.lookup,
+            'get_ready_thumbnail',
+            side_effect=AssertionError('миниатюра ищется поштучно')
+        ), CaptureQueriesContext(connection) as queries:
+            response = self.client_anon.get(reverse('index'))
+        self.assertEqual(len(response.context['page']), 10)
+        kvstore_queries = [
+            query for query in queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        self.assertEqual(len(kvstore_queries), 1)
+
     def test_upload_not_img(self):
         file = SimpleUploadedFile(
             'Image.jpg',
@@ -235,17 +381,50 @@ class TestPostsApp(TestCase):
         )
 
     def test_index_cache(self):
-        response_1 = self.client_auth.get(reverse('index'))
-        Post.objects.create(
+        post = Post.objects.create(
             author=self.author,
             group=self.group,
             text=self.text,
         )
+        response_1 = self.client_auth.get(reverse('index'))
+        Post.objects.filter(pk=post.pk).update(text='Not through save')
         response_2 = self.client_auth.get(reverse('index'))
-        self.assertEqual(response_1.content, response_2.content)
-        cache.clear()
+        self.assertEqual(
+            response_1.content,
+            response_2.content,
+            msg='Главная страница не кэшируется'
+        )
+        Post.objects.create(
+            author=self.author,
+            group=self.group,
+            text='Fresh post',
+        )
         response_3 = self.client_auth.get(reverse('index'))
-        self.assertNotEqual(response_1.content, response_3.content)
+        self.assertContains(
+            response_3,
+            'Fresh post',
+            msg_prefix='Новая запись должна сразу сбрасывать кэш главной'
+        )
+
+    def test_group_and_profile_cache_are_scoped(self):
+        other = Group.objects.create(title='Other', slug='other')
+        Post.objects.create(author=self.author, group=other, text='Old')
+        pages = (
+            reverse('group', args=[self.group.slug]),
+            reverse('group', args=[other.slug]),
+            reverse('profile', args=[self.author.username]),
+        )
+        before = [self.client_anon.get(page).content for page in pages]
+        Post.objects.filter(group=other).update(text='Changed quietly')
+        Post.objects.create(author=self.author, group=self.group, text='New')
+        after = [self.client_anon.get(page).content for page in pages]
+        self.assertNotEqual(before[0], after[0])
+        self.assertEqual(
+            before[1],
+            after[1],
+            msg='Запись в одной группе сбрасывает кэш другой'
+        )
+        self.assertNotEqual(before[2], after[2])
 
     def test_auth_user_comment(self):
         post, pages = self.prepare_post_pages(self.group)
@@ -277,6 +456,23 @@ class TestPostsApp(TestCase):
             msg='Комментарий не соответствует записи'
         )
 
+    def test_invalid_comment_keeps_post_comments(self):
+        post, pages = self.prepare_post_pages(self.group)
+        Comment.objects.create(post=post, author=self.author, text='Первый')
+        response = self.client_auth.post(
+            reverse('add_comment', args=[post.author, post.id]),
+            {'text': ''}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+        self.assertEqual(
+            [comment.text for comment in response.context['comments']],
+            ['Первый'],
+            msg='После ошибки в форме пропали комментарии'
+        )
+        self.assertContains(response, 'Первый')
+        self.assertEqual(response.context['author'], post.author)
+
     def test_anon_user_comment(self):
         post, pages = self.prepare_post_pages(self.group)
         data = {'text': 'Коммент'}
@@ -351,6 +547,1638 @@ class TestPostsApp(TestCase):
         )
 
 
+@override_settings(
+    MEDIA_ROOT=(TEST_DIR + '/media'),
+    THUMBNAILS_IN_BACKGROUND=True
+)
+class TestThumbnailExecutor(TransactionTestCase):
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+    def test_thumbnails_are_generated_by_pool(self):
+        author = User.objects.create(username='Ash')
+        post = Post.objects.create(
+            text='Образец',
+            author=author,
+            image=SimpleUploadedFile('sample.gif', SMALL_GIF, 'image/gif')
+        )
+        futures = []
+        submit = thumbnails.executor.submit
+
+        def spy(func, *args):
+            futures.append(submit(func, *args))
+            return futures[-1]
+
+        with mock.patch.object(thumbnails.executor, 'submit', spy):
+            thumbnails.schedule_thumbnails(post)
+        self.assertEqual(len(futures), 1, msg='Генерация не ушла в пул')
+        futures[0].result(timeout=10)
+        post.refresh_from_db()
+        self.assertIsNotNone(
+            thumbnails.lookup.get_ready_thumbnail(post.image, 'card'),
+            msg='Фоновая задача не создала миниатюру'
+        )
+
+
+class TestCursorPagination(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create(username='Syd')
+        Post.objects.bulk_create(
+            Post(text=f'Post {i}', author=self.author) for i in range(25)
+        )
+        cache.clear()
+
+    def walk(self, url, key):
+        seen = []
+        response = self.client.get(url, {'cursor': ''})
+        while True:
+            page = response.context['page']
+            seen.extend(post.id for post in page)
+            cursor = getattr(page, key)
+            if cursor is None:
+                return seen, response
+            response = self.client.get(url, {'cursor': cursor})
+
+    def test_cursor_pages_cover_all_posts(self):
+        Post.objects.update(pub_date=Post.objects.first().pub_date)
+        expected = list(
+            Post.objects.order_by('-pub_date', '-id').values_list(
+                'id',
+                flat=True
+            )
+        )
+        for url in (
+            reverse('index'),
+            reverse('profile', args=[self.author.username]),
+        ):
+            with self.subTest(url=url):
+                seen, response = self.walk(url, 'next_cursor')
+                self.assertEqual(
+                    seen,
+                    expected,
+                    msg='Курсорная пагинация теряет или дублирует записи'
+                )
+                self.assertEqual(len(response.context['page']), 5)
+                self.assertContains(response, '?cursor=')
+
+    def test_cursor_previous_page(self):
+        url = reverse('index')
+        first = self.client.get(url, {'cursor': ''}).context['page']
+        second = self.client.get(
+            url,
+            {'cursor': first.next_cursor}
+        ).context['page']
+        back = self.client.get(
+            url,
+            {'cursor': second.previous_cursor}
+        ).context['page']
+        self.assertFalse(first.has_previous())
+        self.assertEqual(
+            [post.id for post in back],
+            [post.id for post in first],
+            msg='Ссылка на предыдущую страницу ведёт не туда'
+        )
+
+    def test_cursor_page_skips_count(self):
+        url = reverse('index')
+        first = self.client.get(url, {'cursor': ''}).context['page']
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'cursor': first.next_cursor})
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries),
+            msg='Курсорная пагинация не должна считать записи'
+        )
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse('index'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 10)
+
+
+class TestCachedCountPaginator(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create(username='Barrett')
+        self.group = Group.objects.create(title='Piper', slug='piper')
+        Post.objects.bulk_create(
+            Post(text=f'Post {i}', author=self.author, group=self.group)
+            for i in range(300)
+        )
+        self.url = reverse('group', args=[self.group.slug])
+        cache.clear()
+
+    def test_page_links_are_elided(self):
+        response = self.client.get(self.url, {'page': 15})
+        page = response.context['page']
+        self.assertEqual(
+            page.elided_page_range,
+            [1, '…', 13, 14, 15, 16, 17, '…', 30],
+            msg='Проверь окно ссылок на страницы'
+        )
+        self.assertLess(
+            response.content.decode().count('class="page-item'),
+            15,
+            msg='Паджинатор выводит ссылки на все страницы'
+        )
+
+    def test_count_is_cached_and_reset_on_write(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'page': 2})
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries),
+            msg='Число записей должно браться из кэша'
+        )
+        self.assertEqual(response.context['paginator'].count, 300)
+        Post.objects.create(
+            text='One more',
+            author=self.author,
+            group=self.group
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response.context['paginator'].count,
+            301,
+            msg='Кэш числа записей не сбрасывается после записи'
+        )
+
+
+class TestFeedFanOut(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='Waters')
+        self.readers = [
+            User.objects.create(username=f'Reader_{i}') for i in range(5)
+        ]
+        for reader in self.readers:
+            Follow.objects.create(user=reader, author=self.author)
+
+    def test_new_post_is_pushed_to_followers(self):
+        post = Post.objects.create(text='Echoes', author=self.author)
+        self.assertEqual(
+            set(post.feed_entries.values_list('user', flat=True)),
+            {reader.id for reader in self.readers},
+            msg='Запись не попала в ленты подписчиков'
+        )
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        Post.objects.create(text='Echoes', author=self.author)
+        Post.objects.create(text='Time', author=self.author)
+        user = User.objects.create(username='Gilmour')
+        client = Client()
+        client.force_login(user)
+        client.get(reverse('profile_follow', args=[self.author.username]))
+        self.assertEqual(user.feed_entries.count(), 2)
+        client.get(reverse('profile_unfollow', args=[self.author.username]))
+        self.assertEqual(
+            user.feed_entries.count(),
+            0,
+            msg='После отписки лента не очищается'
+        )
+
+    def test_large_fan_out_runs_in_background_batches(self):
+        submitted = []
+
+        class Executor:
+            def submit(self, func, *args):
+                submitted.append(args)
+
+        with mock.patch.object(feeds, 'FANOUT_SYNC_LIMIT', 2), \
+                mock.patch.object(feeds, 'executor', Executor()), \
+                mock.patch.object(
+                    feeds.transaction,
+                    'on_commit',
+                    lambda func, using=None: func()
+                ):
+            post = Post.objects.create(text='Money', author=self.author)
+        self.assertFalse(post.feed_entries.exists())
+        self.assertEqual(len(submitted), 1)
+        feeds.push_to_followers(*submitted[0], batch_size=2)
+        self.assertEqual(post.feed_entries.count(), len(self.readers))
+
+
+class TestCommentsCount(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='Mason')
+        self.post = Post.objects.create(
+            text='Interstellar',
+            author=self.author
+        )
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def test_counter_follows_comments(self):
+        self.client.post(
+            reverse('add_comment', args=[self.author.username, self.post.id]),
+            {'text': 'Overdrive'}
+        )
+        Comment.objects.create(post=self.post, author=self.author, text='2')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 2)
+        Comment.objects.first().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(
+            self.post.comments_count,
+            1,
+            msg='Счётчик не уменьшается при удалении комментария'
+        )
+        commenter = User.objects.create(username='Wright')
+        Comment.objects.create(post=self.post, author=commenter, text='3')
+        commenter.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+
+    def test_listing_does_not_query_comments(self):
+        Comment.objects.create(post=self.post, author=self.author, text='1')
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Комментариев: 1')
+        self.assertFalse(
+            any('posts_comment' in query['sql'] for query in queries),
+            msg='Карточка записи не должна запрашивать комментарии'
+        )
+
+    def test_recount_command_fixes_drift(self):
+        Comment.objects.create(post=self.post, author=self.author, text='1')
+        Post.objects.update(comments_count=7)
+        out = StringIO()
+        call_command('recount_comments', stdout=out)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertIn('1', out.getvalue())
+
+
+class TestAuthorStats(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='Wright')
+        self.reader = User.objects.create(username='Mason')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(text='Us and Them', author=self.author)
+        Post.objects.create(text='Any Colour', author=self.author)
+
+    def test_stats_follow_writes(self):
+        stats = AuthorStats.objects.get(user=self.author)
+        self.assertEqual(
+            (stats.followers_count, stats.following_count, stats.posts_count),
+            (1, 0, 2)
+        )
+        Follow.objects.all().delete()
+        Post.objects.first().delete()
+        stats.refresh_from_db()
+        self.assertEqual(
+            (stats.followers_count, stats.posts_count),
+            (0, 1),
+            msg='Статистика не обновляется при удалении'
+        )
+
+    def test_card_runs_no_aggregates(self):
+        url = reverse('profile', args=[self.author.username])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'cursor': ''})
+        self.assertContains(response, 'Подписчиков: 1')
+        self.assertContains(response, 'Записей: 2')
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries),
+            msg='Карточка автора не должна считать записи и подписки'
+        )
+
+    def test_rebuild_command_restores_stats(self):
+        AuthorStats.objects.filter(user=self.author).update(posts_count=9)
+        AuthorStats.objects.filter(user=self.reader).delete()
+        out = StringIO()
+        call_command('rebuild_author_stats', '--dry-run', stdout=out)
+        self.assertIn('2', out.getvalue())
+        call_command('rebuild_author_stats', stdout=StringIO())
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.author).posts_count,
+            2
+        )
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.reader).following_count,
+            1
+        )
+
+
+class TestFeedQueryPlans(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='Mason')
+        self.reader = User.objects.create(username='Waters')
+        self.group = Group.objects.create(title='Animals', slug='animals')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.bulk_create(
+            Post(text=f'Pigs {i}', author=self.author, group=self.group)
+            for i in range(15)
+        )
+        feeds.backfill(self.reader.id, self.author.id)
+        self.post = Post.objects.create(text='Dogs', author=self.author)
+        Comment.objects.create(post=self.post, author=self.reader, text='1')
+        self.client = Client()
+        self.client.force_login(self.reader)
+        cache.clear()
+
+    def query_plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_feed_queries_use_indexes(self):
+        urls = (
+            reverse('index'),
+            reverse('group', args=[self.group.slug]),
+            reverse('profile', args=[self.author.username]),
+            reverse('follow_index'),
+            reverse('post', args=[self.author.username, self.post.id]),
+        )
+        for url in urls:
+            for params in ({'page': 2}, {'cursor': ''}):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, params)
+                page = response.context.get('page')
+                cursor = getattr(page, 'next_cursor', None)
+                if cursor:
+                    with CaptureQueriesContext(connection) as more:
+                        self.client.get(url, {'cursor': cursor})
+                    queries.captured_queries.extend(more.captured_queries)
+                for query in queries.captured_queries:
+                    sql = query['sql']
+                    if '"posts_' not in sql or 'COUNT(' in sql:
+                        continue
+                    for step in self.query_plan(sql):
+                        with self.subTest(url=url, sql=sql, step=step):
+                            self.assertNotIn('TEMP B-TREE', step)
+                            self.assertFalse(
+                                step.startswith('SCAN')
+                                and 'INDEX' not in step,
+                                msg='Запрос читает таблицу целиком'
+                            )
+
+    def test_fan_out_reads_follow_index(self):
+        plan = self.query_plan(str(
+            Follow.objects.filter(author_id=1, user_id__gt=0).order_by(
+                'user_id'
+            ).values('user_id')[:10].query
+        ))
+        self.assertTrue(
+            any('follow_author_user_idx' in step for step in plan),
+            msg=plan
+        )
+
+
+class TestPostCardCache(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='Gilmour')
+        self.post = Post.objects.create(text='Comfortably', author=self.author)
+        self.url = reverse('profile', args=[self.author.username])
+        self.client_auth = Client()
+        self.client_auth.force_login(self.author)
+        cache.clear()
+
+    def test_edit_link_is_not_cached(self):
+        self.client.get(self.url)
+        response = self.client_auth.get(self.url)
+        self.assertContains(response, 'Редактировать')
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'Редактировать')
+
+    def test_warm_page_is_two_get_many(self):
+        self.client.get(self.url)
+        with mock.patch(
+            'posts.cards.render_card',
+            side_effect=AssertionError('карточка рендерится заново')
+        ), mock.patch.object(
+            cards.cache,
+            'get_many',
+            wraps=cards.cache.get_many
+        ) as get_many:
+            response = self.client.get(self.url, {'page': 1})
+        self.assertContains(response, 'Comfortably')
+        # Поколения авторов и групп, затем сами карточки.
+        self.assertEqual(get_many.call_count, 2)
+
+    def test_card_version_changes_on_edit_and_comment(self):
+        self.client.get(self.url)
+        self.client_auth.post(
+            reverse('post_edit', args=[self.author.username, self.post.id]),
+            {'text': 'Numb'}
+        )
+        self.assertContains(self.client.get(self.url), 'Numb')
+        Comment.objects.create(post=self.post, author=self.author, text='1')
+        self.assertContains(self.client.get(self.url), 'Комментариев: 1')
+
+    def test_unrelated_saves_keep_cards(self):
+        group = Group.objects.create(title='Pink', slug='floyd')
+        edited = Post.objects.get(pk=self.post.pk).edited
+        generation = get_generation(index_scope())
+        self.author.set_password('Money')
+        self.author.save()
+        group.description = 'Dark Side'
+        group.save()
+        self.assertEqual(
+            Post.objects.get(pk=self.post.pk).edited,
+            edited,
+            msg='Сохранение без смены имени переписывает записи автора'
+        )
+        self.assertEqual(get_generation(index_scope()), generation)
+        self.author.first_name = 'Дэвид'
+        self.author.save()
+        self.assertEqual(get_generation(index_scope()), generation)
+        self.assertContains(self.client.get(self.url), 'Дэвид')
+
+    def test_renames_refresh_cards_on_other_pages(self):
+        group = Group.objects.create(title='Pink', slug='floyd')
+        Post.objects.create(text='Wall', author=self.author, group=group)
+        edited = dict(Post.objects.values_list('pk', 'edited'))
+        group_url = reverse('group', args=[group.slug])
+        self.client.get(group_url)
+        self.client.get(self.url)
+        self.author.username = 'Waters'
+        self.author.save()
+        self.assertContains(
+            self.client.get(group_url),
+            'Waters',
+            msg_prefix='Страница группы показывает старое имя автора'
+        )
+        url = reverse('profile', args=['Waters'])
+        self.client.get(url)
+        group.title = 'Animals'
+        group.save()
+        self.assertContains(
+            self.client.get(url),
+            'Animals',
+            msg_prefix='Страница автора показывает старое название группы'
+        )
+        self.assertEqual(
+            dict(Post.objects.values_list('pk', 'edited')),
+            edited,
+            msg='Переименование переписывает записи'
+        )
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='Ripley')
+        self.weak = Post.objects.create(
+            text='Ностромо вернулся на Землю, а потом ещё долго летел',
+            author=self.author
+        )
+        self.strong = Post.objects.create(
+            text='Ностромо, Ностромо!',
+            author=self.author
+        )
+        Post.objects.create(text='Совсем о другом', author=self.author)
+        self.client = Client()
+
+    def search(self, query, **params):
+        return self.client.get(reverse('search'), {'q': query, **params})
+
+    def test_results_are_ranked(self):
+        response = self.search('ностром')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(response.context['page']),
+            [self.strong, self.weak],
+            msg='Результаты поиска должны идти по релевантности'
+        )
+        self.assertEqual(response.context['paginator'].count, 2)
+
+    def test_results_are_paginated_with_query(self):
+        for number in range(12):
+            Post.objects.create(text=f'Бишоп {number}', author=self.author)
+        response = self.search('бишоп', page=2)
+        self.assertEqual(len(response.context['page']), 2)
+        self.assertContains(response, '?q=%D0%B1%D0%B8%D1%88%D0%BE%D0%BF&amp;')
+
+    def test_index_follows_edits_and_deletes(self):
+        self.weak.text = 'Султана'
+        self.weak.save()
+        self.assertEqual(list(self.search('ностромо').context['page']), [
+            self.strong
+        ])
+        self.assertEqual(list(self.search('султана').context['page']), [
+            self.weak
+        ])
+        self.weak.delete()
+        self.assertEqual(self.search('султана').context['paginator'].count, 0)
+
+    def test_query_syntax_is_escaped(self):
+        response = self.search('"Ностромо" AND (OR*')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['paginator'].count, 0)
+        self.assertEqual(self.search('').context['paginator'].count, 0)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_post_fts')
+        self.assertEqual(self.search('ностромо').context['paginator'].count, 0)
+        out = StringIO()
+        call_command('rebuild_search_index', '--chunk-size=2', stdout=out)
+        self.assertIn('3', out.getvalue())
+        self.assertEqual(self.search('ностромо').context['paginator'].count, 2)
+
+    def test_rebuild_keeps_index_searchable(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM posts_post_fts WHERE rowid = %s',
+                [self.weak.pk]
+            )
+            cursor.execute(
+                "INSERT INTO posts_post_fts (rowid, text) "
+                "VALUES (9999, 'Ностромо удалён')"
+            )
+        found = []
+
+        def batches(queryset, size):
+            for ids in id_batches(queryset, size):
+                found.append(search.SearchResults('ностромо').count())
+                yield ids
+
+        with mock.patch.object(search, 'id_batches', batches):
+            self.assertEqual(search.rebuild_index(chunk_size=1), 3)
+        self.assertNotIn(
+            0,
+            found,
+            msg='Во время перестройки индекс пустеет'
+        )
+        self.assertEqual(
+            list(self.search('ностромо').context['page']),
+            [self.strong, self.weak],
+            msg='Перестройка не добавила пропущенную и не убрала лишнюю'
+        )
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser('Bishop', 'b@b.com', 'pass')
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'),
+            {'q': 'ностромо'}
+        )
+        self.assertEqual(
+            set(response.context['cl'].result_list),
+            {self.strong, self.weak}
+        )
+
+
+class TestImportCommunity(TestCase):
+    def setUp(self):
+        self.existing = User.objects.create(username='Hudson')
+        self.records = [
+            {'type': 'user', 'id': 1, 'username': 'Hicks'},
+            {'type': 'user', 'id': 2, 'username': 'Hudson'},
+            {'type': 'group', 'id': 'g', 'title': 'Марины', 'slug': 'marines'},
+            {'type': 'follow', 'user': 2, 'author': 1},
+            {
+                'type': 'post',
+                'id': 10,
+                'author': 1,
+                'group': 'g',
+                'text': 'Игра окончена',
+                'pub_date': '2010-05-01T10:00:00'
+            },
+            {'type': 'post', 'id': 11, 'author': 1, 'text': 'Финальная'},
+            {'type': 'post', 'id': 12, 'author': 99, 'text': 'Ничья'},
+            {'type': 'comment', 'post': 10, 'author': 2, 'text': 'Так точно'},
+            {'type': 'comment', 'post': 10, 'author': 1, 'text': 'Вольно'},
+            {'type': 'comment', 'post': 77, 'author': 1, 'text': 'Мимо'},
+        ]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write_jsonl(self):
+        path = os.path.join(self.directory, 'community.jsonl')
+        with open(path, 'w', encoding='utf-8') as target:
+            for record in self.records:
+                target.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return path
+
+    def import_community(self, path):
+        out = StringIO()
+        call_command(
+            'import_community',
+            path,
+            '--batch-size=2',
+            '--transaction-size=3',
+            stdout=out
+        )
+        return out.getvalue()
+
+    def test_import_builds_everything(self):
+        out = self.import_community(self.write_jsonl())
+        self.assertIn('post: создано 2, пропущено 1', out)
+        self.assertIn('comment: создано 2, пропущено 1', out)
+        hicks = User.objects.get(username='Hicks')
+        self.assertEqual(User.objects.filter(username='Hudson').count(), 1)
+        post = Post.objects.get(text='Игра окончена')
+        self.assertEqual(post.author, hicks)
+        self.assertEqual(post.group.slug, 'marines')
+        self.assertEqual(
+            (post.pub_date.year, post.pub_date.month),
+            (2010, 5),
+            msg='Импорт должен сохранять дату публикации'
+        )
+        self.assertEqual(post.comments_count, 2)
+        self.assertEqual(AuthorStats.objects.get(user=hicks).posts_count, 2)
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.existing).following_count,
+            1
+        )
+        self.assertEqual(
+            FeedEntry.objects.filter(user=self.existing).count(),
+            2,
+            msg='Лента подписчика должна содержать импортированные записи'
+        )
+        results = self.client.get(reverse('search'), {'q': 'окончена'})
+        self.assertEqual(list(results.context['page']), [post])
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+
+    def test_new_objects_get_fresh_ids_after_import(self):
+        self.import_community(self.write_jsonl())
+        post = Post.objects.create(text='Новая', author=self.existing)
+        self.assertGreater(post.pk, Post.objects.exclude(pk=post.pk).latest(
+            'pk'
+        ).pk)
+
+    def test_import_from_csv(self):
+        path = os.path.join(self.directory, 'community.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as target:
+            target.write(
+                'type,id,username,author,text\n'
+                'user,5,Vasquez,,\n'
+                'post,1,,5,Привет из CSV\n'
+            )
+        self.import_community(path)
+        self.assertTrue(Post.objects.filter(
+            author__username='Vasquez',
+            text='Привет из CSV'
+        ).exists())
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class TestAuthorExport(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='Bishop')
+        self.group = Group.objects.create(title='Синтетики', slug='synth')
+        self.posts = [
+            Post.objects.create(
+                text=f'Запись {number}',
+                author=self.author,
+                group=self.group
+            )
+            for number in range(3)
+        ]
+        self.posts[0].image = SimpleUploadedFile('bishop.gif', b'GIF89a')
+        self.posts[0].save()
+        self.comment = Comment.objects.create(
+            post=self.posts[1],
+            author=self.author,
+            text='Я не опасен'
+        )
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+    def export(self, **params):
+        response = self.client.get(
+            reverse('profile_export', args=[self.author.username]),
+            params
+        )
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_jsonl_export_streams_posts_and_comments(self):
+        response, content = self.export()
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(
+            [(row['type'], row['id']) for row in rows],
+            [('post', post.id) for post in self.posts] + [
+                ('comment', self.comment.id)
+            ]
+        )
+        self.assertEqual(rows[0]['group'], 'synth')
+        self.assertIn('Bishop.jsonl', response['Content-Disposition'])
+
+    def test_export_resumes_after_last_ids(self):
+        response, content = self.export(
+            after_post=self.posts[1].id,
+            after_comment=self.comment.id
+        )
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(
+            [row['id'] for row in rows],
+            [self.posts[2].id],
+            msg='Выгрузка должна продолжаться после переданных id'
+        )
+
+    def test_csv_export(self):
+        response, content = self.export(format='csv')
+        lines = content.decode().splitlines()
+        self.assertEqual(lines[0], 'type,id,post,group,text,date,image')
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+
+    def test_zip_export_contains_images(self):
+        response, content = self.export(format='zip')
+        archive = zipfile.ZipFile(BytesIO(content))
+        self.assertEqual(
+            archive.namelist(),
+            ['export.jsonl', f'images/{self.posts[0].image.name}']
+        )
+        self.assertEqual(
+            archive.read(f'images/{self.posts[0].image.name}'),
+            b'GIF89a'
+        )
+
+    def test_only_author_and_staff_can_export(self):
+        stranger = User.objects.create(username='Burke')
+        self.client.force_login(stranger)
+        response = self.client.get(
+            reverse('profile_export', args=[self.author.username])
+        )
+        self.assertRedirects(
+            response,
+            reverse('profile', args=[self.author.username])
+        )
+
+    def test_export_command_writes_file(self):
+        path = os.path.join(TEST_DIR, 'bishop.jsonl')
+        os.makedirs(TEST_DIR, exist_ok=True)
+        call_command(
+            'export_author',
+            self.author.username,
+            f'--output={path}',
+            f'--after-post={self.posts[2].id}'
+        )
+        with open(path, encoding='utf-8') as source:
+            rows = [json.loads(line) for line in source]
+        self.assertEqual(rows, [{
+            'type': 'comment',
+            'id': self.comment.id,
+            'post': self.posts[1].id,
+            'text': 'Я не опасен',
+            'date': self.comment.created.isoformat(),
+        }])
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='Newt')
+        self.group = Group.objects.create(title='Колония', slug='hadleys')
+        self.post = Post.objects.create(
+            text='Они выходят ночью',
+            author=self.author,
+            group=self.group
+        )
+        self.pages = (
+            reverse('group', args=[self.group.slug]),
+            reverse('profile', args=[self.author.username]),
+            reverse('post', args=[self.author.username, self.post.id]),
+        )
+        self.client = Client()
+
+    def revalidate(self, client, page):
+        response = client.get(page)
+        return client.get(page, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_pages_are_not_rendered(self):
+        for page in self.pages:
+            with self.subTest(page=page):
+                response = self.client.get(page)
+                self.assertTrue(response.has_header('Last-Modified'))
+                with self.assertNumQueries(0):
+                    again = self.client.get(
+                        page,
+                        HTTP_IF_NONE_MATCH=response['ETag']
+                    )
+                self.assertEqual(again.status_code, 304)
+                again = self.client.get(
+                    page,
+                    HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+                )
+                self.assertEqual(again.status_code, 304)
+
+    def test_clients_revalidate_cached_pages(self):
+        pages = (reverse('index'),) + self.pages[:2]
+        for page in pages:
+            for attempt in ('промах', 'попадание'):
+                with self.subTest(page=page, attempt=attempt):
+                    response = self.client.get(page)
+                    self.assertFalse(
+                        response.has_header('Expires'),
+                        msg='Браузеру разрешено не переспрашивать страницу'
+                    )
+                    self.assertIn('no-cache', response['Cache-Control'])
+                    self.assertIn('max-age=0', response['Cache-Control'])
+
+    def test_changes_invalidate_etag(self):
+        etags = [self.client.get(page)['ETag'] for page in self.pages]
+        Comment.objects.create(
+            post=self.post,
+            author=self.author,
+            text='Мама'
+        )
+        for page, etag in zip(self.pages, etags):
+            with self.subTest(page=page):
+                response = self.client.get(page, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(
+                    response.status_code,
+                    200,
+                    msg='После изменения страница должна отдаваться заново'
+                )
+
+    def test_etag_depends_on_user_and_follow_state(self):
+        reader = User.objects.create(username='Gorman')
+        page = self.pages[1]
+        anon_etag = self.client.get(page)['ETag']
+        self.client.force_login(reader)
+        response = self.client.get(page, HTTP_IF_NONE_MATCH=anon_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        Follow.objects.create(user=reader, author=self.author)
+        response = self.client.get(page, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.revalidate(self.client, page).status_code, 304)
+
+
+class TestPageCacheCommit(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='Bishop')
+        self.post = Post.objects.create(text='Ностромо', author=self.author)
+
+    def around_commit(self, write):
+        """Поколение и число записей, которые увидит чтение до коммита."""
+        with transaction.atomic():
+            write()
+            read = get_generation(index_scope())
+            cache.set(count_cache_key('index'), 1)
+        return read, get_generation(index_scope())
+
+    def test_read_before_commit_is_not_kept(self):
+        writes = {
+            'комментарий': lambda: Comment.objects.create(
+                post=self.post,
+                author=self.author,
+                text='Выходим'
+            ),
+            'запись': lambda: Post.objects.create(
+                text='Сулако',
+                author=self.author
+            ),
+        }
+        for name, write in writes.items():
+            with self.subTest(write=name):
+                read, committed = self.around_commit(write)
+                self.assertNotEqual(
+                    read,
+                    committed,
+                    msg='Страница, прочитанная до коммита, осталась в кэше'
+                )
+        # Последней была запись: число записей тоже должно сброситься.
+        self.assertIsNone(
+            cache.get(count_cache_key('index')),
+            msg='Число записей, посчитанное до коммита, осталось в кэше'
+        )
+        response = Client().get(reverse('index'))
+        self.assertContains(response, 'Сулако')
+
+
+class TestJsonApi(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='Vasquez')
+        self.reader = User.objects.create(username='Drake')
+        self.group = Group.objects.create(title='Смарт-ганы', slug='guns')
+        for number in range(12):
+            Post.objects.create(
+                text=f'Запись {number}',
+                author=self.author,
+                group=self.group if number % 2 else None
+            )
+        self.post = Post.objects.latest('pub_date', 'id')
+        Comment.objects.create(post=self.post, author=self.reader, text='Да')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client = Client()
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return response, response.json()
+
+    def walk(self, url, queries=1):
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            with self.assertNumQueries(queries):
+                response, data = self.get(url, cursor=cursor, limit=5)
+            seen.extend(item['i'] for item in data['items'])
+            cursor = data['next']
+        return seen
+
+    def test_feeds_are_cursor_paginated_in_one_query(self):
+        expected = list(Post.objects.order_by('-pub_date', '-id').values_list(
+            'id',
+            flat=True
+        ))
+        self.assertEqual(self.walk(reverse('api_index')), expected)
+        self.assertEqual(
+            self.walk(reverse('api_profile', args=[self.author.username])),
+            expected
+        )
+        self.assertEqual(
+            self.walk(reverse('api_group', args=[self.group.slug])),
+            list(Post.objects.filter(group=self.group).order_by(
+                '-pub_date',
+                '-id'
+            ).values_list('id', flat=True))
+        )
+
+    def test_items_use_short_keys(self):
+        response, data = self.get(reverse('api_index'))
+        self.assertEqual(
+            list(data['items'][0]),
+            ['i', 'a', 'g', 'd', 't', 'm', 'c'],
+            msg='Ключи ответа должны быть короткими и в постоянном порядке'
+        )
+        self.assertEqual(data['items'][0]['a'], 'Vasquez')
+        self.assertEqual(data['items'][0]['c'], 1)
+        self.assertNotIn(b', ', response.content)
+
+    def test_follow_feed(self):
+        response, data = self.get(reverse('api_follow_index'))
+        self.assertEqual(response.status_code, 401)
+        self.client.force_login(self.reader)
+        self.assertEqual(
+            len(self.walk(reverse('api_follow_index'), queries=3)),
+            12,
+            msg='Кроме сессии и пользователя - один запрос на страницу'
+        )
+
+    def test_post_with_comments(self):
+        response, data = self.get(reverse('api_post', args=[self.post.id]))
+        self.assertEqual(data['post']['i'], self.post.id)
+        self.assertEqual(
+            [(item['a'], item['t']) for item in data['comments']['items']],
+            [('Drake', 'Да')]
+        )
+        response, data = self.get(reverse('api_post', args=[0]))
+        self.assertEqual(response.status_code, 404)
+        response, data = self.get(reverse('api_profile', args=['Nobody']))
+        self.assertEqual(response.status_code, 404)
+        response, data = self.get(reverse('api_group', args=['nothing']))
+        self.assertEqual(data, {'error': 'Группа не найдена'})
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class TestGenerateDataset(TestCase):
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+    def generate(self, *args):
+        out = StringIO()
+        call_command(
+            'generate_dataset',
+            '--users=40',
+            '--groups=3',
+            '--posts=300',
+            '--batch-size=50',
+            *args,
+            stdout=out
+        )
+        return out.getvalue()
+
+    def test_counters_and_feeds_are_consistent(self):
+        out = self.generate('--defer-indexes')
+        self.assertIn('post: 300', out)
+        self.assertEqual(User.objects.count(), 40)
+        self.assertEqual(
+            recount_comments(),
+            0,
+            msg='comments_count должен совпадать с комментариями'
+        )
+        self.assertEqual(rebuild_author_stats(dry_run=True), 0)
+        self.assertIn('post + comment: ', out)
+        self.assertIn(', производные', out)
+        self.assertIn('Всего строк без лент: ', out)
+        expected_feed = sum(
+            Post.objects.filter(author_id=author_id).count()
+            for author_id in Follow.objects.values_list('author_id', flat=True)
+        )
+        self.assertEqual(FeedEntry.objects.count(), expected_feed)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor,
+                Post._meta.db_table
+            )
+        self.assertLessEqual(
+            {index.name for index in Post._meta.indexes},
+            set(constraints),
+            msg='Снятые на время заливки индексы должны вернуться'
+        )
+        response = self.client.get(reverse('search'), {'q': 'кот'})
+        self.assertGreater(response.context['paginator'].count, 0)
+
+    def test_distributions_are_skewed(self):
+        self.generate()
+        followers = list(AuthorStats.objects.order_by(
+            '-followers_count'
+        ).values_list('followers_count', flat=True))
+        self.assertGreater(followers[0], 4 * followers[len(followers) // 2])
+        comments = sorted(
+            Post.objects.values_list('comments_count', flat=True),
+            reverse=True
+        )
+        median = max(comments[len(comments) // 2], 1)
+        self.assertGreater(comments[0], 5 * median)
+
+    def test_top_writer_is_not_top_followed(self):
+        self.generate('--no-feeds')
+        stats = AuthorStats.objects.order_by('-followers_count', 'pk')
+        most_followed = stats.first()
+        self.assertLess(
+            most_followed.posts_count,
+            stats.order_by('-posts_count').first().posts_count,
+            msg='Самый читаемый автор пишет больше всех: ленты раздуваются'
+        )
+
+    def test_same_seed_gives_same_data(self):
+        def snapshot():
+            first_post = Post.objects.order_by('pk').first().pk
+            first_user = User.objects.order_by('pk').first().pk
+            return [
+                (text, author_id - first_user, pub_date, comments_count)
+                for text, author_id, pub_date, comments_count in
+                Post.objects.filter(pk__gte=first_post).order_by(
+                    'pk'
+                ).values_list(
+                    'text',
+                    'author_id',
+                    'pub_date',
+                    'comments_count'
+                )
+            ]
+        self.generate('--seed=7', '--no-feeds')
+        first = snapshot()
+        Post.objects.all().delete()
+        User.objects.all().delete()
+        self.generate('--seed=7', '--no-feeds', '--prefix=again')
+        self.assertEqual(snapshot(), first)
+
+    def test_images_are_attached(self):
+        self.generate('--images=2', '--image-ratio=1')
+        names = set(Post.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 2)
+        for name in names:
+            self.assertTrue(os.path.exists(
+                os.path.join(TEST_DIR, 'media', name)
+            ))
+
+
+class TestSlowQueryLog(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.log = os.path.join(TEST_DIR, 'logs', 'slow.log')
+        self.user = User.objects.create_user(username='bishop')
+        Post.objects.create(text='Медленная запись', author=self.user)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+    def records(self):
+        return list(slow_queries.read_log(self.log))
+
+    def test_slow_queries_are_logged_with_view_and_plan(self):
+        with override_settings(
+            SLOW_QUERY_THRESHOLD_MS=0,
+            SLOW_QUERY_LOG=self.log
+        ):
+            self.client.get(reverse('index'))
+        records = [
+            record for record in self.records()
+            if record['view'] == 'index'
+        ]
+        self.assertTrue(records, msg='Запросы главной не попали в журнал')
+        select = next(
+            record for record in records
+            if record['sql'].startswith('SELECT')
+        )
+        self.assertTrue(select['plan'], msg='Нет плана для SELECT')
+        self.assertTrue(
+            any('posts/views.py' in line for line in select['stack']),
+            msg='В стеке нет view'
+        )
+
+    def test_params_are_logged_only_for_posts_selects(self):
+        with override_settings(
+            SLOW_QUERY_THRESHOLD_MS=0,
+            SLOW_QUERY_LOG=self.log
+        ):
+            list(Post.objects.filter(text='Медленная запись'))
+            User.objects.filter(username='bishop').update(password='hash')
+            list(User.objects.filter(password='hash'))
+        posts_select, *user_queries = self.records()
+        self.assertIn('Медленная запись', posts_select['params'])
+        self.assertEqual(len(user_queries), 2)
+        for record in user_queries:
+            self.assertIsNone(
+                record['params'],
+                msg='В журнал попали параметры запроса к пользователям'
+            )
+
+    def test_explain_outside_transaction_does_not_begin(self):
+        sql = 'SELECT COUNT(*) FROM posts_post WHERE id > %s'
+        with mock.patch.object(connection, 'in_atomic_block', False), \
+                mock.patch.object(
+                    slow_queries.transaction,
+                    'atomic',
+                    side_effect=AssertionError('EXPLAIN в транзакции')
+                ):
+            plan = slow_queries.explain(connection, sql, [0])
+        self.assertTrue(plan)
+        self.assertNotIn('не удался', plan[0])
+
+    def test_fast_queries_are_not_logged(self):
+        with override_settings(
+            SLOW_QUERY_THRESHOLD_MS=60000,
+            SLOW_QUERY_LOG=self.log
+        ):
+            self.client.get(reverse('index'))
+        self.assertEqual(self.records(), [])
+
+    def test_command_reports_top_offenders(self):
+        with override_settings(
+            SLOW_QUERY_THRESHOLD_MS=0,
+            SLOW_QUERY_LOG=self.log
+        ):
+            for _ in range(3):
+                list(Post.objects.filter(pk__in=[1, 2, 3]))
+            list(Post.objects.filter(pk__in=[1]))
+        offenders = slow_queries.top_offenders(self.records())
+        self.assertEqual(
+            offenders[0]['count'],
+            4,
+            msg='Запросы с IN разной длины не сгруппированы'
+        )
+        out = StringIO()
+        call_command('slow_queries', f'--log={self.log}', '--plans',
+                     stdout=out)
+        self.assertIn('4 раз', out.getvalue())
+        self.assertIn('план:', out.getvalue())
+
+
+@override_settings(
+    POST_SHARDS=['default', 'shard1'],
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+    }}
+)
+class TestSharding(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        connections.databases['shard1'] = dict(
+            connections.databases['default'],
+            NAME=os.path.join(self.directory, 'shard1.sqlite3'),
+            OPTIONS={}
+        )
+        copy_database('shard1')
+        self.first = User.objects.create_user(username='Wells')
+        self.second = User.objects.create_user(username='Crane')
+        self.reader = User.objects.create_user(username='Gerber')
+        AuthorShard.objects.create(author=self.first, shard='default')
+        AuthorShard.objects.create(author=self.second, shard='shard1')
+
+    def tearDown(self):
+        connections['shard1'].close()
+        del connections.databases['shard1']
+        delattr(connections._connections, 'shard1')
+        shutil.rmtree(self.directory)
+
+    def publish(self, count):
+        return [
+            Post.objects.create(
+                text=f'Запись {number}',
+                author=(self.first, self.second)[number % 2]
+            )
+            for number in range(count)
+        ]
+
+    def test_rows_are_placed_by_author(self):
+        first, second = self.publish(2)
+        second.comments.create(author=self.reader, text='Да')
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertTrue(Post.objects.using('default').filter(
+            pk=first.pk
+        ).exists())
+        self.assertTrue(Post.objects.using('shard1').filter(
+            pk=second.pk
+        ).exists())
+        self.assertFalse(Post.objects.using('default').filter(
+            pk=second.pk
+        ).exists())
+        self.assertEqual(Comment.objects.using('shard1').count(), 1)
+        self.assertEqual(
+            Post.objects.using('shard1').get(pk=second.pk).comments_count,
+            1,
+            msg='Счётчик комментариев обновлён не в том шарде'
+        )
+        self.assertEqual(
+            list(self.second.posts.all()),
+            [second],
+            msg='Записи автора читаются не из его шарда'
+        )
+
+    def test_user_delete_removes_rows_from_all_shards(self):
+        first, second = self.publish(2)
+        second.comments.create(author=self.reader, text='Да')
+        first.comments.create(author=self.second, text='Нет')
+        author_id = self.second.pk
+        self.second.delete()
+        leftovers = {
+            'записи': Post.objects.using('shard1'),
+            'комментарии': Comment.objects.using('shard1'),
+            'пользователь': User.objects.using('shard1').filter(pk=author_id),
+        }
+        for name, rows in leftovers.items():
+            with self.subTest(rows=name):
+                self.assertFalse(
+                    rows.exists(),
+                    msg='Строки удалённого пользователя остались в шарде'
+                )
+        self.assertFalse(Comment.objects.using('default').exists())
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['page']), [first])
+
+    def test_repair_commands_count_every_shard(self):
+        first, second = self.publish(2)
+        second.comments.create(author=self.reader, text='Да')
+        Post.objects.using('shard1').filter(pk=second.pk).update(
+            comments_count=5
+        )
+        self.assertEqual(recount_comments(), 1)
+        self.assertEqual(
+            Post.objects.using('shard1').get(pk=second.pk).comments_count,
+            1,
+            msg='Счётчик комментариев в шарде не пересчитан'
+        )
+        self.assertEqual(rebuild_author_stats(), 0)
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.second).posts_count,
+            1,
+            msg='Записи автора из шарда не посчитаны'
+        )
+
+    def test_search_rebuild_reads_every_shard(self):
+        posts = self.publish(4)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_post_fts')
+        self.assertEqual(search.rebuild_index(chunk_size=1), 4)
+        self.assertEqual(
+            sorted(post.pk for post in search.SearchResults('запись')[:10]),
+            [post.pk for post in posts],
+            msg='Записи из шарда пропали из индекса'
+        )
+
+    def test_api_feeds_read_every_shard(self):
+        group = Group.objects.create(title='Прометей', slug='prometheus')
+        posts = self.publish(4)
+        Post.objects.filter(pk=posts[0].pk).update(group=group)
+        Post.objects.using('shard1').create(
+            text='В группе',
+            author=self.second,
+            group=group
+        )
+        Follow.objects.create(user=self.reader, author=self.second)
+        self.client.force_login(self.reader)
+        feeds = {
+            reverse('api_index'): 5,
+            reverse('api_profile', args=[self.second.username]): 3,
+            reverse('api_group', args=[group.slug]): 2,
+            reverse('api_follow_index'): 3,
+        }
+        for url, expected in feeds.items():
+            with self.subTest(url=url):
+                data = self.client.get(url, {'limit': 2}).json()
+                items = data['items']
+                while data['next']:
+                    data = self.client.get(
+                        url,
+                        {'limit': 2, 'cursor': data['next']}
+                    ).json()
+                    items += data['items']
+                self.assertEqual(
+                    len(items),
+                    expected,
+                    msg='Лента API видит не все шарды'
+                )
+        item = self.client.get(
+            reverse('api_profile', args=[self.second.username])
+        ).json()['items'][0]
+        self.assertEqual(item['a'], self.second.username)
+        response = self.client.get(reverse('api_profile', args=['nobody']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_bulk_loaders_refuse_shards(self):
+        commands = {
+            'import_community': ['missing.jsonl'],
+            'generate_dataset': [],
+        }
+        for command, args in commands.items():
+            with self.subTest(command=command):
+                with self.assertRaises(CommandError):
+                    call_command(command, *args, stdout=StringIO())
+        self.assertFalse(Post.objects.exists())
+
+    def test_index_merges_shards(self):
+        posts = self.publish(15)
+        expected = [post.pk for post in reversed(posts)]
+        first_page = self.client.get(reverse('index'))
+        second_page = self.client.get(reverse('index') + '?page=2')
+        self.assertEqual(first_page.context['paginator'].count, 15)
+        self.assertEqual(
+            [post.pk for post in first_page.context['page']]
+            + [post.pk for post in second_page.context['page']],
+            expected,
+            msg='Записи шардов слиты не по дате'
+        )
+        self.assertContains(first_page, 'Crane')
+        cursor_page = self.client.get(reverse('index') + '?cursor=')
+        self.assertEqual(
+            [post.pk for post in cursor_page.context['page']],
+            expected[:10]
+        )
+
+    def test_follow_index_gathers_followed_authors(self):
+        posts = self.publish(4)
+        Follow.objects.create(user=self.reader, author=self.second)
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(
+            [post.pk for post in response.context['page']],
+            [posts[3].pk, posts[1].pk]
+        )
+        Follow.objects.create(user=self.reader, author=self.first)
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(len(response.context['page']), 4)
+
+    def test_post_pages_read_author_shard(self):
+        post = self.publish(2)[1]
+        self.client.force_login(self.second)
+        response = self.client.get(reverse('post', args=['Crane', post.pk]))
+        self.assertEqual(
+            response.status_code,
+            200,
+            msg='Страница записи из другого шарда не найдена'
+        )
+        self.assertEqual(response.context['post'].author, self.second)
+        self.client.post(
+            reverse('add_comment', args=['Crane', post.pk]),
+            {'text': 'Мать'}
+        )
+        self.assertEqual(
+            list(Comment.objects.using('shard1').values_list(
+                'text',
+                flat=True
+            )),
+            ['Мать']
+        )
+        self.client.post(
+            reverse('post_edit', args=['Crane', post.pk]),
+            {'text': 'Исправлено'}
+        )
+        self.assertEqual(
+            Post.objects.using('shard1').get(pk=post.pk).text,
+            'Исправлено',
+            msg='Правка записи не дошла до её шарда'
+        )
+        response = self.client.get(
+            reverse('post_comments', args=['Crane', post.pk])
+        )
+        self.assertContains(response, 'Мать')
+        response = self.client.get(reverse('api_post', args=[post.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['comments']['items']), 1)
+        response = self.client.get(reverse('search'), {'q': 'Исправлено'})
+        self.assertEqual(
+            [found.pk for found in response.context['page']],
+            [post.pk]
+        )
+        rows = list(export_rows(self.second))
+        self.assertEqual(
+            [row['type'] for row in rows],
+            ['post', 'comment'],
+            msg='Выгрузка автора не видит его шард'
+        )
+
+    def test_move_keeps_writes_made_during_copy(self):
+        AuthorShard.objects.filter(author=self.second).update(
+            shard='default'
+        )
+        first, second = [
+            Post.objects.create(text=f'Запись {number}', author=self.second)
+            for number in range(2)
+        ]
+        old_comment = first.comments.create(author=self.reader, text='Нет')
+        lock_for_writes = sharding.lock_for_writes
+        written = []
+
+        def write_then_lock(alias):
+            # Пишем, пока строки уже скопированы, а шард ещё не сменён.
+            if not written:
+                written.append(Post.objects.create(
+                    text='Новая',
+                    author=self.second
+                ))
+                second.comments.create(author=self.reader, text='Да')
+                old_comment.delete()
+                first.text = 'Исправлено'
+                first.save()
+            lock_for_writes(alias)
+
+        with mock.patch.object(sharding, 'lock_for_writes', write_then_lock):
+            moved = sharding.move_author(self.second.pk, 'shard1')
+        self.assertEqual(moved, 3)
+        self.assertFalse(Post.objects.using('default').exists())
+        self.assertFalse(Comment.objects.using('default').exists())
+        posts = Post.objects.using('shard1').in_bulk()
+        self.assertEqual(
+            set(posts),
+            {first.pk, second.pk, written[0].pk},
+            msg='Запись, сделанная во время переноса, потеряна'
+        )
+        self.assertEqual(posts[first.pk].text, 'Исправлено')
+        self.assertEqual(
+            list(Comment.objects.using('shard1').values_list(
+                'post_id',
+                'text'
+            )),
+            [(second.pk, 'Да')]
+        )
+        self.assertEqual(
+            [posts[first.pk].comments_count, posts[second.pk].comments_count],
+            [0, 1]
+        )
+
+    def test_rebalance_moves_author_with_comments(self):
+        AuthorShard.objects.filter(author=self.second).update(
+            shard='default'
+        )
+        posts = self.publish(6)
+        posts[1].comments.create(author=self.reader, text='Да')
+        dates = {post.pk: post.pub_date for post in posts}
+        out = StringIO()
+        call_command('rebalance_shards', stdout=out)
+        self.assertEqual(Post.objects.using('default').count(), 3)
+        self.assertEqual(Post.objects.using('shard1').count(), 3)
+        moved = AuthorShard.objects.get(shard='shard1').author
+        self.assertIn(f'автор {moved.pk} -> shard1', out.getvalue())
+        for post in moved.posts.all():
+            self.assertEqual(post.pub_date, dates[post.pk])
+        if moved == self.second:
+            self.assertEqual(Comment.objects.using('shard1').count(), 1)
+        response = self.client.get(reverse('profile', args=[moved.username]))
+        self.assertEqual(len(response.context['page']), 3)
+
+
+class TestPostComments(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='Dallas')
+        self.commenter = User.objects.create(username='Lambert')
+        self.post = Post.objects.create(text='Сигнал', author=self.author)
+
+    def comment(self, count):
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.commenter, text=f'Ответ {n}')
+            for n in range(count)
+        )
+        Post.objects.filter(pk=self.post.pk).update(
+            comments_count=Comment.objects.filter(post=self.post).count()
+        )
+
+    def get_post(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('post', args=['Dallas', self.post.id])
+            )
+        return response, len(queries)
+
+    def test_query_count_does_not_depend_on_comments(self):
+        self.comment(3)
+        _, few = self.get_post()
+        self.comment(60)
+        response, many = self.get_post()
+        self.assertEqual(
+            few,
+            many,
+            msg='Число запросов растёт с комментариями'
+        )
+        self.assertEqual(
+            response.content.decode().count('name="comment_'),
+            COMMENTS_PER_PAGE
+        )
+
+    def test_load_more_walks_all_comments(self):
+        self.comment(45)
+        response, _ = self.get_post()
+        seen = [comment.id for comment in response.context['comments']]
+        next_cursor = response.context['next_cursor']
+        while next_cursor:
+            fragment = self.client.get(
+                reverse('post_comments', args=['Dallas', self.post.id]),
+                {'cursor': next_cursor}
+            )
+            self.assertNotContains(fragment, '<html')
+            seen += [comment.id for comment in fragment.context['comments']]
+            next_cursor = fragment.context['next_cursor']
+        self.assertEqual(
+            seen,
+            list(Comment.objects.order_by('-created', '-pk').values_list(
+                'pk',
+                flat=True
+            )),
+            msg='Комментарии пропущены или повторяются'
+        )
+
+    def test_no_load_more_for_short_threads(self):
+        self.comment(2)
+        response, _ = self.get_post()
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertNotContains(response, 'js-more-comments"')
+
+
+class TestFollowGraph(TestCase):
+    def setUp(self):
+        cache.clear()
+        follow_graph.local_sets.clear()
+        self.reader = User.objects.create(username='Parker')
+        self.authors = [
+            User.objects.create(username=f'Brett{number}')
+            for number in range(3)
+        ]
+        # Без записей страница автора не показывает кнопку подписки.
+        Post.objects.create(text='Ностромо', author=self.authors[0])
+        self.client.force_login(self.reader)
+
+    def follow_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        return [
+            query['sql'] for query in queries
+            if Follow._meta.db_table in query['sql']
+        ]
+
+    def test_profile_checks_follow_from_cache(self):
+        url = reverse('profile', args=[self.authors[0].username])
+        self.follow_queries(url)
+        self.assertEqual(
+            self.follow_queries(url),
+            [],
+            msg='Проверка подписки на странице автора идёт в базу'
+        )
+
+    def test_follow_and_unfollow_update_graph(self):
+        author = self.authors[0]
+        self.assertFalse(follow_graph.is_following(self.reader.pk, author.pk))
+        self.client.post(reverse('profile_follow', args=[author.username]))
+        self.assertTrue(
+            follow_graph.is_following(self.reader.pk, author.pk),
+            msg='Подписка не попала в граф'
+        )
+        response = self.client.get(reverse('profile', args=[author.username]))
+        self.assertContains(response, 'Отписаться')
+        self.client.post(reverse('profile_unfollow', args=[author.username]))
+        self.assertFalse(
+            follow_graph.is_following(self.reader.pk, author.pk),
+            msg='Отписка не попала в граф'
+        )
+
+    def test_stale_process_memory_is_not_used(self):
+        author = self.authors[1]
+        follow_graph.followed_ids(self.reader.pk)
+        # Версия в общем кэше меняется, даже если подписку сделал другой
+        # процесс: набор из памяти этого процесса больше не годится.
+        Follow.objects.create(user=self.reader, author=author)
+        self.assertTrue(follow_graph.is_following(self.reader.pk, author.pk))
+
+    def test_apply_change_writes_through(self):
+        author = self.authors[2]
+        follow_graph.followed_ids(self.reader.pk)
+        follow_graph.apply_change(self.reader.pk, author.pk, True)
+        follow_graph.local_sets.clear()
+        with mock.patch.object(follow_graph, 'load') as load:
+            self.assertEqual(
+                follow_graph.followed_ids(self.reader.pk),
+                {author.pk},
+                msg='Новый набор не записан в кэш после коммита'
+            )
+        load.assert_not_called()
+
+
 class TestServerResponses(TestCase):
     def setUp(self):
         self.client_anon = Client()
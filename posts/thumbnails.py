@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (EMPTY_VALUE,
+                                                       KVStore as
+                                                       CachedDBKVStore)
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from .models import Post
+from .sharding import shard_for_post
+
+THUMBNAIL_SIZES = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+THUMBNAIL_WORKERS = getattr(settings, 'THUMBNAIL_WORKERS', 2)
+# Столько ждём задачу генерации, прежде чем поставить её ещё раз.
+THUMBNAIL_RETRY_SECONDS = getattr(settings, 'THUMBNAIL_RETRY_SECONDS', 60)
+
+executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+
+
+class ThumbnailLookup(ThumbnailBackend):
+    """Ищет готовую миниатюру в key-value хранилище sorl, не создавая её."""
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        source = ImageFile(file_)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def get_ready_thumbnail(self, file_, size):
+        geometry_string, options = THUMBNAIL_SIZES[size]
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, **options)
+        )
+
+    def get_many_ready_thumbnails(self, files, size):
+        """
+        То же, что get_ready_thumbnail, но для словаря {ключ: файл}.
+
+        С хранилищем cached_db это один cache.get_many и не больше
+        одного запроса к таблице sorl на промахи.
+        """
+        geometry_string, options = THUMBNAIL_SIZES[size]
+        raw_keys = {
+            add_prefix(
+                self.thumbnail_file(file_, geometry_string, **options).key
+            ): ident
+            for ident, file_ in files.items()
+        }
+        kvstore = default.kvstore
+        if isinstance(kvstore, CachedDBKVStore):
+            values = kvstore.cache.get_many(list(raw_keys))
+            missing = [key for key in raw_keys if key not in values]
+            if missing:
+                stored = dict(
+                    KVStoreModel.objects.filter(key__in=missing).values_list(
+                        'key',
+                        'value'
+                    )
+                )
+                found = {key: stored.get(key, EMPTY_VALUE) for key in missing}
+                kvstore.cache.set_many(
+                    found,
+                    sorl_settings.THUMBNAIL_CACHE_TIMEOUT
+                )
+                values.update(found)
+        else:
+            values = {key: kvstore._get_raw(key) for key in raw_keys}
+        thumbnails = dict.fromkeys(files)
+        for key, ident in raw_keys.items():
+            value = values.get(key)
+            if value and value != EMPTY_VALUE:
+                thumbnails[ident] = deserialize_image_file(value)
+        return thumbnails
+
+
+lookup = ThumbnailLookup()
+
+
+def prefetch_thumbnails(posts, size='card'):
+    posts = [post for post in posts if post.image]
+    if not posts:
+        return
+    thumbnails = lookup.get_many_ready_thumbnails(
+        {post.id: post.image for post in posts},
+        size
+    )
+    for post in posts:
+        post._thumbnails = getattr(post, '_thumbnails', {})
+        post._thumbnails[size] = thumbnails[post.id]
+        if thumbnails[post.id] is None:
+            retry_thumbnails(post.id)
+
+
+def generate_thumbnails(post_id):
+    post = Post.objects.using(shard_for_post(post_id)).filter(
+        pk=post_id
+    ).first()
+    if post is None or not post.image:
+        return
+    for geometry_string, options in THUMBNAIL_SIZES.values():
+        get_thumbnail(post.image, geometry_string, **options)
+    post.save(update_fields=['edited'])
+
+
+def generate_in_background(post_id):
+    try:
+        generate_thumbnails(post_id)
+    finally:
+        connection.close()
+
+
+def pending_key(post_id):
+    return f'thumbnail_pending:{post_id}'
+
+
+def submit(post_id):
+    cache.set(pending_key(post_id), True, THUMBNAIL_RETRY_SECONDS)
+    if getattr(settings, 'THUMBNAILS_IN_BACKGROUND', True):
+        executor.submit(generate_in_background, post_id)
+    else:
+        # Как и в пуле, ошибка генерации не ломает запрос.
+        with suppress(Exception):
+            generate_thumbnails(post_id)
+
+
+def schedule_thumbnails(post):
+    if post.image:
+        transaction.on_commit(lambda: submit(post.id))
+
+
+def retry_thumbnails(post_id):
+    """
+    Ставит генерацию ещё раз, если миниатюры нет, а прошлая задача
+    не появлялась THUMBNAIL_RETRY_SECONDS.
+
+    Очередь живёт в памяти процесса, и задача, потерянная при его
+    перезапуске, иначе не повторилась бы никогда.
+    """
+    if cache.add(pending_key(post_id), True, THUMBNAIL_RETRY_SECONDS):
+        transaction.on_commit(lambda: submit(post_id))
@@ -1,12 +1,26 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.index, name='index'),
     path('group/<slug:slug>/', views.group_posts, name='group'),
     path('new/', views.new_post, name='new_post'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('search/', views.search, name='search'),
+    path('api/v1/posts/', api.index, name='api_index'),
+    path('api/v1/posts/<int:post_id>/', api.post, name='api_post'),
+    path(
+        'api/v1/groups/<slug:slug>/posts/',
+        api.group_posts,
+        name='api_group'
+    ),
+    path(
+        'api/v1/users/<str:username>/posts/',
+        api.profile,
+        name='api_profile'
+    ),
+    path('api/v1/follow/', api.follow_index, name='api_follow_index'),
     path('<str:username>/', views.profile, name='profile'),
     path(
         '<str:username>/<int:post_id>/edit/',
@@ -18,12 +32,22 @@ urlpatterns = [
         views.profile_follow,
         name='profile_follow'
     ),
+    path(
+        '<str:username>/export/',
+        views.profile_export,
+        name='profile_export'
+    ),
     path(
         '<str:username>/unfollow/',
         views.profile_unfollow,
         name='profile_unfollow'
     ),
     path('<str:username>/<int:post_id>/', views.post, name='post'),
+    path(
+        '<str:username>/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'
+    ),
     path(
         '<username>/<int:post_id>/comment',
         views.add_comment,
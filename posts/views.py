@@ -1,18 +1,36 @@
+from urllib.parse import urlencode
+
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.views.decorators.vary import vary_on_cookie
+
+from yatube.sqlite_backend.writes import run_serialized, serialized_write
 
+from .cards import prefetch_cards
+from .exports import EXPORT_FORMATS, export
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import FeedEntry, Follow, Group, Post, User
+from .page_cache import (author_scope, cache_page_by_generation,
+                         conditional_by_generation, group_scope, index_scope,
+                         post_scope)
+from .paginators import (COMMENTS_PER_PAGE, POSTS_PER_PAGE,
+                         CachedCountPaginator, CursorPaginator,
+                         count_cache_key, paginate)
+from .search import SearchResults
+from .sharding import followed_posts, get_post_or_404, is_sharded, scatter
+from .thumbnails import schedule_thumbnails
 
 
-@cache_page(20, key_prefix='index_page')
+@cache_page_by_generation('index_page', index_scope)
 def index(request):
-    post_list = Post.objects.select_related('author', 'group').all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = scatter(Post.objects.select_related('author', 'group'))
+    paginator, page = paginate(
+        request,
+        post_list,
+        count_cache_key('index')
+    )
+    prefetch_cards(page)
     return render(
         request,
         'index.html',
@@ -20,12 +38,17 @@ def index(request):
         )
 
 
+@conditional_by_generation(group_scope)
+@cache_page_by_generation('group_page', group_scope)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = scatter(group.posts.select_related('author'))
+    paginator, page = paginate(
+        request,
+        post_list,
+        count_cache_key('group', group.id)
+    )
+    prefetch_cards(page)
     return render(
         request,
         'group.html',
@@ -33,49 +56,117 @@ def group_posts(request, slug):
         )
 
 
+@conditional_by_generation(author_scope)
+@cache_page_by_generation('profile_page', author_scope)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(
+        User.objects.select_related('stats'),
+        username=username
+    )
     post_list = author.posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    subscribe = request.user.is_authenticated and Follow.objects.filter(
-        user=request.user,
-        author=author
-    ).exists()
+    paginator, page = paginate(
+        request,
+        post_list,
+        count_cache_key('author', author.id)
+    )
+    prefetch_cards(page)
     return render(request, 'posts/profile.html', {
         'page': page,
         'paginator': paginator,
         'author': author,
-        'subscribe': subscribe
         }
     )
 
 
+@conditional_by_generation(post_scope)
+@vary_on_cookie
 def post(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
-    form = CommentForm()
+    post = get_post_or_404(username, post_id)
+    return render_post(request, post, CommentForm())
+
+
+def render_post(request, post, form):
+    # Первая порция комментариев; остальные подгружает post_comments.
+    # Есть ли продолжение, видно по comments_count без лишнего запроса.
+    comments = post.comments.select_related('author').order_by(
+        '-created',
+        '-pk'
+    )[:COMMENTS_PER_PAGE]
+    next_cursor = None
+    if post.comments_count > COMMENTS_PER_PAGE and comments:
+        next_cursor = comment_paginator(post).encode_cursor(
+            list(comments)[-1],
+            'n'
+        )
     return render(request, 'posts/profile.html', {
         'post': post,
         'author': post.author,
         'form': form,
+        'comments': comments,
+        'next_cursor': next_cursor,
         }
     )
 
 
+def comment_paginator(post):
+    return CursorPaginator(
+        post.comments.select_related('author'),
+        COMMENTS_PER_PAGE,
+        date_field='created'
+    )
+
+
+@conditional_by_generation(post_scope)
+def post_comments(request, username, post_id):
+    post = get_post_or_404(username, post_id)
+    page = comment_paginator(post).get_page(request.GET.get('cursor'))
+    return render(request, 'posts/includes/comment_list.html', {
+        'post': post,
+        'comments': page,
+        'next_cursor': page.next_cursor,
+        }
+    )
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    paginator = CachedCountPaginator(SearchResults(query), POSTS_PER_PAGE)
+    page = paginator.get_page(request.GET.get('page'))
+    prefetch_cards(page)
+    return render(request, 'posts/search.html', {
+        'page': page,
+        'paginator': paginator,
+        'query': query,
+        'extra_query': urlencode({'q': query}) + '&',
+        }
+    )
+
+
+def store_upload(instance):
+    """
+    Кладёт загруженную картинку в хранилище до транзакции записи, чтобы
+    повтор при блокировке базы не сохранял файл ещё раз.
+    """
+    image = instance.image
+    if image and not image._committed:
+        image.save(image.name, image.file, save=False)
+
+
 @login_required
 def new_post(request):
     form = PostForm(request.POST or None, request.FILES or None)
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
+        store_upload(post)
+        run_serialized(post.save)
+        schedule_thumbnails(post)
         return redirect('index')
     return render(request, 'posts/new_post.html', {'form': form})
 
 
 def post_edit(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+    post = get_post_or_404(username, post_id)
     if request.user != post.author:
         return redirect('post', username, post_id)
     form = PostForm(
@@ -84,7 +175,10 @@ def post_edit(request, username, post_id):
         instance=post
     )
     if form.is_valid():
-        form.save()
+        store_upload(post)
+        run_serialized(form.save)
+        if 'image' in form.changed_data:
+            schedule_thumbnails(post)
         return redirect('post', username, post_id)
     return render(
         request,
@@ -95,24 +189,62 @@ def post_edit(request, username, post_id):
 
 @login_required
 def add_comment(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+    post = get_post_or_404(username, post_id)
     form = CommentForm(request.POST or None)
     if request.method == 'POST':
         if form.is_valid():
             comment = form.save(commit=False)
             comment.author = request.user
             comment.post = post
-            comment.save()
+            run_serialized(comment.save)
             return redirect('post', username, post_id)
-    return render(request, 'posts/profile.html', {'form': form, 'post': post})
+    return render_post(request, post, form)
+
+
+@login_required
+def profile_export(request, username):
+    author = get_object_or_404(User, username=username)
+    if request.user != author and not request.user.is_staff:
+        return redirect('profile', username)
+    file_format = request.GET.get('format', 'jsonl')
+    if file_format not in EXPORT_FORMATS:
+        file_format = 'jsonl'
+    content_type, extension = EXPORT_FORMATS[file_format]
+    try:
+        after_post = int(request.GET.get('after_post', 0))
+        after_comment = int(request.GET.get('after_comment', 0))
+    except ValueError:
+        after_post = after_comment = 0
+    response = StreamingHttpResponse(
+        export(author, file_format, after_post, after_comment),
+        content_type=content_type
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{author.username}.{extension}"'
+    )
+    return response
 
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    if is_sharded():
+        paginator, page = paginate(
+            request,
+            followed_posts(request.user),
+            count_cache_key('follow', request.user.id)
+        )
+    else:
+        entries = FeedEntry.objects.select_related(
+            'post__author',
+            'post__group'
+        ).filter(user=request.user).order_by('-pub_date', '-id')
+        paginator, page = paginate(
+            request,
+            entries,
+            count_cache_key('follow', request.user.id)
+        )
+        page.object_list = [entry.post for entry in page]
+    prefetch_cards(page)
     return render(
         request,
         'posts/follow.html',
@@ -121,6 +253,7 @@ def follow_index(request):
 
 
 @login_required
+@serialized_write
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author:
@@ -132,6 +265,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@serialized_write
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     follow_to_delete = Follow.objects.filter(
@@ -0,0 +1,259 @@
+"""
+Метрики запросов в формате Prometheus.
+
+MetricsMiddleware для каждого имени URL (index, profile, post, ...)
+копит в памяти процесса гистограммы длительности запроса, числа и
+времени SQL-запросов, времени рендеринга шаблонов и счётчики попаданий
+в кэш. metrics_view отдаёт их текстом для Prometheus. Каждый процесс
+считает своё, суммирует уже Prometheus.
+
+Накладные расходы - пара вызовов perf_counter на SQL-запрос, рендер и
+обращение к кэшу и один захват блокировки на запрос.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import Template
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+HISTOGRAMS = {
+    'yatube_request_duration_seconds': (
+        'Время ответа', DURATION_BUCKETS
+    ),
+    'yatube_sql_queries': ('SQL-запросов за запрос', COUNT_BUCKETS),
+    'yatube_sql_duration_seconds': (
+        'Время SQL за запрос', DURATION_BUCKETS
+    ),
+    'yatube_template_duration_seconds': (
+        'Время рендеринга шаблонов за запрос', DURATION_BUCKETS
+    ),
+}
+COUNTERS = {
+    'yatube_requests_total': 'Запросов по коду ответа',
+    'yatube_cache_requests_total': 'Обращений к кэшу: hit или miss',
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LOOPBACK_IPS = ('127.0.0.1', '::1')
+MISSING = object()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def record(self, view, stats, status):
+        values = {
+            'yatube_request_duration_seconds': stats.duration,
+            'yatube_sql_queries': stats.queries,
+            'yatube_sql_duration_seconds': stats.sql_time,
+            'yatube_template_duration_seconds': stats.template_time,
+        }
+        counters = {
+            ('yatube_requests_total', (('view', view), ('status', status))): 1,
+            ('yatube_cache_requests_total', (
+                ('view', view), ('result', 'hit')
+            )): stats.cache_hits,
+            ('yatube_cache_requests_total', (
+                ('view', view), ('result', 'miss')
+            )): stats.cache_misses,
+        }
+        with self.lock:
+            for name, value in values.items():
+                key = (name, view)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+                self.histograms[key].observe(value)
+            for key, value in counters.items():
+                if value:
+                    self.counters[key] = self.counters.get(key, 0) + value
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def render(self):
+        with self.lock:
+            histograms = sorted(
+                (key, list(histogram.counts), histogram.sum, histogram.count)
+                for key, histogram in self.histograms.items()
+            )
+            counters = sorted(self.counters.items())
+        lines = []
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (metric, view), counts, total, count in histograms:
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f'{name}_bucket{{view="{view}",le="{bound}"}} '
+                        f'{cumulative}'
+                    )
+                lines.append(f'{name}_sum{{view="{view}"}} {total}')
+                lines.append(f'{name}_count{{view="{view}"}} {count}')
+        for name, help_text in COUNTERS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for (metric, labels), value in counters:
+                if metric == name:
+                    label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f'{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+local = threading.local()
+
+
+class RequestStats:
+    def __init__(self):
+        self.duration = 0
+        self.queries = 0
+        self.sql_time = 0
+        self.template_time = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+
+
+def current_stats():
+    return getattr(local, 'stats', None)
+
+
+def instrument_templates():
+    """Считает время рендеринга верхнего уровня, без вложенных include."""
+    if getattr(Template, '_metrics_instrumented', False):
+        return
+    render = Template.render
+
+    def timed_render(self, *args, **kwargs):
+        stats = current_stats()
+        if stats is None:
+            return render(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            stats.template_time += time.perf_counter() - started
+
+    Template.render = timed_render
+    Template._metrics_instrumented = True
+
+
+def instrument_cache(cache_class):
+    """
+    Считает попадания и промахи get и get_many бэкенда кэша.
+
+    Вложенные вызовы (get_many через get у LocMemCache) не считаются
+    второй раз.
+    """
+    if getattr(cache_class, '_metrics_instrumented', False):
+        return
+    get = cache_class.get
+    get_many = cache_class.get_many
+
+    def counted_get(self, key, default=None, version=None):
+        stats = current_stats()
+        if stats is None or stats.depth:
+            return get(self, key, default, version)
+        stats.depth += 1
+        try:
+            value = get(self, key, MISSING, version)
+        finally:
+            stats.depth -= 1
+        if value is MISSING:
+            stats.cache_misses += 1
+            return default
+        stats.cache_hits += 1
+        return value
+
+    def counted_get_many(self, keys, version=None):
+        stats = current_stats()
+        if stats is None or stats.depth:
+            return get_many(self, keys, version)
+        keys = list(keys)
+        stats.depth += 1
+        try:
+            found = get_many(self, keys, version)
+        finally:
+            stats.depth -= 1
+        stats.cache_hits += len(found)
+        stats.cache_misses += len(keys) - len(found)
+        return found
+
+    cache_class.get = counted_get
+    cache_class.get_many = counted_get_many
+    cache_class._metrics_instrumented = True
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+        instrument_cache(type(caches['default']))
+
+    def __call__(self, request):
+        stats = RequestStats()
+        local.stats = stats
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            local.stats = None
+        stats.duration = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unresolved'
+        registry.record(view, stats, response.status_code)
+        return response
+
+
+def metrics_allowed(request):
+    """
+    Метрики отдаются только адресам из METRICS_ALLOWED_IPS, по умолчанию
+    локальным; открыть их всем можно только явно, через '*'.
+    """
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', None) or LOOPBACK_IPS
+    return '*' in allowed or request.META.get('REMOTE_ADDR') in allowed
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,110 @@
+"""
+Чтение с реплик.
+
+ReplicaMiddleware помечает GET и HEAD запросы как читающие, и
+ReplicaRouter отправляет их чтения на одну из баз DATABASE_REPLICAS.
+Всё остальное - запись, чтение внутри транзакции, команды и фоновые
+задачи - идёт в default. Клиент, который только что что-то записал,
+получает cookie и REPLICA_PIN_SECONDS читает с основной базы, поэтому
+видит свои изменения даже при отставании реплики. Столько же после
+изменения области страниц их читают с основной базы все (см.
+page_cache.read_generation), чтобы кэш не запомнил отставшую реплику.
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'pin_primary'
+REPLICA_PIN_SECONDS = 10
+READ_METHODS = ('GET', 'HEAD')
+# Отставшая реплика без свежей сессии разлогинила бы пользователя.
+PRIMARY_APPS = ('sessions',)
+
+local = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def lag_seconds():
+    """Сколько реплика может отставать от основной базы."""
+    return getattr(settings, 'REPLICA_PIN_SECONDS', REPLICA_PIN_SECONDS)
+
+
+def reading_from_replica():
+    return bool(replicas()) and getattr(local, 'use_replica', False)
+
+
+def use_primary():
+    """Остаток запроса читает с основной базы."""
+    local.use_replica = False
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not replicas():
+            return None
+        if (
+            not getattr(local, 'use_replica', False)
+            or model._meta.app_label in PRIMARY_APPS
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            # Явно, а не None: иначе связанные объекты читались бы из
+            # той базы, откуда загружен экземпляр, то есть с реплики.
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas())
+
+    def db_for_write(self, model, **hints):
+        # После записи в этом запросе читать её надо с основной базы.
+        local.use_replica = False
+        local.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплики получают схему вместе с данными.
+        return db not in replicas()
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        local.use_replica = (
+            request.method in READ_METHODS
+            and PIN_COOKIE not in request.COOKIES
+        )
+        local.wrote = False
+        try:
+            response = self.get_response(request)
+            if local.wrote:
+                response.set_cookie(
+                    PIN_COOKIE,
+                    '1',
+                    max_age=lag_seconds(),
+                    httponly=True
+                )
+            return response
+        finally:
+            local.use_replica = False
+            local.wrote = False
+
+
+def copy_database(target, source=DEFAULT_DB_ALIAS):
+    """
+    Копирует SQLite-базу source в target через online backup API.
+
+    Так на одном сервере и в тестах имитируется репликация: копия
+    согласована, а источник во время копирования остаётся доступен.
+    """
+    source_connection = connections[source]
+    target_connection = connections[target]
+    source_connection.ensure_connection()
+    target_connection.ensure_connection()
+    source_connection.connection.backup(target_connection.connection)
@@ -0,0 +1,57 @@
+"""
+Окружение тестов.
+
+Тесты не должны видеть страницы и поколения прошлых прогонов и сайта,
+поэтому у каждого прогона свой пустой файл кэша, который удаляется в
+конце. Миниатюры создаются в потоке запроса: фоновый поток гонялся бы
+с очисткой базы между тестами. Для manage.py test окружение включает
+TestRunner, для pytest - conftest.py.
+"""
+import copy
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.middleware import cache as middleware_cache
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+@receiver(setting_changed)
+def clear_middleware_caches(setting, **kwargs):
+    # debug_toolbar подменяет caches в django.middleware.cache своим
+    # CacheHandler, и override_settings(CACHES=...) сбрасывает только
+    # django.core.cache.caches: cache_page читал бы старый кэш.
+    if setting == 'CACHES':
+        middleware_cache.caches._caches = threading.local()
+
+
+@contextmanager
+def isolated_settings():
+    directory = tempfile.mkdtemp(prefix='yatube-cache-')
+    caches = copy.deepcopy(settings.CACHES)
+    caches['default']['LOCATION'] = os.path.join(directory, 'cache.sqlite3')
+    try:
+        with override_settings(
+            CACHES=caches,
+            THUMBNAILS_IN_BACKGROUND=False
+        ):
+            yield
+    finally:
+        shutil.rmtree(directory, True)
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.isolated_settings = isolated_settings()
+        self.isolated_settings.__enter__()
+
+    def teardown_test_environment(self, **kwargs):
+        self.isolated_settings.__exit__(None, None, None)
+        super().teardown_test_environment(**kwargs)
@@ -33,6 +33,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.metrics.MetricsMiddleware',
+    'yatube.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -40,6 +42,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'posts.slow_queries.SlowQueryMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
@@ -67,11 +70,35 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'yatube.sqlite_backend',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            # WAL: читатели не ждут писателя; NORMAL в WAL не теряет
+            # целостность, только последние транзакции при сбое питания.
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'busy_timeout': 5000,
+                'mmap_size': 256 * 1024 * 1024,
+                'cache_size': -20000,
+            },
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# Базы-реплики из DATABASES, с которых читают GET-запросы; пусто -
+# всё читается из default.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = [
+    'posts.sharding.ShardRouter',
+    'yatube.replicas.ReplicaRouter',
+]
+# Базы, по которым записи и комментарии раскладываются по авторам.
+POST_SHARDS = ['default']
+# Сколько секунд после записи клиент читает с основной базы.
+REPLICA_PIN_SECONDS = 10
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -90,10 +117,18 @@ AUTH_PASSWORD_VALIDATORS = [
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'yatube.sqlite_cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
     }
 }
 
+# Свой кэш и миниатюры в потоке запроса на время прогона тестов
+# (pytest подключает то же окружение в conftest.py).
+TEST_RUNNER = 'yatube.runner.TestRunner'
+
 LANGUAGE_CODE = 'ru'
 
 TIME_ZONE = 'UTC'
@@ -117,3 +152,16 @@ LOGIN_REDIRECT_URL = 'index'
 
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
+
+# False - миниатюры создаются сразу после коммита в потоке запроса.
+THUMBNAILS_IN_BACKGROUND = True
+
+# Адреса, которым доступен /internal/metrics/; ['*'] - всем, только явно.
+METRICS_ALLOWED_IPS = INTERNAL_IPS + ['::1']
+
+# Запросы дольше порога (мс) пишутся в журнал с планом; None - выключено.
+SLOW_QUERY_THRESHOLD_MS = 100
+SLOW_QUERY_LOG = os.path.join(BASE_DIR, 'logs', 'slow_queries.log')
+
+# Сколько раз повторять запись, получившую "database is locked".
+DATABASE_WRITE_RETRIES = 3
@@ -0,0 +1,37 @@
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Бэкенд sqlite3 с настройкой соединения из OPTIONS.
+
+    OPTIONS['pragmas'] - словарь PRAGMA, которые выполняются на каждом
+    новом соединении (journal_mode, synchronous, mmap_size, cache_size,
+    busy_timeout). OPTIONS['transaction_mode'] - чем начинается atomic:
+    с IMMEDIATE транзакция сразу берёт блокировку записи и ждёт её в
+    busy_timeout, а не получает "database is locked" посреди транзакции,
+    когда чтение пытается стать записью.
+    """
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas = self.settings_dict['OPTIONS'].get('pragmas', {})
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode is None:
+            return super()._start_transaction_under_autocommit()
+        if mode.upper() not in TRANSACTION_MODES:
+            raise ValueError(f'Неизвестный transaction_mode: {mode}')
+        self.cursor().execute(f'BEGIN {mode}')
@@ -0,0 +1,73 @@
+"""
+Сериализация записи в SQLite.
+
+SQLite пускает одного писателя за раз. Если несколько потоков одного
+процесса пишут одновременно, проигравшие крутятся в busy handler, который
+спит всё более длинными паузами, и время ответа растёт скачками.
+run_serialized ставит запись в очередь на блокировке процесса и
+выполняет её в одной транзакции, а "database is locked" от других
+процессов повторяет ограниченное число раз с нарастающей паузой.
+Сериализуется только сама запись: формы рендерятся и файлы сохраняются
+вне блокировки, иначе повтор сохранил бы файл второй раз.
+"""
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import (DEFAULT_DB_ALIAS, OperationalError, connections,
+                       transaction)
+
+WRITE_RETRIES = 3
+RETRY_DELAY = 0.05
+
+locks = {}
+locks_guard = threading.Lock()
+
+
+def write_lock(connection):
+    """Общая для потоков процесса блокировка файла базы."""
+    name = connection.settings_dict['NAME']
+    with locks_guard:
+        return locks.setdefault(name, threading.Lock())
+
+
+def is_locked_error(error):
+    return 'locked' in str(error) or 'busy' in str(error)
+
+
+def run_serialized(function, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    retries = getattr(settings, 'DATABASE_WRITE_RETRIES', WRITE_RETRIES)
+    delay = getattr(settings, 'DATABASE_RETRY_DELAY', RETRY_DELAY)
+    # Внутри чужой транзакции блокировка уже взята, а повтор её откатил
+    # бы только частично.
+    if connection.in_atomic_block:
+        return function()
+    lock = None
+    if connection.vendor == 'sqlite' and getattr(
+        settings, 'DATABASE_SERIALIZE_WRITES', True
+    ):
+        lock = write_lock(connection)
+    for attempt in range(retries + 1):
+        try:
+            if lock is None:
+                with transaction.atomic(using=using):
+                    return function()
+            with lock, transaction.atomic(using=using):
+                return function()
+        except OperationalError as error:
+            if attempt == retries or not is_locked_error(error):
+                raise
+        time.sleep(delay * 2 ** attempt)
+
+
+def serialized_write(view):
+    """
+    run_serialized для всего view - только для view, которые пишут и
+    перенаправляют, ничего не рендеря и не сохраняя файлов.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return run_serialized(lambda: view(request, *args, **kwargs))
+    return wrapper
@@ -0,0 +1,253 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SQLITE_MAX_VARIABLES = 900
+
+
+class SQLiteCache(BaseCache):
+    """
+    Общий для всех процессов кэш в одном SQLite-файле в режиме WAL.
+
+    LOCATION - путь к файлу. Читатели не блокируют писателя, incr и add
+    выполняются в BEGIN IMMEDIATE, поэтому атомарны между воркерами.
+    При превышении MAX_ENTRIES вытесняются давно не читанные ключи.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._busy_timeout = options.get('BUSY_TIMEOUT', 5)
+        self._touch_resolution = options.get('TOUCH_RESOLUTION', 1)
+        self._cull_every = options.get('CULL_EVERY', 50)
+        self._local = threading.local()
+
+    @property
+    def _connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = self._connect()
+            local.pid = os.getpid()
+            local.writes = 0
+        return local.connection
+
+    def _connect(self):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(
+            self._path,
+            timeout=self._busy_timeout,
+            isolation_level=None
+        )
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache_entries ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+            'expires REAL, accessed REAL NOT NULL)'
+        )
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS cache_entries_accessed '
+            'ON cache_entries (accessed)'
+        )
+        return connection
+
+    def _expired(self, expires, now):
+        return expires is not None and expires <= now
+
+    def _touch_rows(self, keys, now):
+        if keys:
+            self._connection.executemany(
+                'UPDATE cache_entries SET accessed = ? WHERE key = ?',
+                [(now, key) for key in keys]
+            )
+
+    def _fetch(self, keys):
+        rows = {}
+        for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            chunk = keys[start:start + SQLITE_MAX_VARIABLES]
+            cursor = self._connection.execute(
+                'SELECT key, value, expires, accessed FROM cache_entries '
+                'WHERE key IN (%s)' % ', '.join('?' * len(chunk)),
+                chunk
+            )
+            for key, value, expires, accessed in cursor:
+                rows[key] = (value, expires, accessed)
+        return rows
+
+    def _read(self, keys):
+        now = time.time()
+        found = {}
+        expired = []
+        stale = []
+        for key, (value, expires, accessed) in self._fetch(keys).items():
+            if self._expired(expires, now):
+                expired.append(key)
+                continue
+            found[key] = pickle.loads(value)
+            if now - accessed >= self._touch_resolution:
+                stale.append(key)
+        if expired:
+            self._delete(expired)
+        self._touch_rows(stale, now)
+        return found
+
+    def _write(self, rows, mode='REPLACE'):
+        connection = self._connection
+        now = time.time()
+        connection.executemany(
+            'INSERT OR %s INTO cache_entries (key, value, expires, accessed) '
+            'VALUES (?, ?, ?, ?)' % mode,
+            [
+                (key, pickle.dumps(value, self.pickle_protocol), expires, now)
+                for key, value, expires in rows
+            ]
+        )
+        self._local.writes += len(rows)
+        if self._local.writes >= self._cull_every:
+            self._local.writes = 0
+            self._cull(now)
+
+    def _cull(self, now):
+        connection = self._connection
+        connection.execute(
+            'DELETE FROM cache_entries WHERE expires <= ?',
+            (now,)
+        )
+        count = connection.execute(
+            'SELECT COUNT(*) FROM cache_entries'
+        ).fetchone()[0]
+        if count <= self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            connection.execute('DELETE FROM cache_entries')
+            return
+        connection.execute(
+            'DELETE FROM cache_entries WHERE key IN ('
+            'SELECT key FROM cache_entries ORDER BY accessed LIMIT ?)',
+            (max(count // self._cull_frequency, count - self._max_entries),)
+        )
+
+    def _delete(self, keys):
+        deleted = 0
+        for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            chunk = keys[start:start + SQLITE_MAX_VARIABLES]
+            deleted += self._connection.execute(
+                'DELETE FROM cache_entries WHERE key IN (%s)'
+                % ', '.join('?' * len(chunk)),
+                chunk
+            ).rowcount
+        return deleted
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        return self._read([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys_map = {self._key(key, version): key for key in keys}
+        found = self._read(list(keys_map))
+        return {keys_map[key]: value for key, value in found.items()}
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        row = self._connection.execute(
+            'SELECT expires FROM cache_entries WHERE key = ?',
+            (key,)
+        ).fetchone()
+        return row is not None and not self._expired(row[0], time.time())
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        self._write([(key, value, self.get_backend_timeout(timeout))])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        rows = [
+            (self._key(key, version), value, expires)
+            for key, value in data.items()
+        ]
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            self._write(rows)
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT expires FROM cache_entries WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is not None and not self._expired(row[0], time.time()):
+                connection.execute('ROLLBACK')
+                return False
+            self._write([(key, value, self.get_backend_timeout(timeout))])
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT value, expires FROM cache_entries WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is None or self._expired(row[1], time.time()):
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            connection.execute(
+                'UPDATE cache_entries SET value = ?, accessed = ? '
+                'WHERE key = ?',
+                (pickle.dumps(value, self.pickle_protocol), time.time(), key)
+            )
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        return bool(self._connection.execute(
+            'UPDATE cache_entries SET expires = ?, accessed = ? '
+            'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (
+                self.get_backend_timeout(timeout),
+                time.time(),
+                key,
+                time.time()
+            )
+        ).rowcount)
+
+    def delete(self, key, version=None):
+        self._delete([self._key(key, version)])
+
+    def delete_many(self, keys, version=None):
+        self._delete([self._key(key, version) for key in keys])
+
+    def clear(self):
+        self._connection.execute('DELETE FROM cache_entries')
@@ -0,0 +1,415 @@
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connections, transaction
+from django.db.utils import ConnectionHandler
+from django.test import (Client, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Post, User
+from yatube.metrics import registry
+from yatube.replicas import PIN_COOKIE, copy_database
+from yatube.sqlite_backend.writes import run_serialized
+from yatube.sqlite_cache import SQLiteCache
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21\xf9\x04'
+    b'\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02'
+    b'\x02\x4c\x01\x00\x3b'
+)
+
+
+def increment(location, times):
+    cache = SQLiteCache(location, {})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class TestSQLiteCache(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_set_get_delete(self):
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        self.assertTrue(self.cache.has_key('key'))
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+
+    def test_many(self):
+        self.cache.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(
+            self.cache.get_many(['a', 'c', 'missing']),
+            {'a': 1, 'c': 3}
+        )
+        self.cache.delete_many(['a', 'b'])
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'c': 3})
+
+    def test_expiry(self):
+        self.cache.set('short', 1, 0.05)
+        self.cache.set('forever', 1, None)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('short'))
+        self.assertEqual(self.cache.get('forever'), 1)
+        self.assertTrue(self.cache.add('short', 2))
+
+    def test_shared_between_instances(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(self.make_cache().get('key'), 'value')
+
+    def test_incr_is_atomic_across_processes(self):
+        self.cache.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=increment, args=(self.location, 50))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_least_recently_used_keys_are_evicted(self):
+        cache = self.make_cache(
+            MAX_ENTRIES=10,
+            CULL_FREQUENCY=2,
+            CULL_EVERY=1,
+            TOUCH_RESOLUTION=0
+        )
+        for i in range(10):
+            cache.set(f'key_{i}', i)
+        cache.get('key_0')
+        cache.set('key_10', 10)
+        self.assertEqual(cache.get('key_0'), 0)
+        self.assertIsNone(cache.get('key_1'))
+        self.assertEqual(cache.get('key_10'), 10)
+
+    def test_tests_use_their_own_cache_file(self):
+        location = settings.CACHES['default']['LOCATION']
+        self.assertNotEqual(
+            os.path.dirname(location),
+            settings.BASE_DIR,
+            msg='Тесты пишут в кэш сайта и видят прошлые прогоны'
+        )
+        self.assertTrue(location.startswith(tempfile.gettempdir()))
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        registry.clear()
+        cache.clear()
+        author = User.objects.create(username='Kane')
+        Post.objects.create(text='Лицехват', author=author)
+
+    def metrics(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        self.client.get(reverse('profile', args=['Kane']))
+        text = self.metrics()
+        self.assertIn(
+            'yatube_request_duration_seconds_count{view="index"} 2',
+            text
+        )
+        self.assertIn('yatube_sql_queries_count{view="profile"} 1', text)
+        self.assertIn(
+            'yatube_requests_total{view="index",status="200"} 2',
+            text
+        )
+        self.assertIn('yatube_request_duration_seconds_bucket{view="index",'
+                      'le="+Inf"} 2', text)
+        template_sum = [
+            line for line in text.splitlines()
+            if line.startswith('yatube_template_duration_seconds_sum'
+                               '{view="profile"}')
+        ]
+        self.assertGreater(float(template_sum[0].split()[1]), 0)
+
+    def test_cache_hits_and_misses(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        text = self.metrics()
+        self.assertIn(
+            'yatube_cache_requests_total{view="index",result="hit"}',
+            text
+        )
+        self.assertIn(
+            'yatube_cache_requests_total{view="index",result="miss"}',
+            text
+        )
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_endpoint_can_be_restricted(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_IPS=None)
+    def test_endpoint_is_local_by_default(self):
+        response = self.client.get(
+            reverse('metrics'),
+            REMOTE_ADDR='203.0.113.7'
+        )
+        self.assertEqual(
+            response.status_code,
+            403,
+            msg='Метрики по умолчанию открыты всем'
+        )
+        self.metrics()
+        with override_settings(METRICS_ALLOWED_IPS=['*']):
+            response = self.client.get(
+                reverse('metrics'),
+                REMOTE_ADDR='203.0.113.7'
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_endpoint_does_not_hide_user_named_metrics(self):
+        author = User.objects.create(username='metrics')
+        Post.objects.create(text='Я тоже автор', author=author)
+        response = self.client.get(reverse('profile', args=['metrics']))
+        self.assertContains(response, 'Я тоже автор')
+
+
+class TestSQLiteBackend(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tuned.sqlite3')
+        self.connection = ConnectionHandler({'default': {
+            'ENGINE': 'yatube.sqlite_backend',
+            'NAME': self.path,
+            'OPTIONS': {
+                'pragmas': {
+                    'journal_mode': 'WAL',
+                    'synchronous': 'NORMAL',
+                    'busy_timeout': 1234,
+                    'cache_size': -4000,
+                    'mmap_size': 1024 * 1024,
+                },
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }})['default']
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def pragma(self, name):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_applied(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('busy_timeout'), 1234)
+        self.assertEqual(self.pragma('cache_size'), -4000)
+        self.assertEqual(self.pragma('mmap_size'), 1024 * 1024)
+
+    def test_atomic_takes_write_lock_at_begin(self):
+        self.connection.ensure_connection()
+        other = sqlite3.connect(self.path, timeout=0, isolation_level=None)
+        try:
+            # Из-за IMMEDIATE блокировка записи берётся ещё до записи.
+            with mock.patch('django.db.transaction.connections',
+                            {'default': self.connection}):
+                with transaction.atomic():
+                    with self.assertRaises(sqlite3.OperationalError):
+                        other.execute('BEGIN IMMEDIATE')
+            other.execute('BEGIN IMMEDIATE')
+            other.execute('ROLLBACK')
+        finally:
+            other.close()
+
+
+class TestSerializedWrites(TransactionTestCase):
+    def test_locked_write_is_retried(self):
+        calls = []
+
+        def write():
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return User.objects.create(username='Ripley')
+
+        with override_settings(DATABASE_RETRY_DELAY=0):
+            user = run_serialized(write)
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(User.objects.filter(pk=user.pk).exists())
+
+    def test_retries_are_bounded(self):
+        calls = []
+
+        def write():
+            calls.append(1)
+            raise OperationalError('database is locked')
+
+        with override_settings(
+            DATABASE_RETRY_DELAY=0,
+            DATABASE_WRITE_RETRIES=2
+        ):
+            with self.assertRaises(OperationalError):
+                run_serialized(write)
+        self.assertEqual(len(calls), 3)
+
+    def test_form_pages_do_not_take_write_lock(self):
+        self.client.force_login(User.objects.create(username='Ash'))
+        post = Post.objects.create(text='Мать', author=User.objects.get())
+        with mock.patch(
+            'yatube.sqlite_backend.writes.write_lock',
+            side_effect=AssertionError('форма рендерится под блокировкой')
+        ):
+            for url in (
+                reverse('new_post'),
+                reverse('post_edit', args=['Ash', post.pk]),
+                reverse('add_comment', args=['Ash', post.pk]),
+            ):
+                with self.subTest(url=url):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_retry_does_not_store_upload_again(self):
+        self.client.force_login(User.objects.create(username='Ash'))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        save = Post.save
+        calls = []
+
+        def locked_once(post, *args, **kwargs):
+            # Блокировка случается уже после записи: транзакция откатится.
+            save(post, *args, **kwargs)
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+
+        image = SimpleUploadedFile('ash.gif', SMALL_GIF, 'image/gif')
+        with override_settings(DATABASE_RETRY_DELAY=0,
+                               MEDIA_ROOT=directory), \
+                mock.patch.object(Post, 'save', locked_once), \
+                mock.patch('posts.views.schedule_thumbnails'):
+            self.client.post(
+                reverse('new_post'),
+                {'text': 'Андроид', 'image': image}
+            )
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(Post.objects.get().text, 'Андроид')
+        self.assertEqual(
+            os.listdir(os.path.join(directory, 'posts')),
+            ['ash.gif'],
+            msg='Повтор записи сохранил картинку ещё раз'
+        )
+
+    def test_other_errors_are_not_retried(self):
+        calls = []
+
+        def write():
+            calls.append(1)
+            raise OperationalError('no such table: nowhere')
+
+        with self.assertRaises(OperationalError):
+            run_serialized(write)
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(
+    DATABASE_REPLICAS=['replica'],
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+    }}
+)
+class TestReadReplicas(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        connections.databases['replica'] = dict(
+            connections.databases['default'],
+            NAME=os.path.join(self.directory, 'replica.sqlite3'),
+            OPTIONS={}
+        )
+        self.author = User.objects.create_user(username='Bishop')
+        User.objects.create_user(username='Ripley')
+        Post.objects.create(text='Реплицированная запись', author=self.author)
+        copy_database('replica')
+        Post.objects.create(text='Только на основной базе', author=self.author)
+        self.client = Client()
+        self.client.force_login(self.author)
+        # Вход сам по себе запись: начинаем без привязки к основной базе.
+        self.client.cookies.pop(PIN_COOKIE, None)
+
+    def tearDown(self):
+        connections['replica'].close()
+        del connections.databases['replica']
+        delattr(connections._connections, 'replica')
+        shutil.rmtree(self.directory)
+
+    def profile(self):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get(reverse('profile', args=['Bishop']))
+        return response.content.decode(), len(queries)
+
+    def test_reads_go_to_replica(self):
+        content, queries = self.profile()
+        self.assertGreater(queries, 0)
+        self.assertIn('Реплицированная запись', content)
+        self.assertNotIn('Только на основной базе', content)
+
+    def test_writer_reads_own_writes(self):
+        response = self.client.post(
+            reverse('new_post'),
+            {'text': 'Свежая запись'}
+        )
+        self.assertIn(PIN_COOKIE, response.cookies)
+        content, queries = self.profile()
+        self.assertEqual(queries, 0)
+        self.assertIn('Свежая запись', content)
+
+    def test_write_in_get_request_pins_to_primary(self):
+        response = self.client.get(reverse('profile_follow', args=['Ripley']))
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'replicas',
+    }})
+    def test_recent_changes_are_read_from_primary(self):
+        content, queries = self.profile()
+        self.assertGreater(queries, 0)
+        Post.objects.create(text='Свежая правка', author=self.author)
+        content, queries = self.profile()
+        self.assertEqual(
+            queries,
+            0,
+            msg='Сразу после изменения страница собрана с реплики'
+        )
+        self.assertIn('Свежая правка', content)
+
+    def test_without_replicas_everything_reads_default(self):
+        with override_settings(DATABASE_REPLICAS=[]):
+            content, queries = self.profile()
+        self.assertEqual(queries, 0)
+        self.assertIn('Только на основной базе', content)
@@ -5,6 +5,8 @@ from django.contrib import admin
 from django.contrib.flatpages import views
 from django.urls import include, path
 
+from yatube.metrics import metrics_view
+
 urlpatterns = [
     path('GothamAdminMaster/', admin.site.urls),
     path('auth/', include('users.urls')),
@@ -24,6 +26,8 @@ urlpatterns = [
         {'url': '/about-spec/'},
         name='spec'
     ),
+    # Не в корне: /metrics/ - страница пользователя metrics.
+    path('internal/metrics/', metrics_view, name='metrics'),
     path('', include('posts.urls')),
 ]
 